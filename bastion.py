@@ -0,0 +1,219 @@
+# bastion.py
+# 踏み台ホスト (ProxyJump) 経由の接続。踏み台への認証済みの接続を1本だけ張って共有し、
+# 各ホストへの接続はその上の direct-tcpip チャンネルとして開く
+import json
+import threading
+
+import channel_reader
+import connection_pool
+
+# 1つの踏み台で同時に開くチャンネル (踏み台経由の接続) の最大数のデフォルト値
+# (OpenSSH の MaxSessions の既定値に合わせる)
+DEFAULT_MAX_CHANNELS = 10
+
+_jump_hosts = {}  # connection_pool.make_key() のキー -> JumpHost
+_jump_hosts_lock = threading.Lock()
+
+
+def parse_jump(text, default_port=22, default_user=None):
+    """
+    "[user@]host[:port]" 形式の踏み台の指定を {'host', 'port', 'user'} の辞書にする。
+    IPv6アドレスにポートを付ける場合は "[addr]:port" と記述する。
+
+    Raises:
+        ValueError: 書式やポート番号が無効な場合、ユーザー名が決まらない場合。
+    """
+    text = text.strip()
+    user, sep, address = text.rpartition('@')
+    if not sep:
+        user = default_user
+    host, port = address, default_port
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        if rest.startswith(':'):
+            port = rest[1:]
+    elif address.count(':') == 1:
+        host, port = address.split(':')
+    try:
+        port = int(port)
+        if not 1 <= port <= 65535:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"踏み台のポート番号が無効です: {text}")
+    if not host:
+        raise ValueError(f"踏み台のホストが指定されていません: {text}")
+    if not user:
+        raise ValueError(f"踏み台のユーザー名が指定されていません: {text}")
+    return {'host': host, 'port': port, 'user': user}
+
+
+class _TunnelSocket:
+    """
+    direct-tcpip チャンネルを paramiko.Transport のソケットとして使うためのラッパー。
+    閉じたときに (Transport の終了時に呼ばれる) 踏み台のチャンネル数の枠を返す。
+    """
+
+    def __init__(self, channel, release):
+        self._channel = channel
+        self._release = release
+        self._release_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def close(self):
+        self._channel.close()
+        with self._release_lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class JumpHost:
+    """
+    複数の接続で共有する踏み台ホストへの接続。
+
+    踏み台への接続 (鍵交換と認証) は最初に必要になったときに1回だけ行い、
+    各ホストへの接続はその上の direct-tcpip チャンネルとして開く。
+    同時に開くチャンネルの数は max_channels に制限し、空きがない場合は空くまで待つ。
+    踏み台への接続が切れていた場合は、次にチャンネルを開くときに再接続する。
+    auth には踏み台の認証とホスト鍵の確認のオプション (ssh_executor.open_transport の
+    key_files / use_agent / passphrase / host_key_policy) を指定できる。
+    """
+
+    def __init__(self, host, port, user, pwd, profile=None, max_channels=DEFAULT_MAX_CHANNELS,
+                 **auth):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.max_channels = max_channels
+        self.connect_count = 0  # 踏み台に接続 (再接続を含む) した回数
+        self._pwd = pwd
+        self._profile = profile
+        self._auth = auth
+        self._transport = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_channels)
+
+    @property
+    def label(self):
+        return f"{self.user}@{self.host}:{self.port}"
+
+    def _connect(self, timeout, log_queue):
+        # ロックを保持した状態で呼び出すこと
+        import paramiko
+        import ssh_executor
+
+        if self._transport is not None:
+            self._transport.close()
+            if log_queue is not None:
+                log_queue.put(f"踏み台 {self.label} への接続が切れていたため再接続します...")
+        elif log_queue is not None:
+            log_queue.put(f"踏み台 {self.label} に接続します...")
+        self._transport = None
+        try:
+            transport = ssh_executor.open_transport(self.host, self.port, self.user, self._pwd,
+                                                    timeout=timeout, profile=self._profile,
+                                                    **self._auth)
+        except Exception as e:
+            raise paramiko.SSHException(f"踏み台 {self.label} に接続できません: {e}") from e
+        transport.set_keepalive(connection_pool.DEFAULT_KEEPALIVE_INTERVAL)
+        self._transport = transport
+        self.connect_count += 1
+        return transport
+
+    def _get_transport(self, timeout, log_queue, failed=None):
+        """
+        踏み台への接続を返す。切断されている場合、または failed (チャンネルを開けなかった接続)
+        がまだ使われている場合は再接続する。
+        """
+        with self._lock:
+            transport = self._transport
+            if transport is None or not transport.is_active() or transport is failed:
+                transport = self._connect(timeout, log_queue)
+            return transport
+
+    def _wait_slot(self, cancel_event):
+        """チャンネル数の枠が空くまで待つ。待っている間に cancel_event がセットされたら False"""
+        while not self._slots.acquire(timeout=channel_reader.CANCEL_CHECK_INTERVAL):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+        return True
+
+    def open_socket(self, host, port, timeout, cancel_event=None, log_queue=None):
+        """
+        踏み台から host:port への direct-tcpip チャンネルを開き、paramiko.Transport に
+        ソケットとして渡せるオブジェクトを返す。チャンネル数の枠が空くのを待つ間に
+        cancel_event (is_set() を持つオブジェクト) がセットされた場合は None を返す。
+
+        Raises:
+            paramiko.SSHException: 踏み台に接続できない場合。
+            OSError: 踏み台から接続先に接続できない場合。
+        """
+        import paramiko
+
+        if not self._wait_slot(cancel_event):
+            return None
+        try:
+            transport = self._get_transport(timeout, log_queue)
+            try:
+                channel = transport.open_channel(
+                    'direct-tcpip', (host, port), ('127.0.0.1', 0), timeout=timeout)
+            except paramiko.ChannelException as e:
+                # 踏み台からの接続先への接続の失敗 (踏み台への接続は正常)
+                raise OSError(f"踏み台 {self.label} から {host}:{port} に接続できません: "
+                              f"{e.text}") from e
+            except (paramiko.SSHException, EOFError, OSError):
+                if transport.is_active():
+                    raise
+                # チャンネルを開く途中で踏み台への接続が切れた場合は一度だけ再接続する
+                transport = self._get_transport(timeout, log_queue, failed=transport)
+                channel = transport.open_channel(
+                    'direct-tcpip', (host, port), ('127.0.0.1', 0), timeout=timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+        return _TunnelSocket(channel, self._slots.release)
+
+    def __reduce__(self):
+        # 別のプロセス (sharded_executor) に渡した場合は、そのプロセスの共有の JumpHost になる
+        spec = {'host': self.host, 'port': self.port, 'user': self.user}
+        return _restore_jump_host, (spec, self._pwd, self._profile, self.max_channels, self._auth)
+
+    def close(self):
+        with self._lock:
+            transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+
+
+def get_jump_host(spec, pwd, profile=None, max_channels=DEFAULT_MAX_CHANNELS, **auth):
+    """
+    踏み台の指定 (parse_jump() の辞書) に対応する JumpHost を返す。
+    同じ踏み台・ユーザー・認証情報・転送設定 (の内容)・チャンネル数の上限の JumpHost は1つだけ作り、
+    複数の実行 (GUIでの繰り返しの実行を含む) で共有する。
+    """
+    # 同じ名前でも内容が変更された転送設定の JumpHost は使い回さない (connection_pool と同じ)
+    key = connection_pool.make_key(spec['host'], spec['port'], spec['user'], pwd,
+                                   json.dumps(profile, sort_keys=True) if profile else None,
+                                   auth.get('key_files', ()), auth.get('use_agent', False))
+    key += (auth.get('host_key_policy'), max_channels)
+    with _jump_hosts_lock:
+        jump_host = _jump_hosts.get(key)
+        if jump_host is None:
+            jump_host = _jump_hosts[key] = JumpHost(
+                spec['host'], spec['port'], spec['user'], pwd, profile, max_channels, **auth)
+        return jump_host
+
+
+def _restore_jump_host(spec, pwd, profile, max_channels, auth):
+    return get_jump_host(spec, pwd, profile, max_channels, **auth)
+
+
+def close_all():
+    """共有している全ての踏み台への接続を閉じる。アプリケーション終了時に呼び出す。"""
+    with _jump_hosts_lock:
+        jump_hosts = list(_jump_hosts.values())
+        _jump_hosts.clear()
+    for jump_host in jump_hosts:
+        jump_host.close()
@@ -0,0 +1,297 @@
+# bench_executor.py
+"""
+ssh_executor.execute_ssh_commands のベンチマーク。
+
+benchmarks/fake_ssh_server.py の簡易SSHサーバーをプロセス内で起動し、
+以下を計測する (実機のボードは不要)。
+
+    接続時間       TCP接続・鍵交換・認証 (open_transport) にかかる時間
+    コマンドごとの時間  出力のないコマンドを連続実行したときの1コマンドあたりの時間
+    出力スループット  大量の出力を受信したときの MB/s と 行/s
+    ファイル転送     upload / download ステップの MB/s (SFTPClient.put / get との比較)
+    停止までの時間   実行中に停止要求を出してから関数が戻るまでの時間
+    公開鍵認証      秘密鍵ファイルで認証したときの接続時間 (鍵の読み込みは初回のみ)
+    踏み台経由      踏み台を共有して複数ホストに接続したときの時間と踏み台への接続回数
+
+使い方:
+    python benchmarks/bench_executor.py
+    python benchmarks/bench_executor.py --commands 200 --mb 64 --line 120
+"""
+import argparse
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bastion  # noqa: E402
+import config_manager  # noqa: E402
+import connection_pool  # noqa: E402
+import ssh_auth  # noqa: E402
+import ssh_executor  # noqa: E402
+from fake_ssh_server import FakeSSHServer  # noqa: E402
+
+# 停止要求から戻るまでの待ち時間の上限 (秒)
+CANCEL_TIMEOUT = 10
+
+
+class _LogCounter:
+    """GUIの代わりにログキューを読み出し、行数を数えるスレッド"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.count = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            self.count += 1
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+# 計測に使う転送設定 (main() で --profile から設定する)
+transport_profile = None
+# 簡易SSHサーバーのホスト鍵は起動のたびに変わるため、known_hosts には登録しない
+HOST_KEY_POLICY = ssh_auth.POLICY_OFF
+
+
+def run(server, commands, pool=None, cancel_event=None, **options):
+    """コマンドリストを実行し、(結果, 所要時間[秒], ログ行数) を返す"""
+    logs = _LogCounter()
+    cancel_event = cancel_event or threading.Event()
+    start = time.perf_counter()
+    result = ssh_executor.execute_ssh_commands(
+        '127.0.0.1', server.port, server.username, server.password, commands,
+        logs.queue, queue.SimpleQueue(), cancel_event, pool=pool,
+        transport_profile=transport_profile, journal=False, host_key_policy=HOST_KEY_POLICY,
+        **options)
+    elapsed = time.perf_counter() - start
+    logs.stop()
+    if result['status'] not in (ssh_executor.STATUS_DONE, ssh_executor.STATUS_STOPPED):
+        raise RuntimeError(f"実行に失敗しました: {result}")
+    return result, elapsed, logs.count
+
+
+def bench_connect(server, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transport = ssh_executor.open_transport(
+            '127.0.0.1', server.port, server.username, server.password,
+            profile=transport_profile, host_key_policy=HOST_KEY_POLICY)
+        timings.append((time.perf_counter() - start) * 1000)
+        description = ssh_executor.describe_transport(transport)
+        transport.close()
+    timings.sort()
+    print(f"接続時間            : 中央値 {timings[len(timings) // 2]:7.1f} ms"
+          f" / 最小 {timings[0]:7.1f} ms ({repeat} 回)")
+    print(f"  {description}")
+
+
+def bench_per_command(server, pool, count):
+    commands = [{'command': 'emit bytes=0'} for _ in range(count)]
+    run(server, commands[:1], pool)  # 接続をプールに用意しておく
+    _, elapsed, _ = run(server, commands, pool)
+    print(f"コマンドごとの時間  : {elapsed / count * 1000:7.2f} ms/コマンド ({count} コマンド)")
+    if server.allow_subprocess:
+        commands = [{'command': 'true'} for _ in range(count)]
+        _, elapsed, _ = run(server, commands, pool, pipelined=True)
+        print(f"  一括送信モード    : {elapsed / count * 1000:7.2f} ms/コマンド (true, シェル起動を含む)")
+
+
+def bench_throughput(server, pool, megabytes, line_length):
+    total = megabytes * 1024 * 1024
+    commands = [{'command': f'emit bytes={total} line={line_length}'}]
+    lines = total // line_length
+    # 既定 (出力をスプールファイルに保存し、ログは先頭と末尾のみ) と全行をログに送る場合
+    for label, capture_output in (("出力スループット    ", True), ("  全行をログに表示  ", False)):
+        result, elapsed, log_lines = run(server, commands, pool, capture_output=capture_output)
+        print(f"{label}: {megabytes / elapsed:7.1f} MB/s,"
+              f" {lines / elapsed:10,.0f} 行/s ({megabytes} MB, 1行 {line_length} バイト,"
+              f" ログ {log_lines:,} 行)")
+        if capture_output:
+            saved_lines = result['outputs'][0].line_count
+            result['spool'].close()
+        else:
+            saved_lines = log_lines
+        if saved_lines < lines:
+            print(f"  [警告] 保存された行数が不足しています ({saved_lines} < {lines})")
+
+
+def bench_transfer(server, pool, megabytes):
+    """upload / download ステップと paramiko の SFTPClient.put / get を比較する"""
+    import paramiko
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local = os.path.join(tmpdir, 'local.bin')
+        with open(local, 'wb') as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+        remote = os.path.join(tmpdir, 'remote.bin')
+        fetched = os.path.join(tmpdir, 'fetched.bin')
+
+        transport = ssh_executor.open_transport(
+            '127.0.0.1', server.port, server.username, server.password,
+            profile=transport_profile, host_key_policy=HOST_KEY_POLICY)
+        sftp = paramiko.SFTPClient.from_transport(transport)
+        start = time.perf_counter()
+        sftp.put(local, remote)
+        put_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        sftp.get(remote, fetched)
+        get_elapsed = time.perf_counter() - start
+        sftp.close()
+        transport.close()
+        os.remove(remote)
+        os.remove(fetched)
+
+        upload = [{'upload': {'src': local, 'dest': remote}}]
+        download = [{'download': {'src': remote, 'dest': fetched}}]
+        _, upload_elapsed, _ = run(server, upload, pool)
+        _, download_elapsed, _ = run(server, download, pool)
+        _, skip_elapsed, _ = run(server, upload, pool)
+    print(f"ファイル転送        : upload {megabytes / upload_elapsed:7.1f} MB/s"
+          f" (SFTPClient.put {megabytes / put_elapsed:7.1f} MB/s),"
+          f" download {megabytes / download_elapsed:7.1f} MB/s"
+          f" (SFTPClient.get {megabytes / get_elapsed:7.1f} MB/s)")
+    print(f"  変更なしでスキップ: {skip_elapsed * 1000:7.1f} ms ({megabytes} MB)")
+
+
+def bench_cancel(server, pool):
+    commands = [{'command': f'sleep seconds={CANCEL_TIMEOUT * 3}'}]
+    run(server, [{'command': 'emit bytes=0'}], pool)
+    cancel_event = threading.Event()
+    done = threading.Event()
+    stopped_at = []
+
+    def worker():
+        run(server, commands, pool, cancel_event)
+        stopped_at.append(time.perf_counter())
+        done.set()
+
+    threading.Thread(target=worker, daemon=True).start()
+    time.sleep(0.3)  # コマンドが実行中になるのを待つ
+    requested_at = time.perf_counter()
+    cancel_event.set()
+    if done.wait(CANCEL_TIMEOUT):
+        print(f"停止までの時間      : {(stopped_at[0] - requested_at) * 1000:7.1f} ms")
+    else:
+        print(f"停止までの時間      : {CANCEL_TIMEOUT} 秒以内に停止しませんでした")
+
+    # コマンドの timeout 指定: 指定時間を過ぎてから打ち切られるまでの遅れ
+    step_timeout = 0.5
+    commands = [{'command': f'sleep seconds={CANCEL_TIMEOUT * 3}', 'timeout': step_timeout}]
+    result, elapsed, _ = run(server, commands, pool)
+    print(f"  タイムアウト      : {(elapsed - step_timeout) * 1000:7.1f} ms"
+          f" (timeout {step_timeout} 秒, 終了コード {result['exit_codes'].get(0)})")
+
+
+def bench_publickey(server, repeat):
+    """秘密鍵ファイルで認証したときの接続時間 (初回は鍵の読み込みを含む)"""
+    import paramiko
+
+    key = paramiko.RSAKey.generate(2048)
+    server.authorized_keys.append(key)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'id_rsa')
+        key.write_private_key_file(path)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            transport = ssh_executor.open_transport(
+                '127.0.0.1', server.port, server.username, None, profile=transport_profile,
+                key_files=[path], host_key_policy=HOST_KEY_POLICY)
+            timings.append((time.perf_counter() - start) * 1000)
+            auth_method = transport.auth_method
+            transport.close()
+    server.authorized_keys.remove(key)
+    first, rest = timings[0], sorted(timings[1:]) or timings
+    print(f"公開鍵認証          : 中央値 {rest[len(rest) // 2]:7.1f} ms"
+          f" / 初回 {first:7.1f} ms ({repeat} 回, 認証方法 {auth_method})")
+
+
+def bench_jump(server, hosts, max_channels):
+    """踏み台 (別の簡易SSHサーバー) を経由して hosts 回の実行を並列に行う"""
+    with FakeSSHServer(allow_forwarding=True) as jump_server:
+        jump = bastion.JumpHost('127.0.0.1', jump_server.port, jump_server.username,
+                                jump_server.password, max_channels=max_channels,
+                                host_key_policy=HOST_KEY_POLICY)
+        commands = [{'command': 'emit bytes=1000 line=100'}]
+        try:
+            elapsed = {}
+            for label, options in (('直接接続', {}), ('踏み台経由', {'jump': jump})):
+                threads = [threading.Thread(target=run, args=(server, commands), kwargs=options)
+                           for _ in range(hosts)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed[label] = time.perf_counter() - start
+            print(f"踏み台経由 ({hosts} 接続, 同時 {max_channels} チャンネル):")
+            for label, seconds in elapsed.items():
+                print(f"  {label}: {seconds * 1000:7.1f} ms")
+            print(f"  踏み台への接続回数: {jump.connect_count} 回")
+
+            # 踏み台側で接続が切れた後の実行は、自動的に再接続して成功すること
+            for transport in list(jump_server._transports):
+                transport.close()
+            time.sleep(0.1)
+            start = time.perf_counter()
+            run(server, commands, jump=jump)
+            print(f"  切断後の再接続: {(time.perf_counter() - start) * 1000:7.1f} ms"
+                  f" (踏み台への接続回数: {jump.connect_count} 回)")
+        finally:
+            jump.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ssh_executor を簡易SSHサーバーに対して計測します。")
+    parser.add_argument('--connects', type=int, default=10, help="接続時間の計測回数")
+    parser.add_argument('--commands', type=int, default=100, help="連続実行するコマンド数")
+    parser.add_argument('--mb', type=int, default=32, help="出力スループット計測の出力量 (MB)")
+    parser.add_argument('--line', type=int, default=80, help="1行のバイト数")
+    parser.add_argument('--transfer-mb', type=int, default=128,
+                        help="ファイル転送の計測に使うファイルサイズ (MB)。0 で計測しない")
+    parser.add_argument('--profile', default=config_manager.DEFAULT_TRANSPORT_PROFILE,
+                        help="転送設定の名前 (config_manager を参照)")
+    parser.add_argument('--skip-cancel', action='store_true', help="停止までの時間を計測しない")
+    parser.add_argument('--jump-hosts', type=int, default=40,
+                        help="踏み台経由で接続する回数。0 で計測しない")
+    parser.add_argument('--jump-channels', type=int, default=bastion.DEFAULT_MAX_CHANNELS,
+                        help="踏み台の同時チャンネル数の上限")
+    args = parser.parse_args(argv)
+
+    global transport_profile
+    transport_profile = config_manager.get_transport_profile(args.profile)
+    print(f"転送設定: {args.profile} {transport_profile}")
+    pool = connection_pool.ConnectionPool()
+    with FakeSSHServer(allow_subprocess=os.name == 'posix') as server:
+        try:
+            bench_connect(server, args.connects)
+            bench_publickey(server, args.connects)
+            bench_per_command(server, pool, args.commands)
+            bench_throughput(server, pool, args.mb, args.line)
+            if args.transfer_mb and server.allow_subprocess:
+                bench_transfer(server, pool, args.transfer_mb)
+            if not args.skip_cancel:
+                bench_cancel(server, pool)
+            if args.jump_hosts:
+                bench_jump(server, args.jump_hosts, args.jump_channels)
+        finally:
+            pool.close_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
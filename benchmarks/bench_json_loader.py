@@ -0,0 +1,71 @@
+# bench_json_loader.py
+"""
+コマンドファイルの読み込みを計測するベンチマーク。
+
+json.load でファイル全体を読み込む従来の方法と、json_loader の
+ストリーミング読み込み (初回) およびキャッシュ済みの再読み込みを比較する。
+
+使い方:
+    python benchmarks/bench_json_loader.py
+    python benchmarks/bench_json_loader.py --entries 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_loader  # noqa: E402
+
+REPEAT = 3
+
+
+def legacy_load(filepath):
+    """従来と同じ方法 (json.load でファイル全体を読み込んでから検証) で読み込む"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return json_loader.CommandList(
+        [json_loader._validate_item(i, item) for i, item in enumerate(data)])
+
+
+def measure(label, load):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        load()
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label}: {min(timings):9.2f} ms, ピークメモリ {peak / 1024 / 1024:7.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="コマンドファイルの読み込みを計測します。")
+    parser.add_argument('--entries', type=int, default=50000, help="コマンドの件数")
+    args = parser.parse_args(argv)
+
+    commands = [{'command': f"echo step {i} && test -d /tmp/work-{i % 97}",
+                 'description': f"手順 {i}"} for i in range(args.entries)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'commands.json')
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(commands, f, ensure_ascii=False, indent=2)
+        size_mb = os.path.getsize(filepath) / 1024 / 1024
+        print(f"{args.entries} 件, {size_mb:.1f} MB")
+
+        measure("json.load (従来)", lambda: legacy_load(filepath))
+        measure("ストリーミング読み込み",
+                lambda: json_loader.load_commands_from_json(filepath, use_cache=False))
+        json_loader.load_commands_from_json(filepath)
+        measure("キャッシュ済み", lambda: json_loader.load_commands_from_json(filepath))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
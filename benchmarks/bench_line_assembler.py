@@ -0,0 +1,89 @@
+# bench_line_assembler.py
+"""
+LineAssembler と従来の read_stream の行分割処理を比較するマイクロベンチマーク。
+
+使い方:
+    python benchmarks/bench_line_assembler.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from line_assembler import LineAssembler  # noqa: E402
+
+CHUNK_SIZE = 4096
+
+
+def legacy_split(chunks):
+    """従来の read_stream と同じ方法 (buffer += chunk と split) で行に分割する"""
+    lines = []
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            lines.append(line.decode(errors='replace'))
+    if buffer:
+        lines.append(buffer.decode(errors='replace'))
+    return lines
+
+
+def assembler_split(chunks, raw=False):
+    """LineAssembler で行に分割する (raw=True はデコードせずバイト列のまま)"""
+    assembler = LineAssembler(raw=raw)
+    lines = []
+    for chunk in chunks:
+        lines.extend(assembler.feed(chunk))
+    rest = assembler.flush()
+    if rest:
+        lines.append(rest)
+    return lines
+
+
+def make_chunks(data):
+    return [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def bench(name, func, chunks, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    total = sum(len(c) for c in chunks)
+    print(f"  {name:<10} {best * 1000:9.1f} ms  {total / best / 1e6:8.1f} MB/s")
+    return best
+
+
+def main():
+    scenarios = {
+        # 短い行が大量に含まれる出力 (apt upgrade のようなログ)
+        "短い行 x 200000": b''.join(b"line %d\n" % i for i in range(200000)),
+        # 改行を含まない巨大な出力
+        "改行なし 2 MiB": b'x' * (2 * 1024 * 1024),
+        # チャンク境界でマルチバイト文字が分断される出力
+        "マルチバイト": ("日本語のログ出力です。\n" * 20000).encode('utf-8'),
+    }
+    for title, data in scenarios.items():
+        chunks = make_chunks(data)
+        print(f"{title} ({len(data) / 1e6:.1f} MB, {len(chunks)} chunks)")
+        legacy = bench("legacy", legacy_split, chunks, repeat=1)
+        current = bench("assembler", assembler_split, chunks)
+        print(f"  speedup    {legacy / current:9.1f} x")
+        raw = bench("raw", lambda c: assembler_split(c, raw=True), chunks)
+        print(f"  speedup    {legacy / raw:9.1f} x (デコードなし)")
+
+    # マルチバイト文字がチャンク境界で壊れないことを確認
+    text = "日本語のログ出力です。\n" * 100
+    data = text.encode('utf-8')
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    assert assembler_split(chunks) == text.splitlines()
+    assert assembler_split(chunks, raw=True) == data.splitlines()
+    print("マルチバイト文字の境界処理: OK")
+
+
+if __name__ == '__main__':
+    main()
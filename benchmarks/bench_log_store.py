@@ -0,0 +1,67 @@
+# bench_log_store.py
+"""
+ログ表示欄の保存先 (log_store.LogStore) への追記と、絞り込み・文字列検索の速度を計測するベンチマーク。
+
+多数のホストのコマンド出力 (1行ずつの LogRecord) を追記し、
+ホスト + コマンド + stderr の絞り込み、重要度の絞り込み、文字列検索にかかる時間を計測する。
+
+使い方:
+    python benchmarks/bench_log_store.py
+    python benchmarks/bench_log_store.py --hosts 500 --steps 40 --lines 2000000 --memory
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_record  # noqa: E402
+import log_store  # noqa: E402
+
+
+def make_records(hosts, steps, lines, line_length):
+    records = []
+    payload = b'x' * line_length
+    for i in range(lines):
+        stream = log_record.STREAM_STDERR if i % 47 == 0 else log_record.STREAM_STDOUT
+        data = payload + b' error' if i % 997 == 0 else payload
+        records.append(log_record.LogRecord(stream, data, (i // hosts) % steps, f"board-{i % hosts}"))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ログ表示欄の絞り込みと検索を計測します。")
+    parser.add_argument('--hosts', type=int, default=200, help="ホスト数")
+    parser.add_argument('--steps', type=int, default=20, help="コマンド数")
+    parser.add_argument('--lines', type=int, default=1000000, help="全体の行数")
+    parser.add_argument('--line', type=int, default=80, help="1行のバイト数")
+    parser.add_argument('--memory', action='store_true', help="本文を一時ファイルではなくメモリに保持する")
+    args = parser.parse_args(argv)
+
+    records = make_records(args.hosts, args.steps, args.lines, args.line)
+    store = log_store.LogStore(on_disk=not args.memory)
+    start = time.perf_counter()
+    store.extend(records)
+    elapsed = time.perf_counter() - start
+    print(f"追記: {len(store):,} 行, {elapsed * 1000:.0f} ms ({len(store) / elapsed:,.0f} 行/s)")
+
+    host = f"board-{args.hosts // 2 + 1}"
+    queries = (
+        ("ホスト + コマンド + stderr", dict(host=host, step=args.steps // 2, stream=log_record.STREAM_STDERR)),
+        ("ホスト", dict(host=host)),
+        ("エラー以上", dict(severity=log_store.SEVERITY_ERROR)),
+        ("文字列検索", dict(search="error")),
+        ("ホスト + 文字列検索", dict(host=host, search="error")),
+    )
+    for label, criteria in queries:
+        start = time.perf_counter()
+        view = log_store.LogView(store, **criteria)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<20}: {elapsed * 1000:8.1f} ms ({len(view):,} 行)")
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# bench_run_log.py
+"""
+実行ログファイル (log_record.RunLogWriter) の書き込みと、read_run_log() での
+絞り込みの速度を JSONL 形式とバイナリ形式で比較するベンチマーク。
+
+多数のホストのコマンド出力 (1行ずつの LogRecord) を生成して書き込み、
+1台のホストの stderr だけを読み出す時間を計測する。
+
+使い方:
+    python benchmarks/bench_run_log.py
+    python benchmarks/bench_run_log.py --hosts 1000 --lines 500 --line 120
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_record  # noqa: E402
+
+
+def make_records(hosts, lines, line_length):
+    records = []
+    payload = b'x' * line_length
+    for i in range(lines):
+        for h in range(hosts):
+            stream = log_record.STREAM_STDERR if i % 50 == 0 else log_record.STREAM_STDOUT
+            records.append(log_record.LogRecord(stream, payload, 0, f"host-{h:04d}"))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="実行ログファイルの書き込みと絞り込みを計測します。")
+    parser.add_argument('--hosts', type=int, default=200, help="ホスト数")
+    parser.add_argument('--lines', type=int, default=1000, help="1ホストあたりの出力行数")
+    parser.add_argument('--line', type=int, default=80, help="1行のバイト数")
+    args = parser.parse_args(argv)
+
+    records = make_records(args.hosts, args.lines, args.line)
+    raw_mb = len(records) * args.line / 1e6
+    print(f"{len(records):,} 行 ({args.hosts} ホスト x {args.lines} 行, 出力 {raw_mb:.1f} MB)")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for file_format, suffix in ((log_record.FORMAT_JSONL, '.jsonl'),
+                                    (log_record.FORMAT_BINARY, '.sshlog')):
+            path = os.path.join(tmpdir, f"run{suffix}")
+            start = time.perf_counter()
+            with log_record.RunLogWriter(path) as writer:
+                for record in records:
+                    writer.write(record)
+            write_elapsed = time.perf_counter() - start
+            size = os.path.getsize(path) / 1e6
+
+            start = time.perf_counter()
+            found = sum(1 for _ in log_record.read_run_log(
+                path, host="host-0001", stream=log_record.STREAM_STDERR))
+            read_elapsed = time.perf_counter() - start
+            print(f"{file_format:<7}: 書き込み {write_elapsed * 1000:8.1f} ms"
+                  f" ({len(records) / write_elapsed:10,.0f} 行/s), ファイル {size:7.1f} MB,"
+                  f" 絞り込み {read_elapsed * 1000:8.1f} ms ({found} 行)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
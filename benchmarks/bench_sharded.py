@@ -0,0 +1,112 @@
+# bench_sharded.py
+"""
+複数ホストの実行 (fleet_executor.execute_fleet) と、複数プロセスに分けた実行
+(sharded_executor.execute_sharded) の所要時間を比較するベンチマーク。
+
+簡易SSHサーバー (fake_ssh_server.py) を別プロセスで起動し (計測側と GIL を共有しないため)、
+同じサーバーに多数のホストとして接続する。暗号化とパケット処理の負荷が大きくなるよう、
+各ホストで一定量の出力を受信する。プロセス数による差は CPU のコア数が多いほど大きくなる。
+
+使い方:
+    python benchmarks/bench_sharded.py
+    python benchmarks/bench_sharded.py --hosts 500 --kb 512 --processes 4 --concurrency 100
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fleet_executor  # noqa: E402
+import sharded_executor  # noqa: E402
+import ssh_auth  # noqa: E402
+import ssh_executor  # noqa: E402
+
+
+def _serve(conn):
+    """簡易SSHサーバーを起動してポート番号を返し、親プロセスが終了するまで待ち受ける"""
+    from fake_ssh_server import FakeSSHServer
+
+    with FakeSSHServer() as server:
+        conn.send((server.port, server.username, server.password))
+        try:
+            conn.recv()
+        except EOFError:
+            pass
+
+
+def _drain(log_queue, stop):
+    """GUIの代わりにログキューを読み出し、行数を数える"""
+    count = 0
+    while not (stop.is_set() and log_queue.empty()):
+        try:
+            log_queue.get(timeout=0.1)
+            count += 1
+        except queue.Empty:
+            pass
+    return count
+
+
+def run(label, func, targets, commands, **options):
+    log_queue = queue.Queue(maxsize=10000)
+    stop = threading.Event()
+    counted = []
+    reader = threading.Thread(target=lambda: counted.append(_drain(log_queue, stop)))
+    reader.start()
+    start = time.perf_counter()
+    results = func(targets, commands, log_queue, queue.SimpleQueue(), threading.Event(),
+                   **options)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    reader.join()
+    done = sum(1 for r in results.values() if r['status'] == ssh_executor.STATUS_DONE)
+    print(f"{label:<24}: {elapsed:7.2f} 秒 ({len(targets) / elapsed:7.1f} ホスト/秒,"
+          f" 成功 {done}/{len(targets)}, ログ {counted[0]:,} 行)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数ホストの実行をプロセス数ごとに計測します。")
+    parser.add_argument('--hosts', type=int, default=200, help="接続するホスト数")
+    parser.add_argument('--kb', type=int, default=256, help="1ホストあたりの出力量 (KB)")
+    parser.add_argument('--concurrency', type=int, default=50, help="同時に処理するホスト数")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="execute_sharded のプロセス数")
+    parser.add_argument('--servers', type=int, default=2, help="簡易SSHサーバーのプロセス数")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context('spawn')
+    servers = []
+    targets = []
+    try:
+        for _ in range(max(1, args.servers)):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_serve, args=(child_conn,), daemon=True)
+            process.start()
+            servers.append((process, parent_conn))
+        addresses = [conn.recv() for _, conn in servers]
+        for i in range(args.hosts):
+            port, user, password = addresses[i % len(addresses)]
+            targets.append({'host': '127.0.0.1', 'port': port, 'user': user,
+                            'password': password, 'name': f"host-{i:04d}"})
+        commands = [{'command': f"emit bytes={args.kb * 1024} line=100"}]
+        # 簡易SSHサーバーのホスト鍵は起動のたびに変わるため、known_hosts には登録しない
+        options = {'max_workers': args.concurrency, 'journal': False,
+                   'host_key_policy': ssh_auth.POLICY_OFF}
+        print(f"{args.hosts} ホスト, 出力 {args.kb} KB/ホスト, 同時実行数 {args.concurrency},"
+              f" CPU {os.cpu_count()} コア")
+        run("execute_fleet", fleet_executor.execute_fleet, targets, commands, **options)
+        run(f"execute_sharded ({args.processes} プロセス)", sharded_executor.execute_sharded,
+            targets, commands, processes=args.processes, **options)
+    finally:
+        for process, conn in servers:
+            conn.close()
+            process.join(timeout=5)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# bench_startup.py
+"""
+ヘッドレス実行 (cli.py) の起動時間を計測するベンチマーク。
+
+cli モジュールの import 時間が目標値を超えていないこと、
+および paramiko / tkinter が起動時に読み込まれていないことを確認する。
+
+使い方:
+    python benchmarks/bench_startup.py
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cli モジュールの import にかけてよい時間の目標値 (ミリ秒)
+IMPORT_TARGET_MS = 100
+# 起動時に読み込まれてはならない重いモジュール
+FORBIDDEN_MODULES = ('paramiko', 'tkinter', 'customtkinter', 'cryptography')
+REPEAT = 5
+
+
+def measure_import_ms():
+    """-X importtime の出力から cli モジュールの累積 import 時間を取得する"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import cli'],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'cli':
+            return int(fields[1]) / 1000
+    raise RuntimeError("cli の import 時間を取得できませんでした")
+
+
+def loaded_forbidden_modules():
+    code = ("import sys, cli; cli.main(['test/test.json', '--check']); "
+            f"print('MODULES:' + ','.join(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    line = result.stdout.strip().splitlines()[-1]
+    return [m for m in line[len('MODULES:'):].split(',') if m]
+
+
+def measure_check_ms():
+    """JSONファイルの検証 (--check) を含むプロセス全体の実行時間"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'cli.py', 'test/test.json', '--check'],
+                   cwd=ROOT, capture_output=True, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    import_ms = min(measure_import_ms() for _ in range(REPEAT))
+    check_ms = min(measure_check_ms() for _ in range(REPEAT))
+    forbidden = loaded_forbidden_modules()
+
+    print(f"import cli          : {import_ms:7.1f} ms (目標 {IMPORT_TARGET_MS} ms 以下)")
+    print(f"cli.py --check 全体 : {check_ms:7.1f} ms (インタプリタ起動を含む)")
+    print(f"起動時に読み込まれた重いモジュール: {', '.join(forbidden) or 'なし'}")
+
+    ok = import_ms <= IMPORT_TARGET_MS and not forbidden
+    print("OK" if ok else "NG")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+# fake_ssh_server.py
+"""
+ベンチマーク用の、プロセス内で動作する簡易SSHサーバー (paramiko.ServerInterface)。
+
+実際のボードを用意しなくても ssh_executor を計測できるよう、実行要求された
+コマンド文字列を以下の簡易な指示として解釈し、指定された量の出力を返す。
+
+    emit bytes=1048576 line=80 delay=0 exit=0 stream=stdout
+        delay 秒待ってから、1行 line バイトの出力を合計 bytes バイト送信し、
+        終了コード exit で終了する。stream には stdout / stderr / both を指定できる。
+    sleep seconds=30 exit=0
+        seconds 秒待ってから終了する (チャンネルが閉じられた場合は即座に終了)。
+
+allow_subprocess=True の場合、上記以外のコマンドはローカルのシェルで実行する
+(一括送信モードの計測など、実際のシェルが必要な場合に使用。POSIXのみ)。
+
+SFTPサブシステムにも対応しており、ローカルのファイルシステムをそのまま公開する
+(ファイル転送の計測用)。allow_forwarding=True の場合は direct-tcpip チャンネルによる
+TCP 転送を受け付ける (踏み台ホストとしての計測用)。
+"""
+import os
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+import paramiko
+
+DEFAULT_USER = "bench"
+DEFAULT_PASSWORD = "bench"
+SEND_BLOCK_SIZE = 32768
+
+
+def parse_spec(command):
+    """'emit bytes=10 line=5' のようなコマンドを (名前, {キー: 値}) に分解する"""
+    parts = command.split()
+    if not parts:
+        return None, {}
+    options = {}
+    for part in parts[1:]:
+        key, sep, value = part.partition('=')
+        if not sep:
+            return None, {}
+        options[key] = value
+    return parts[0], options
+
+
+class _Transport(paramiko.Transport):
+    """
+    exec 要求への応答 (MSG_CHANNEL_SUCCESS) の送信を通知する Transport。
+
+    応答はサーバー側の check_channel_exec_request から戻った後に送信されるため、
+    出力の少ないコマンドをすぐに閉じると、クライアントには応答より先に
+    チャンネルのクローズが届いてしまう。応答を送信してから処理を始めるために使う。
+    """
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.reply_events = {}  # クライアント側のチャンネル番号 -> threading.Event
+
+    def _send_user_message(self, data):
+        super()._send_user_message(data)
+        raw = data.asbytes()
+        if raw[:1] == paramiko.common.cMSG_CHANNEL_SUCCESS:
+            event = self.reply_events.pop(struct.unpack('>I', raw[1:5])[0], None)
+            if event is not None:
+                event.set()
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            if attr.st_size is not None:
+                self.writefile.flush()
+                os.ftruncate(self.writefile.fileno(), attr.st_size)
+            if attr.st_mode is not None:
+                os.fchmod(self.writefile.fileno(), attr.st_mode & 0o7777)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class _LocalSFTPInterface(paramiko.SFTPServerInterface):
+    """ローカルのファイルシステムをそのまま公開するSFTPサーバーの実装"""
+
+    def _call(self, function, *args):
+        try:
+            function(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = _SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(newpath):
+            return paramiko.SFTP_FAILURE
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def chattr(self, path, attr):
+        if attr.st_size is not None:
+            result = self._call(os.truncate, path, attr.st_size)
+            if result != paramiko.SFTP_OK:
+                return result
+        if attr.st_mode is not None:
+            return self._call(os.chmod, path, attr.st_mode & 0o7777)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+
+class _Interface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self._server = server
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password' if self._server.authorized_keys else 'password'
+
+    def check_auth_publickey(self, username, key):
+        if username == self._server.username and any(
+                key.asbytes() == authorized.asbytes() for authorized in self._server.authorized_keys):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self._server.username, self._server.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        if not self._server.allow_forwarding:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        try:
+            sock = socket.create_connection(destination, timeout=5)
+        except OSError:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        sock.settimeout(None)
+        self._server.pending_forwards[chanid] = sock
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        replied = threading.Event()
+        channel.get_transport().reply_events[channel.remote_chanid] = replied
+        threading.Thread(target=self._server.handle_command,
+                         args=(channel, command.decode('utf-8', 'replace'), replied),
+                         daemon=True).start()
+        return True
+
+
+class FakeSSHServer:
+    """
+    127.0.0.1 の空きポートで待ち受ける簡易SSHサーバー。
+
+    使い方:
+        with FakeSSHServer() as server:
+            execute_ssh_commands('127.0.0.1', server.port, server.username, server.password, ...)
+    """
+
+    _host_key = None
+
+    def __init__(self, username=DEFAULT_USER, password=DEFAULT_PASSWORD,
+                 allow_subprocess=False, allow_forwarding=False, authorized_keys=()):
+        self.username = username
+        self.password = password
+        self.authorized_keys = list(authorized_keys)  # 公開鍵認証を受け付ける鍵 (paramiko.PKey)
+        self.allow_subprocess = allow_subprocess
+        self.allow_forwarding = allow_forwarding
+        self.pending_forwards = {}  # サーバー側のチャンネル番号 -> 転送先のソケット
+        self.accepted = 0  # 受け付けたSSH接続の数
+        self.port = None
+        self._sock = None
+        self._transports = []
+        self._lock = threading.Lock()
+        if FakeSSHServer._host_key is None:
+            # 鍵の生成は時間がかかるためプロセス内で使い回す
+            FakeSSHServer._host_key = paramiko.RSAKey.generate(2048)
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept_loop(self):
+        while self._sock is not None:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = _Transport(client)
+            transport.add_server_key(self._host_key)
+            transport.use_compression(True)  # クライアントが要求した場合のみ圧縮する
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _LocalSFTPInterface)
+            with self._lock:
+                self._transports.append(transport)
+                self.accepted += 1
+            try:
+                transport.start_server(server=_Interface(self))
+            except (paramiko.SSHException, EOFError, OSError):
+                transport.close()
+                continue
+            if self.allow_forwarding:
+                threading.Thread(target=self._forward_loop, args=(transport,), daemon=True).start()
+
+    def _forward_loop(self, transport):
+        """受け付けた direct-tcpip チャンネルと転送先のソケットの間でデータを中継する"""
+        while transport.is_active():
+            channel = transport.accept(timeout=0.5)
+            if channel is None:
+                continue
+            sock = self.pending_forwards.pop(channel.chanid, None)
+            if sock is None:
+                continue  # セッションチャンネル
+            threading.Thread(target=self._relay, args=(channel.recv, sock.sendall, sock, channel),
+                             daemon=True).start()
+            threading.Thread(target=self._relay, args=(sock.recv, channel.sendall, sock, channel),
+                             daemon=True).start()
+
+    @staticmethod
+    def _relay(receive, send, sock, channel):
+        try:
+            while True:
+                data = receive(SEND_BLOCK_SIZE)
+                if not data:
+                    break
+                send(data)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            sock.close()
+            channel.close()
+
+    # --- コマンドの処理 ---
+    def handle_command(self, channel, command, replied):
+        name, options = parse_spec(command)
+        replied.wait(5)
+        try:
+            if name == 'emit':
+                exit_status = self._emit(channel, options)
+            elif name == 'sleep':
+                exit_status = self._sleep(channel, options)
+            elif self.allow_subprocess:
+                exit_status = self._run_subprocess(channel, command)
+            else:
+                channel.sendall_stderr(f"unknown command: {command}\n".encode())
+                exit_status = 127
+            channel.send_exit_status(exit_status)
+            channel.shutdown_write()
+            channel.close()
+        except (OSError, EOFError, paramiko.SSHException):
+            pass  # クライアント側で閉じられた (キャンセルなど)
+
+    @staticmethod
+    def _emit(channel, options):
+        total = int(options.get('bytes', 0))
+        line_length = max(1, int(options.get('line', 80)))
+        delay = float(options.get('delay', 0))
+        stream = options.get('stream', 'stdout')
+        if delay:
+            time.sleep(delay)
+        line = b'x' * (line_length - 1) + b'\n'
+        block = line * max(1, SEND_BLOCK_SIZE // line_length)
+        senders = {'stdout': [channel.sendall],
+                   'stderr': [channel.sendall_stderr],
+                   'both': [channel.sendall, channel.sendall_stderr]}[stream]
+        for send in senders:
+            remaining = total
+            while remaining > 0 and not channel.closed:
+                data = block[:remaining]
+                send(data)
+                remaining -= len(data)
+        return int(options.get('exit', 0))
+
+    @staticmethod
+    def _sleep(channel, options):
+        deadline = time.monotonic() + float(options.get('seconds', 1))
+        while time.monotonic() < deadline and not channel.closed:
+            channel.status_event.wait(0.05)
+        return int(options.get('exit', 0))
+
+    @staticmethod
+    def _run_subprocess(channel, command):
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def feed_stdin():
+            try:
+                while True:
+                    data = channel.recv(SEND_BLOCK_SIZE)
+                    if not data:
+                        break
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except (OSError, EOFError):
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        def pump(source, send):
+            while True:
+                data = source.read1(SEND_BLOCK_SIZE)
+                if not data:
+                    break
+                send(data)
+
+        threads = [threading.Thread(target=feed_stdin, daemon=True),
+                   threading.Thread(target=pump, args=(process.stdout, channel.sendall), daemon=True),
+                   threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr), daemon=True)]
+        for thread in threads:
+            thread.start()
+        threads[1].join()
+        threads[2].join()
+        return process.wait()
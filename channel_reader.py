@@ -0,0 +1,185 @@
+# channel_reader.py
+import selectors
+import socket
+import threading
+
+# 1回の recv で読み取る最大バイト数
+RECV_SIZE = 32768
+# 1回の通知で1チャンネルから読み取る最大回数 (他チャンネルを待たせないため)
+MAX_READS_PER_WAKEUP = 16
+# コマンドの終了を待つ間にキャンセルとタイムアウトを確認する間隔 (秒)
+CANCEL_CHECK_INTERVAL = 0.05
+
+
+class _Registration:
+    """ChannelReader に登録された1チャンネル分の情報"""
+
+    __slots__ = ('channel', 'sink', 'done', 'fd')
+
+    def __init__(self, channel, sink):
+        self.channel = channel
+        self.sink = sink
+        self.done = threading.Event()
+        self.fd = None
+
+
+class ChannelReader:
+    """
+    複数のSSHチャンネルの stdout/stderr を1つのスレッドで多重化して読み取るクラス。
+
+    paramiko のチャンネルは fileno() で読み取り可能を通知するパイプを返すため、
+    selectors で待ち受けることで固定スリープのポーリングを行わずに済む。
+    読み取ったデータは登録時に渡された sink の feed(stream_name, data) に渡され、
+    チャンネルがEOFに達すると sink.close() が呼ばれる。
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []  # 読み取りスレッド上で実行する処理
+        self._registrations = {}  # id(channel) -> _Registration (読み取りスレッドのみが操作)
+        self._thread = None
+        # 登録要求を読み取りスレッドに知らせるためのソケットペア
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def register(self, channel, sink):
+        """
+        チャンネルを読み取り対象に登録する。
+
+        Args:
+            channel (paramiko.Channel): 読み取り対象のチャンネル。
+            sink: feed(stream_name, data) と close(error=None) を持つオブジェクト。
+
+        Returns:
+            threading.Event: チャンネルの全データを読み終えたときにセットされるイベント。
+        """
+        registration = _Registration(channel, sink)
+        self._submit(lambda: self._add(registration))
+        return registration.done
+
+    def close(self, channel):
+        """
+        登録中のチャンネルの読み取りを打ち切り、チャンネルを閉じる。
+        キャンセル時に使用する。処理は読み取りスレッド上で行われ、
+        完了すると register() が返したイベントがセットされる。
+
+        (チャンネルを閉じると通知用パイプも閉じられるため、
+        登録中のチャンネルを他のスレッドから直接 close() してはならない)
+        """
+        self._submit(lambda: self._abort(channel))
+
+    def _submit(self, operation):
+        """読み取りスレッド上で実行する処理を追加し、スレッドを起こす"""
+        with self._lock:
+            self._pending.append(operation)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="ssh-channel-reader", daemon=True)
+                self._thread.start()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass  # 既に通知済みでバッファが埋まっている
+
+    def _run(self):
+        """読み取りスレッドのメインループ"""
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    self._run_pending()
+                else:
+                    self._drain(key.data)
+
+    def _run_pending(self):
+        """他のスレッドから依頼された登録・中断処理を実行する"""
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for operation in pending:
+            operation()
+
+    def _add(self, registration):
+        """チャンネルをセレクタに追加する"""
+        try:
+            # fileno() はチャンネル内部のパイプを生成し、既存のデータがあれば即座に通知される
+            registration.fd = registration.channel.fileno()
+            self._selector.register(
+                registration.fd, selectors.EVENT_READ, registration)
+            self._registrations[id(registration.channel)] = registration
+        except Exception as e:
+            self._finish(registration, e)
+
+    def _abort(self, channel):
+        """チャンネルの登録を解除してから閉じる"""
+        registration = self._registrations.get(id(channel))
+        if registration is not None:
+            self._finish(registration)
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+    def _drain(self, registration):
+        """読み取り可能になったチャンネルからデータを読み、EOFなら登録を解除する"""
+        channel = registration.channel
+        try:
+            # EOFフラグを先に確認する (EOF以前のデータは必ずバッファ済み)
+            eof = channel.eof_received or channel.closed
+            for _ in range(MAX_READS_PER_WAKEUP):
+                if not channel.recv_ready():
+                    break
+                data = channel.recv(RECV_SIZE)
+                if not data:
+                    break
+                registration.sink.feed('stdout', data)
+            for _ in range(MAX_READS_PER_WAKEUP):
+                if not channel.recv_stderr_ready():
+                    break
+                data = channel.recv_stderr(RECV_SIZE)
+                if not data:
+                    break
+                registration.sink.feed('stderr', data)
+            if eof and not channel.recv_ready() and not channel.recv_stderr_ready():
+                self._finish(registration)
+        except Exception as e:
+            self._finish(registration, e)
+
+    def _finish(self, registration, error=None):
+        """チャンネルの登録を解除し、sink を閉じて完了を通知する"""
+        if registration.done.is_set():
+            return
+        self._registrations.pop(id(registration.channel), None)
+        if registration.fd is not None:
+            try:
+                self._selector.unregister(registration.fd)
+            except (KeyError, ValueError):
+                pass
+        try:
+            registration.sink.close(error)
+        except Exception:
+            pass  # sink のエラーで読み取りスレッドを止めない
+        finally:
+            registration.done.set()
+
+
+_default_reader = None
+_default_reader_lock = threading.Lock()
+
+
+def get_default_reader():
+    """プロセス全体で共有する ChannelReader を返す。"""
+    global _default_reader
+    with _default_reader_lock:
+        if _default_reader is None:
+            _default_reader = ChannelReader()
+        return _default_reader
@@ -0,0 +1,343 @@
+# cli.py
+"""
+GUIを使わずにコマンドリストを実行するコマンドラインツール。
+CIやcronからの実行を想定しており、tkinter / customtkinter は読み込まない。
+paramiko は実際に接続するときに初めて読み込まれる (ssh_executor を参照)。
+
+使い方:
+    SSH_PASSWORD=... python cli.py commands.json --host 192.168.1.10 --user pi
+    python cli.py commands.json --host "10.0.0.1, 10.0.0.2:2222" --user pi --concurrency 20
+    python cli.py commands.json --host "10.0.0.1, 10.0.0.2" --user pi --jump admin@bastion
+    python cli.py commands.json --check   # JSONファイルの検証のみ (接続しない)
+
+終了コード:
+    0   全てのホストで全てのコマンドが終了コード0で完了した
+    1   接続・認証などのエラーが発生したホストがある
+    2   引数またはJSONファイルが無効
+    3   0以外の終了コードで終わったコマンドがある
+    130 停止された (Ctrl+C)
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+
+import bastion
+import command_template
+import config_manager
+import fleet_executor
+import inventory
+import json_loader
+import log_record
+import metrics
+import rollout
+import sharded_executor
+import ssh_auth
+import ssh_executor
+import step_scheduler
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_COMMAND_FAILED = 3
+EXIT_INTERRUPTED = 130
+
+# パスワードを読み取る環境変数のデフォルト名
+PASSWORD_ENV = "SSH_PASSWORD"
+# 秘密鍵のパスフレーズを読み取る環境変数のデフォルト名
+PASSPHRASE_ENV = "SSH_KEY_PASSPHRASE"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="JSONファイルに記述したコマンドをSSH経由で実行します (GUIなし)。")
+    parser.add_argument("json_file", help="実行するコマンドを記述したJSONファイル")
+    parser.add_argument("--host", help="接続先 (カンマ区切りで複数指定可。host:port 形式も可)")
+    parser.add_argument("--user", help="ユーザー名 (--select の場合はインベントリにないホストのみに使用)")
+    parser.add_argument("--var", action="append", default=[], metavar="KEY=VALUE",
+                        help="コマンドのテンプレート ({{ KEY }}) に埋め込む変数 (複数指定可)")
+    parser.add_argument("--select", metavar="EXPR",
+                        help="インベントリからホストを選択する (例: \"group:lab, &tag:arm64, !lab-03\")")
+    parser.add_argument("--inventory", metavar="PATH",
+                        help="インベントリファイル (デフォルト: ~/.SimpleSshRunner/inventory.json)")
+    parser.add_argument("--jump", metavar="[USER@]HOST[:PORT]",
+                        help="踏み台ホスト。全ての接続をこのホスト経由で行う (パスワードは接続先と共通)")
+    parser.add_argument("--jump-channels", type=int, default=bastion.DEFAULT_MAX_CHANNELS,
+                        metavar="N",
+                        help="踏み台経由で同時に開く接続の最大数 "
+                             f"(デフォルト: {bastion.DEFAULT_MAX_CHANNELS})")
+    parser.add_argument("--port", type=int, default=22,
+                        help="ポート番号 (デフォルト: 22)")
+    parser.add_argument("--password-env", default=PASSWORD_ENV, metavar="NAME",
+                        help=f"パスワードを読み取る環境変数 (デフォルト: {PASSWORD_ENV})。"
+                             "未設定で端末から実行した場合は入力を求める")
+    parser.add_argument("--key", action="append", default=[], metavar="PATH",
+                        help="公開鍵認証に使う秘密鍵ファイル (複数指定可)。"
+                             "指定した場合、パスワードは公開鍵認証に失敗したときのみ使う")
+    parser.add_argument("--agent", action="store_true",
+                        help="SSHエージェントの鍵で公開鍵認証を行う")
+    parser.add_argument("--passphrase-env", default=PASSPHRASE_ENV, metavar="NAME",
+                        help=f"秘密鍵のパスフレーズを読み取る環境変数 (デフォルト: {PASSPHRASE_ENV})")
+    parser.add_argument("--host-key-policy", choices=ssh_auth.HOST_KEY_POLICIES,
+                        default=ssh_auth.DEFAULT_HOST_KEY_POLICY,
+                        help="ホスト鍵の確認方法。strict: known_hosts に登録済みの鍵のみ接続 / "
+                             "accept-new: 未登録のホストは鍵を登録して接続 / off: 確認しない "
+                             "(デフォルト: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=fleet_executor.DEFAULT_MAX_WORKERS,
+                        metavar="N", help="同時に処理する最大ホスト数 (デフォルト: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1, metavar="N",
+                        help="複数ホストの実行を N 個のプロセスに分けて行う (数千台規模向け。デフォルト: 1)")
+    parser.add_argument("--max-parallel-steps", type=int,
+                        default=step_scheduler.DEFAULT_MAX_PARALLEL_STEPS, metavar="N",
+                        help="depends_on 指定時に1ホストで同時に実行する最大コマンド数 (デフォルト: %(default)s)")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="全コマンドを1つのリモートシェルで実行する (一括送信モード)")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回の実行で成功したステップを飛ばして再開する")
+    parser.add_argument("--stop-on-error", action="store_true",
+                        help="終了コードが0以外のコマンドがあれば、そのホストの残りのコマンドを実行しない")
+    parser.add_argument("--batch", metavar="N|P%",
+                        help="段階実行: カナリアの後に N 台 (または全体の P%%) ずつ実行する")
+    parser.add_argument("--canary", default=str(rollout.DEFAULT_CANARY), metavar="N|P%",
+                        help="段階実行: 最初に単独で実行する台数 (デフォルト: %(default)s)")
+    parser.add_argument("--max-failures", default="0", metavar="N|P%",
+                        help="段階実行: 失敗したホストがこの台数を超えたら残りを実行せずに中止する"
+                             " (デフォルト: %(default)s)")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="1ホストあたりの実行全体の制限時間 (秒)。過ぎた時点で中断してエラーとする")
+    parser.add_argument("--full-output", action="store_true",
+                        help="長いコマンド出力も省略せずに全て表示する")
+    parser.add_argument("--dedup-output", action="store_true",
+                        help="複数ホストの実行で、先に終了したホストと同じコマンド出力は表示せずに"
+                             "1行にまとめ、終了時にコマンドごとの同じ出力のホストを表示する")
+    parser.add_argument("--run-log", metavar="PATH",
+                        help="ログをファイルに保存する (拡張子が .jsonl の場合は JSONL、それ以外は"
+                             "バイナリ形式)。省略表示した出力も含める場合は --full-output を併用する")
+    parser.add_argument("--metrics-dir", metavar="DIR",
+                        help="実行後にフェーズ別の所要時間を DIR/last_run.json と DIR/last_run.prom に書き出す")
+    parser.add_argument("--profile", default=config_manager.DEFAULT_TRANSPORT_PROFILE, metavar="NAME",
+                        help="転送設定 (圧縮・暗号方式・ウィンドウサイズ) の名前 (デフォルト: %(default)s)。"
+                             f"組み込み: {', '.join(config_manager.BUILTIN_TRANSPORT_PROFILES)}")
+    parser.add_argument("--check", action="store_true",
+                        help="JSONファイルを検証するだけで接続はしない")
+    return parser
+
+
+def read_password(env_name, prompt=True):
+    """
+    環境変数または端末からパスワードを取得する。取得できない場合は None を返す。
+    prompt=False の場合は端末から入力を求めない。
+    """
+    password = os.environ.get(env_name)
+    if password is not None:
+        return password
+    if prompt and sys.stdin.isatty():
+        import getpass
+        return getpass.getpass("Password: ")
+    return None
+
+
+def drain_logs(log_queue, worker, cancel_event, run_log=None):
+    """
+    実行スレッドが終わるまでログキューの内容を標準出力に書き出す。
+    run_log (log_record.RunLogWriter) を渡した場合はファイルにも保存する。
+    """
+    interrupted = False
+    while True:
+        try:
+            try:
+                message = log_queue.get(timeout=0.1)
+            except queue.Empty:
+                if not worker.is_alive() and log_queue.empty():
+                    return interrupted
+                continue
+            if run_log is not None:
+                run_log.write(message)
+            sys.stdout.write(f"{log_record.format_record(message)}\n")
+            if log_queue.empty():
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            if interrupted:
+                raise  # 2回目の Ctrl+C は即座に終了
+            interrupted = True
+            cancel_event.set()
+            sys.stderr.write("停止要求を送信しました (もう一度 Ctrl+C で強制終了)...\n")
+
+
+def exit_code_for(results, interrupted):
+    """
+    実行結果から終了コードを決める。EXIT_INTERRUPTED は Ctrl+C で停止した場合だけ返す。
+    段階実行を中止して実行しなかったホスト ('not_run') は、実行したホストの結果で判定した後、
+    それ以外に失敗がなければ EXIT_ERROR とする。
+    """
+    if interrupted:
+        return EXIT_INTERRUPTED
+    ran = [result for result in results.values() if not result.get('not_run')]
+    if not ran:
+        return EXIT_ERROR
+    if any(result['status'] != ssh_executor.STATUS_DONE for result in ran):
+        return EXIT_ERROR
+    if any(code != 0 for result in ran for code in result['exit_codes'].values()):
+        return EXIT_COMMAND_FAILED
+    if len(ran) < len(results):
+        return EXIT_ERROR
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        commands = json_loader.load_commands_from_json(args.json_file)
+    except Exception as e:
+        sys.stderr.write(f"[エラー] {e}\n")
+        return EXIT_USAGE
+
+    if args.check:
+        print(f"OK: {len(commands)} 件のコマンドを読み込みました。")
+        return EXIT_OK
+
+    if args.select is None and (not args.host or not args.user):
+        parser.error("--host と --user (または --select) を指定してください。")
+    if args.select is not None and args.host:
+        parser.error("--host と --select は同時に指定できません。")
+    if args.concurrency < 1 or args.max_parallel_steps < 1 or args.processes < 1:
+        parser.error("並列数は1以上である必要があります。")
+    if args.timeout is not None and args.timeout <= 0:
+        parser.error("--timeout は正の数である必要があります。")
+    if args.jump_channels < 1:
+        parser.error("--jump-channels は1以上である必要があります。")
+    try:
+        transport_profile = config_manager.get_transport_profile(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # 公開鍵認証の場合、パスワードは環境変数で指定されたときのみ使う
+    use_keys = bool(args.key or args.agent)
+    password = read_password(args.password_env, prompt=not use_keys)
+    if password is None and not use_keys:
+        sys.stderr.write(
+            f"[エラー] パスワードが指定されていません。環境変数 {args.password_env} を設定してください。\n")
+        return EXIT_USAGE
+    auth = {'key_files': args.key, 'use_agent': args.agent,
+            'passphrase': os.environ.get(args.passphrase_env),
+            'host_key_policy': args.host_key_policy}
+    for path in args.key:
+        # 鍵の誤りは接続前にエラーにする (読み込んだ鍵はこのプロセス内で再利用される)
+        try:
+            ssh_auth.load_private_key(path, auth['passphrase'])
+        except Exception as e:
+            sys.stderr.write(f"[エラー] 秘密鍵 {path} を読み込めません: {e}\n")
+            return EXIT_USAGE
+
+    try:
+        if args.select is not None:
+            targets = inventory.select_targets(
+                args.select, args.port, args.user, password, args.inventory, **auth)
+        else:
+            targets = fleet_executor.parse_targets(
+                args.host, args.port, args.user, password)
+        jump = None
+        if args.jump:
+            jump = bastion.get_jump_host(bastion.parse_jump(args.jump, default_user=args.user),
+                                         password, max_channels=args.jump_channels, **auth)
+    except FileNotFoundError as e:
+        sys.stderr.write(f"[エラー] インベントリファイルが見つかりません: {e.filename}\n")
+        return EXIT_USAGE
+    except ValueError as e:
+        # インベントリの JSON の解析エラー (json.JSONDecodeError) を含む
+        parser.error(str(e))
+    if not targets:
+        parser.error("接続先が指定されていません。")
+    try:
+        # テンプレートの変数の不足は接続前にエラーにする
+        params = command_template.parse_params(args.var)
+        command_template.check_targets(commands, targets, params)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.batch is not None:
+        try:
+            for value, name in ((args.batch, "--batch"), (args.canary, "--canary"),
+                                (args.max_failures, "--max-failures")):
+                rollout.parse_amount(value, len(targets), name)
+        except ValueError as e:
+            parser.error(str(e))
+
+    log_queue = queue.Queue(maxsize=10000)
+    status_queue = queue.SimpleQueue()  # 終了コードは戻り値から判定するため読み出さない
+    cancel_event = threading.Event()
+    options = {'pipelined': args.pipelined,
+               'max_parallel_steps': args.max_parallel_steps,
+               'transport_profile': transport_profile,
+               'resume': args.resume,
+               'capture_output': not args.full_output,
+               'run_timeout': args.timeout,
+               'stop_on_error': args.stop_on_error,
+               'jump': jump,
+               **auth}
+    # 出力のまとめは複数ホストの実行でのみ使う (execute_ssh_commands には渡さない)
+    fleet_options = dict(options, dedup_output=args.dedup_output)
+    results = {}
+
+    def run():
+        if args.batch is not None and len(targets) > 1:
+            results.update(rollout.execute_rollout(
+                targets, commands, log_queue, status_queue, cancel_event,
+                canary=args.canary, batch_size=args.batch, max_failures=args.max_failures,
+                max_workers=args.concurrency, processes=args.processes, params=params,
+                **fleet_options))
+        elif len(targets) == 1:
+            target = targets[0]
+            results[fleet_executor.target_label(target)] = ssh_executor.execute_ssh_commands(
+                target['host'], target['port'], target['user'], password,
+                commands.render(command_template.target_variables(target, params)),
+                log_queue, status_queue, cancel_event,
+                **dict(options, transport_profile=target.get('transport_profile', transport_profile),
+                       jump=target.get('jump', jump)))
+        elif args.processes > 1:
+            results.update(sharded_executor.execute_sharded(
+                targets, commands, log_queue, status_queue, cancel_event,
+                processes=args.processes, max_workers=args.concurrency, params=params,
+                **fleet_options))
+        else:
+            results.update(fleet_executor.execute_fleet(
+                targets, commands, log_queue, status_queue, cancel_event,
+                max_workers=args.concurrency, params=params, **fleet_options))
+
+    run_log = None
+    if args.run_log:
+        try:
+            run_log = log_record.RunLogWriter(args.run_log)
+        except OSError as e:
+            sys.stderr.write(f"[エラー] ログファイルを作成できません: {e}\n")
+            return EXIT_USAGE
+
+    worker = threading.Thread(target=run, name="ssh-cli-runner", daemon=True)
+    worker.start()
+    try:
+        interrupted = drain_logs(log_queue, worker, cancel_event, run_log)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        if run_log is not None:
+            run_log.close()
+    worker.join()
+    bastion.close_all()
+    sys.stdout.flush()
+    for result in results.values():
+        if result.get('spool') is not None:
+            result['spool'].close()
+    if args.metrics_dir:
+        try:
+            metrics.write_reports([r['metrics'] for r in results.values() if r.get('metrics')],
+                                  args.metrics_dir)
+        except OSError as e:
+            sys.stderr.write(f"[警告] メトリクスの書き出しに失敗しました: {e}\n")
+    return exit_code_for(results, interrupted)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# command_template.py
+# コマンド文字列の変数展開 ({{ 変数名 }})。読み込み時に一度だけ解析し、ホストごとには展開だけを行う
+import re
+import shlex
+
+# {{ name }} または {{ name | quote }} (quote はシェル用に引用符で囲む)
+_PLACEHOLDER = re.compile(
+    r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|\s*([A-Za-z_]+)\s*)?\}\}')
+# 変数名とはみなさない名前 (Go のテンプレートの {{end}} や {{else}} をそのまま残すため)
+_GO_KEYWORDS = frozenset({'end', 'else', 'break', 'continue', 'nil'})
+FILTERS = {
+    'quote': shlex.quote,
+}
+# テンプレートを使えるコマンドオブジェクトの項目
+TEMPLATE_FIELDS = ('command', 'description')
+
+
+def _to_text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'  # JSON と同じ表記にする
+    return str(value)
+
+
+class Template:
+    """
+    解析済みのテンプレート。
+
+    変数の部分を str.format の位置引数 ({}) に置き換えた書式文字列と、各位置に入る
+    (変数名, フィルター名) の並び (slots) を持つ。展開は str.format の1回の呼び出しで済む。
+    """
+
+    __slots__ = ('source', 'slots', 'variables', '_format')
+
+    def __init__(self, source, parts):
+        self.source = source
+        self.slots = tuple(part for part in parts if isinstance(part, tuple))
+        self.variables = frozenset(name for name, _ in self.slots)
+        self._format = ''.join(
+            part.replace('{', '{{').replace('}', '}}') if isinstance(part, str) else '{}'
+            for part in parts)
+
+    def render(self, values):
+        """変数の値 (dict) を埋め込んだ文字列を返す。全ての変数が values にあること。"""
+        return self.render_resolved(resolve_slots(self.slots, values))
+
+    def render_resolved(self, resolved):
+        """resolve_slots() で変換済みの値を埋め込んだ文字列を返す"""
+        return self._format.format(*[resolved[slot] for slot in self.slots])
+
+
+def resolve_slots(slots, values):
+    """(変数名, フィルター名) ごとに、埋め込む文字列を求める"""
+    resolved = {}
+    for slot in slots:
+        if slot not in resolved:
+            name, filter_name = slot
+            text = _to_text(values[name])
+            resolved[slot] = FILTERS[filter_name](text) if filter_name else text
+    return resolved
+
+
+def compile_template(text, owner="テンプレート"):
+    """
+    文字列を解析して Template を返す。変数 (と \\{{) を含まない場合は None を返す。
+    {{ 変数名 }} の形式でない "{{" は文字として扱う (Go のテンプレートなどをそのまま書けるように)。
+
+    Raises:
+        ValueError: 未知のフィルターが指定された場合。
+    """
+    if '{{' not in text:
+        return None
+    parts = []
+    position = 0
+    literal = []
+    while True:
+        start = text.find('{{', position)
+        if start == -1:
+            literal.append(text[position:])
+            break
+        if start > 0 and text[start - 1] == '\\':
+            # \{{ は "{{" として出力する
+            literal.append(text[position:start - 1] + '{{')
+            position = start + 2
+            continue
+        literal.append(text[position:start])
+        match = _PLACEHOLDER.match(text, start)
+        if match is None or match.group(1) in _GO_KEYWORDS:
+            # 変数の形式でない "{{" (docker の --format '{{.Names}}' など) は文字としてそのまま残す
+            literal.append('{{')
+            position = start + 2
+            continue
+        name, filter_name = match.groups()
+        if filter_name is not None and filter_name not in FILTERS:
+            raise ValueError(f"{owner} のフィルター '{filter_name}' は使用できません "
+                             f"(使用可能: {', '.join(FILTERS)})。")
+        if literal:
+            joined = ''.join(literal)
+            if joined:
+                parts.append(joined)
+            literal = []
+        parts.append((name, filter_name))
+        position = match.end()
+    joined = ''.join(literal)
+    if joined:
+        parts.append(joined)
+    if not any(isinstance(part, tuple) for part in parts):
+        return None if joined == text else Template(text, parts)
+    return Template(text, parts)
+
+
+def compile_commands(commands):
+    """
+    コマンドオブジェクトのリストのテンプレートを解析する。
+
+    Returns:
+        list: (インデックス, 項目名, Template) のリスト (変数を含む項目のみ)。
+
+    Raises:
+        ValueError: テンプレートの書式が無効な場合。
+    """
+    templates = []
+    for i, cmd_obj in enumerate(commands):
+        for field in TEMPLATE_FIELDS:
+            text = cmd_obj.get(field)
+            if isinstance(text, str):
+                template = compile_template(text, f"JSON配列の {i+1} 番目の要素の '{field}'")
+                if template is not None:
+                    templates.append((i, field, template))
+    return templates
+
+
+def target_variables(target, params=None):
+    """
+    ターゲット (fleet_executor のターゲット) に対して使える変数の辞書を返す。
+
+    組み込みの変数 (host, name, port, user) → インベントリのホスト変数 (target['vars'])
+    → 実行時に指定した変数 (params) の順に上書きする。
+    """
+    values = {'host': target['host'], 'name': target.get('name') or target['host'],
+              'port': target.get('port', 22), 'user': target.get('user', '')}
+    values.update(target.get('vars') or {})
+    values.update(params or {})
+    return values
+
+
+def check_targets(commands, targets, params=None):
+    """
+    全てのターゲットでテンプレートの変数が定義されているかを接続前に確認する。
+    commands は json_loader.CommandList。
+
+    Raises:
+        ValueError: 変数が定義されていないターゲットがある場合 (最初の1台を報告する)。
+    """
+    if not getattr(commands, 'variables', None):
+        return
+    for target in targets:
+        missing = commands.missing_variables(target_variables(target, params))
+        if missing:
+            raise ValueError(
+                f"ホスト '{target.get('name') or target['host']}' でテンプレートの変数が"
+                f"定義されていません: {', '.join(missing)}")
+
+
+def parse_params(text):
+    """
+    "key=value" をカンマ区切りで並べた文字列 (またはそのリスト) を変数の辞書にする。
+
+    Raises:
+        ValueError: 書式が無効な場合。
+    """
+    items = text if isinstance(text, (list, tuple)) else text.split(',')
+    params = {}
+    for item in items:
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, value = item.partition('=')
+        key = key.strip()
+        if not sep or not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', key):
+            raise ValueError(f"変数の指定が無効です (key=value の形式で指定してください): {item}")
+        params[key] = value.strip()
+    return params
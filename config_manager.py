@@ -6,6 +6,34 @@ from pathlib import Path  # pathlib を使ってパスを操作
 # アプリケーション名 (設定フォルダ名として使用)
 APP_NAME = "SimpleSshRunner"
 CONFIG_FILENAME = "config.json"
+# 転送設定 (プロファイル) を保存するファイル名 (config.json と同じフォルダに置く)
+TRANSPORT_PROFILES_FILENAME = "transport_profiles.json"
+DEFAULT_TRANSPORT_PROFILE = "default"
+# 使われなくなった設定項目 (保存時に削除する)
+#   log_max_lines: ログ欄の保持行数。ログ表示欄が全ての行を保持するようになったため不要
+OBSOLETE_SETTINGS = ('log_max_lines',)
+
+# 組み込みの転送設定。同名のプロファイルを transport_profiles.json に保存すると上書きできる。
+#   compression     : zlib 圧縮を要求するか
+#   ciphers/macs/kex: 優先するアルゴリズム (先頭ほど優先。サーバーが対応していない場合は既定の順で交渉する)
+#   window_size     : チャンネルのウィンドウサイズ (バイト)
+#   max_packet_size : チャンネルの最大パケットサイズ (バイト)
+BUILTIN_TRANSPORT_PROFILES = {
+    # paramiko の既定値のまま
+    DEFAULT_TRANSPORT_PROFILE: {},
+    # 帯域の狭い回線 (モバイル回線など) 向け: 圧縮を有効にし、ウィンドウを広げて往復待ちを減らす
+    "cellular": {
+        "compression": True,
+        "window_size": 8 * 1024 * 1024,
+    },
+    # LAN上のCPUの遅いボード向け: 圧縮せず、軽い暗号方式を優先する
+    "lan": {
+        "compression": False,
+        "ciphers": ["aes128-ctr", "aes128-gcm@openssh.com"],
+        "macs": ["hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"],
+        "kex": ["curve25519-sha256@libssh.org"],
+    },
+}
 
 
 def get_config_path() -> Path:
@@ -15,18 +43,30 @@ def get_config_path() -> Path:
     return config_dir / CONFIG_FILENAME
 
 
-def save_settings(ip: str, user: str, port: str):
+def get_transport_profiles_path() -> Path:
+    """転送設定ファイルのパスを取得する (設定ファイルと同じフォルダ)"""
+    return get_config_path().parent / TRANSPORT_PROFILES_FILENAME
+
+
+def save_settings(ip: str, user: str, port: str, **extra):
     """
     指定された設定をJSONファイルに保存する。
     ポートは文字列として受け取るが、intに変換して保存することも可能。
-    パスワードは保存しない。
+    パスワードは保存しない。その他の保存済みの設定項目は維持する
+    (OBSOLETE_SETTINGS の項目は削除する)。
+    extra には追加で保存する設定項目 (transport_profile など) を指定できる。
     """
     config_path = get_config_path()
-    settings = {
+    # 既存の設定のうち引数で指定しない項目は残したまま、指定された項目だけを更新する
+    settings = load_settings()
+    settings.update({
         'ip': ip,
         'user': user,
         'port': port  # 文字列のまま保存
-    }
+    })
+    settings.update(extra)
+    for key in OBSOLETE_SETTINGS:
+        settings.pop(key, None)
 
     try:
         # 設定ディレクトリが存在しない場合は作成
@@ -73,6 +113,98 @@ def load_settings() -> dict:
         return default_settings
 
 
+def validate_transport_profile(name: str, profile: dict) -> dict:
+    """
+    転送設定の内容を検証し、既知の項目だけを含む辞書を返す。
+
+    Raises:
+        ValueError: 項目の型や値が無効な場合。
+    """
+    if not isinstance(profile, dict):
+        raise ValueError(f"転送設定 '{name}' はオブジェクト({{}})である必要があります。")
+    validated = {}
+    if 'compression' in profile:
+        if not isinstance(profile['compression'], bool):
+            raise ValueError(f"転送設定 '{name}' の compression は true / false である必要があります。")
+        validated['compression'] = profile['compression']
+    for key in ('ciphers', 'macs', 'kex'):
+        if key in profile:
+            value = profile[key]
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                raise ValueError(f"転送設定 '{name}' の {key} は文字列の配列である必要があります。")
+            validated[key] = list(value)
+    for key in ('window_size', 'max_packet_size'):
+        if key in profile:
+            value = profile[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                raise ValueError(f"転送設定 '{name}' の {key} は正の整数である必要があります。")
+            validated[key] = value
+    return validated
+
+
+def load_transport_profiles() -> dict:
+    """
+    組み込みの転送設定と transport_profiles.json の内容をまとめて返す。
+    ファイルの読み込みに失敗した場合や無効なプロファイルは警告を表示して無視する。
+
+    Returns:
+        dict: プロファイル名をキー、設定の辞書を値とする辞書。
+    """
+    profiles = {name: dict(profile) for name, profile in BUILTIN_TRANSPORT_PROFILES.items()}
+    profiles_path = get_transport_profiles_path()
+    if not profiles_path.exists():
+        return profiles
+
+    try:
+        with open(profiles_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"[警告] 転送設定ファイルの読み込みに失敗しました: {e}。組み込みの設定のみ使用します。")
+        return profiles
+    if not isinstance(saved, dict):
+        print("[警告] 転送設定ファイルの形式が無効です（辞書ではありません）。組み込みの設定のみ使用します。")
+        return profiles
+
+    for name, profile in saved.items():
+        try:
+            profiles[name] = validate_transport_profile(name, profile)
+        except ValueError as e:
+            print(f"[警告] {e}この設定は無視します。")
+    return profiles
+
+
+def save_transport_profiles(profiles: dict):
+    """
+    転送設定を transport_profiles.json に保存する。
+
+    Raises:
+        ValueError: 無効なプロファイルが含まれている場合。
+    """
+    validated = {name: validate_transport_profile(name, profile)
+                 for name, profile in profiles.items()}
+    profiles_path = get_transport_profiles_path()
+    try:
+        profiles_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(profiles_path, 'w', encoding='utf-8') as f:
+            json.dump(validated, f, indent=4)
+    except IOError as e:
+        print(f"[エラー] 転送設定ファイルの書き込みに失敗しました: {e}")
+
+
+def get_transport_profile(name: str) -> dict:
+    """
+    名前を指定して転送設定を取得する。戻り値には 'name' キーにプロファイル名が入る。
+
+    Raises:
+        ValueError: 指定された名前のプロファイルが存在しない場合。
+    """
+    profiles = load_transport_profiles()
+    if name not in profiles:
+        raise ValueError(
+            f"転送設定 '{name}' が見つかりません (利用可能: {', '.join(sorted(profiles))})。")
+    return dict(profiles[name], name=name)
+
+
 # --- テスト用 ---
 if __name__ == '__main__':
     test_ip = "192.168.1.100"
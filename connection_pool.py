@@ -0,0 +1,149 @@
+# connection_pool.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# プールに保持するアイドル接続の最大数 (超えた場合は最も古いものから閉じる)
+DEFAULT_MAX_IDLE = 32
+# アイドル接続を保持する秒数
+DEFAULT_IDLE_TTL = 300
+# キープアライブ送信間隔 (秒)
+DEFAULT_KEEPALIVE_INTERVAL = 30
+
+
+def make_key(host, port, user, pwd=None, profile=None, key_files=(), use_agent=False):
+    """
+    接続プールのキーを生成する。
+
+    (host, port, user) に加えて認証情報のハッシュを含めることで、
+    異なるパスワード (または秘密鍵・エージェント) を指定した実行が認証済みの接続を
+    使い回さないようにする。
+    profile には転送設定を表す文字列を指定し、設定の異なる接続を使い回さないようにする。
+    """
+    credentials = '\0'.join([pwd or '', *key_files, 'agent' if use_agent else ''])
+    secret = hashlib.sha256(credentials.encode('utf-8')).hexdigest()[:16]
+    return (host, int(port), user, secret, profile or '')
+
+
+class ConnectionPool:
+    """
+    認証済みの paramiko.Transport を (host, port, user) ごとに保持し、
+    次回の実行で再利用するための接続プール。
+
+    返却された接続はキープアライブを送りながらアイドル状態で保持され、
+    idle_ttl 秒を過ぎたもの、または max_idle を超えた古いもの (LRU) から閉じられる。
+    再利用前には接続が生きているかを確認する。
+    """
+
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE, idle_ttl=DEFAULT_IDLE_TTL,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL):
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.keepalive_interval = keepalive_interval
+        self._idle = OrderedDict()  # key -> (transport, 返却時刻)。先頭ほど古い
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._janitor = None
+
+    def acquire(self, key, connect):
+        """
+        キーに対応する接続を取得する。
+
+        Args:
+            key (tuple): make_key() で生成したキー。
+            connect (callable): 新規接続を確立して Transport を返す関数。
+
+        Returns:
+            tuple: (transport, reused)。reused はプールの接続を再利用した場合に True。
+        """
+        with self._lock:
+            entry = self._idle.pop(key, None)
+        if entry is not None:
+            transport, _ = entry
+            if self._is_healthy(transport):
+                return transport, True
+            self._close_quietly(transport)
+
+        transport = connect()
+        if self.keepalive_interval:
+            transport.set_keepalive(self.keepalive_interval)
+        return transport, False
+
+    def release(self, key, transport):
+        """
+        使い終わった接続をプールに返却する。切断済みの接続は閉じて破棄する。
+        """
+        if self._closed.is_set() or not self._is_healthy(transport):
+            self._close_quietly(transport)
+            return
+
+        to_close = []
+        with self._lock:
+            previous = self._idle.pop(key, None)
+            if previous is not None and previous[0] is not transport:
+                to_close.append(previous[0])
+            self._idle[key] = (transport, time.monotonic())
+            while len(self._idle) > self.max_idle:
+                _, (old_transport, _) = self._idle.popitem(last=False)
+                to_close.append(old_transport)
+            self._start_janitor()
+        for old_transport in to_close:
+            self._close_quietly(old_transport)
+
+    def discard(self, transport):
+        """再利用できない接続を閉じる (プールには戻さない)。"""
+        self._close_quietly(transport)
+
+    def prune(self):
+        """アイドル時間が idle_ttl を超えた接続と切断済みの接続を閉じる。"""
+        now = time.monotonic()
+        to_close = []
+        with self._lock:
+            for key, (transport, released_at) in list(self._idle.items()):
+                if now - released_at > self.idle_ttl or not transport.is_active():
+                    del self._idle[key]
+                    to_close.append(transport)
+        for transport in to_close:
+            self._close_quietly(transport)
+
+    def close_all(self):
+        """保持している全ての接続を閉じる。アプリケーション終了時に呼び出す。"""
+        self._closed.set()
+        with self._lock:
+            entries = list(self._idle.values())
+            self._idle.clear()
+        for transport, _ in entries:
+            self._close_quietly(transport)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._idle)
+
+    # --- 内部処理 ---
+    def _start_janitor(self):
+        # ロックを保持した状態で呼び出すこと
+        if self._janitor is None or not self._janitor.is_alive():
+            self._janitor = threading.Thread(
+                target=self._janitor_loop, name="ssh-pool-janitor", daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self):
+        interval = max(1, min(self.idle_ttl, 30))
+        while not self._closed.wait(interval):
+            self.prune()
+            with self._lock:
+                if not self._idle:
+                    self._janitor = None
+                    return
+
+    @staticmethod
+    def _is_healthy(transport):
+        return transport.is_active() and transport.is_authenticated()
+
+    @staticmethod
+    def _close_quietly(transport):
+        try:
+            transport.close()
+        except Exception:
+            pass
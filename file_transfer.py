@@ -0,0 +1,323 @@
+# file_transfer.py
+# upload / download ステップ (SFTPによるファイル転送) の実行
+import hashlib
+import os
+import posixpath
+import secrets
+import shlex
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import channel_reader
+import log_record
+
+# コマンドオブジェクトで転送を表すキー
+TRANSFER_KINDS = ('upload', 'download')
+# 1回の読み書き要求のサイズ (paramiko の SFTP の最大要求サイズ)
+BLOCK_SIZE = 32768
+# ダウンロード時に一度に受け取るデータの大きさ
+READ_PIECE_SIZE = 1024 * 1024
+# ダウンロード時に同時に送信しておく読み取り要求の最大数
+MAX_PREFETCH_REQUESTS = 64
+# このサイズ以上のファイルは複数のSFTPチャンネルで分割して並列に転送する
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_PARALLEL_CHUNKS = 4
+# ローカルファイルのハッシュ計算で一度に読み込むサイズ
+HASH_READ_SIZE = 1024 * 1024
+# ローカルファイルのハッシュを保持するファイル数の上限
+HASH_CACHE_MAX_ENTRIES = 64
+
+_hash_cache = OrderedDict()  # 絶対パス -> ((mtime_ns, size), sha256)
+_hash_cache_lock = threading.Lock()
+
+
+class TransferCancelled(Exception):
+    """転送中にキャンセルされたことを示す例外"""
+
+
+def is_transfer(cmd_obj):
+    """コマンドオブジェクトがファイル転送 (upload / download) か"""
+    return any(kind in cmd_obj for kind in TRANSFER_KINDS)
+
+
+def describe(cmd_obj):
+    """ログに表示する転送の内容 (例: "upload a.img -> /tmp/a.img")"""
+    for kind in TRANSFER_KINDS:
+        if kind in cmd_obj:
+            spec = cmd_obj[kind]
+            return f"{kind} {spec['src']} -> {spec['dest']}"
+    return ''
+
+
+def local_sha256(path, cancel_event=None):
+    """
+    ローカルファイルの SHA-256 を返す。
+    更新日時とサイズが変わっていないファイルは前回の計算結果を使う。
+    HASH_READ_SIZE ごとに cancel_event を確認し、停止する場合は TransferCancelled を送出する。
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _hash_cache_lock:
+        cached = _hash_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _hash_cache.move_to_end(path)
+            return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TransferCancelled()
+            data = f.read(HASH_READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    result = digest.hexdigest()
+
+    with _hash_cache_lock:
+        _hash_cache[path] = (signature, result)
+        _hash_cache.move_to_end(path)
+        while len(_hash_cache) > HASH_CACHE_MAX_ENTRIES:
+            _hash_cache.popitem(last=False)
+    return result
+
+
+def remote_sha256(open_channel, path, cancel_event=None):
+    """
+    リモートのファイルの SHA-256 を sha256sum で計算して返す。
+    sha256sum が使えない場合などは None を返す。
+    計算を待つ間も channel_reader.CANCEL_CHECK_INTERVAL ごとに cancel_event を確認し、
+    停止する場合はチャンネルを閉じて TransferCancelled を送出する。
+    """
+    def check():
+        if cancel_event is not None and cancel_event.is_set():
+            raise TransferCancelled()
+
+    channel = open_channel()
+    try:
+        # 標準入力から読ませ、ファイル名が '-' で始まる場合もオプションと解釈させない
+        channel.exec_command(f"sha256sum < {shlex.quote(path)}")
+        channel.settimeout(channel_reader.CANCEL_CHECK_INTERVAL)
+        output = b''
+        while True:
+            check()
+            try:
+                data = channel.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            output += data
+        while not channel.status_event.wait(channel_reader.CANCEL_CHECK_INTERVAL):
+            check()
+        if channel.recv_exit_status() != 0:
+            return None
+    finally:
+        channel.close()
+    fields = output.split()
+    if not fields or len(fields[0]) != 64:
+        return None
+    return fields[0].decode('ascii').lower()
+
+
+def _open_sftp(open_channel):
+    import paramiko
+
+    channel = open_channel()
+    channel.invoke_subsystem('sftp')
+    return paramiko.SFTPClient(channel)
+
+
+def _split_ranges(size, chunks):
+    """ファイルを chunks 個の (開始位置, 長さ) に分割する"""
+    if size < PARALLEL_THRESHOLD or chunks <= 1:
+        return [(0, size)]
+    step = -(-size // chunks)
+    step += -step % BLOCK_SIZE  # 要求の境界をそろえる
+    return [(offset, min(step, size - offset)) for offset in range(0, size, step)]
+
+
+def _run_ranges(open_sftp, sftp, ranges, transfer_range):
+    """
+    各範囲を transfer_range(sftp, offset, length) で転送する。
+    2つ目以降の範囲は別のSFTPチャンネルを開いて並列に転送する。
+    """
+    if len(ranges) == 1:
+        transfer_range(sftp, *ranges[0])
+        return
+    errors = []
+
+    def worker(offset, length):
+        try:
+            client = open_sftp()
+            try:
+                transfer_range(client, offset, length)
+            finally:
+                client.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=r, daemon=True,
+                                name="sftp-chunk") for r in ranges[1:]]
+    for thread in threads:
+        thread.start()
+    try:
+        transfer_range(sftp, *ranges[0])
+    except Exception as e:
+        errors.append(e)
+    for thread in threads:
+        thread.join()
+    if errors:
+        # キャンセルを優先して報告する
+        raise next((e for e in errors if isinstance(e, TransferCancelled)), errors[0])
+
+
+def _upload(open_channel, sftp, src, dest, cancel_event, chunks):
+    size = os.path.getsize(src)
+    # 転送中のファイルを一時的な名前で作成し、完了後に置き換える
+    partial = f"{dest}.part-{secrets.token_hex(4)}"
+
+    def transfer_range(client, offset, length):
+        with open(src, 'rb') as local, client.open(partial, 'r+b') as remote:
+            remote.set_pipelined(True)  # 書き込みの応答を待たずに次の要求を送る
+            local.seek(offset)
+            remote.seek(offset)
+            remaining = length
+            while remaining > 0:
+                if cancel_event.is_set():
+                    raise TransferCancelled()
+                data = local.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    raise IOError(f"転送中にファイルが短くなりました: {src}")
+                remote.write(data)
+                remaining -= len(data)
+
+    try:
+        with sftp.open(partial, 'wb') as remote:
+            remote.truncate(size)
+        _run_ranges(lambda: _open_sftp(open_channel), sftp,
+                    _split_ranges(size, chunks), transfer_range)
+        sftp.chmod(partial, os.stat(src).st_mode & 0o777)
+        try:
+            sftp.posix_rename(partial, dest)
+        except IOError:
+            # posix-rename 拡張に対応していないサーバー
+            try:
+                sftp.remove(dest)
+            except IOError:
+                pass
+            sftp.rename(partial, dest)
+    except BaseException:
+        try:
+            sftp.remove(partial)
+        except Exception:
+            pass
+        raise
+    return size
+
+
+def _download(open_channel, sftp, src, dest, cancel_event, chunks):
+    size = sftp.stat(src).st_size
+    partial = f"{dest}.part-{secrets.token_hex(4)}"
+
+    def transfer_range(client, offset, length):
+        pieces = [(start, min(READ_PIECE_SIZE, offset + length - start))
+                  for start in range(offset, offset + length, READ_PIECE_SIZE)]
+        with client.open(src, 'rb') as remote, open(partial, 'r+b') as local:
+            local.seek(offset)
+            # 読み取り要求をまとめて送信し、応答を順に受け取る (先読み)
+            for data in remote.readv(pieces, MAX_PREFETCH_REQUESTS):
+                if cancel_event.is_set():
+                    raise TransferCancelled()
+                local.write(data)
+
+    try:
+        with open(partial, 'wb') as local:
+            local.truncate(size)
+        _run_ranges(lambda: _open_sftp(open_channel), sftp,
+                    _split_ranges(size, chunks), transfer_range)
+        os.replace(partial, dest)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def run_transfer(open_channel, cmd_obj, log_queue, cancel_event,
+                 chunks=DEFAULT_PARALLEL_CHUNKS, step=None):
+    """
+    upload / download ステップを1つ実行し、終了コード (成功: 0, 失敗: 1) を返す。
+
+    転送先に同じサイズ・同じ SHA-256 のファイルが既にある場合は転送しない。
+    大きなファイル (PARALLEL_THRESHOLD 以上) は chunks 個の範囲に分割し、
+    それぞれ別のSFTPチャンネルで並列に転送する。
+
+    Args:
+        open_channel (callable): 新しいセッションチャンネルを開いて返す関数 (複数スレッドから呼ばれる)。
+        cmd_obj (dict): json_loader で検証済みの upload / download のコマンドオブジェクト。
+        log_queue: ログメッセージの送信先キュー。
+        cancel_event (threading.Event): キャンセル通知用イベント。
+        chunks (int): 大きなファイルを並列に転送するときの分割数。
+        step (int): コマンドの位置 (ログのメッセージに付ける)。
+    """
+    import paramiko
+
+    kind = 'upload' if 'upload' in cmd_obj else 'download'
+    src, dest = cmd_obj[kind]['src'], cmd_obj[kind]['dest']
+
+    sftp = None
+    try:
+        sftp = _open_sftp(open_channel)
+        if kind == 'upload':
+            if dest.endswith('/'):
+                dest = posixpath.join(dest, os.path.basename(src))
+            local_path, local_size = src, os.path.getsize(src)
+            try:
+                remote_size = sftp.stat(dest).st_size
+            except IOError:
+                remote_size = None  # 転送先にファイルがない
+            remote_path = dest
+        else:
+            if dest.endswith(('/', os.sep)) or os.path.isdir(dest):
+                dest = os.path.join(dest, posixpath.basename(src))
+            os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+            remote_path, remote_size = src, sftp.stat(src).st_size
+            local_path = dest
+            local_size = os.path.getsize(dest) if os.path.isfile(dest) else None
+
+        if local_size is not None and local_size == remote_size:
+            local_digest = local_sha256(local_path, cancel_event)
+            if local_digest == remote_sha256(open_channel, remote_path, cancel_event):
+                log_queue.put(log_record.message(
+                    f"[スキップ] {dest} は変更されていません (sha256: {local_digest[:12]}...)", step))
+                return 0
+
+        start = time.monotonic()
+        if kind == 'upload':
+            size = _upload(open_channel, sftp, src, dest, cancel_event, chunks)
+        else:
+            size = _download(open_channel, sftp, src, dest, cancel_event, chunks)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        if size < 1024 * 1024:
+            log_queue.put(log_record.message(f"転送完了: {size} バイト, {elapsed:.2f} 秒", step))
+        else:
+            log_queue.put(log_record.message(
+                f"転送完了: {size / 1024 / 1024:.1f} MB, "
+                f"{elapsed:.2f} 秒 ({size / 1024 / 1024 / elapsed:.1f} MB/s)", step))
+        return 0
+    except TransferCancelled:
+        log_queue.put(log_record.message("[中断] 転送をキャンセルしました。", step))
+        return 1
+    except (IOError, OSError, paramiko.SSHException) as e:
+        # SFTPサブシステムを開けない場合などもステップの失敗とし、ホストの実行は続ける
+        log_queue.put(log_record.message(f"[エラー] ファイル転送に失敗しました: {e}", step))
+        return 1
+    finally:
+        if sftp is not None:
+            sftp.close()
@@ -0,0 +1,238 @@
+# fleet_executor.py
+import threading
+
+import command_template
+import log_record
+import metrics
+import output_dedup
+import ssh_executor
+
+# 同時に処理するホスト数のデフォルト値
+DEFAULT_MAX_WORKERS = 10
+
+
+class _HostLogQueue:
+    """
+    ログ (文字列のメッセージは log_record.LogRecord にする) にホスト名を設定して
+    共有のログキューへ転送するラッパー。execute_ssh_commands からは通常のキューと同じように見える。
+    """
+
+    def __init__(self, log_queue, label):
+        self._log_queue = log_queue
+        self._label = label
+
+    def put(self, message, block=True, timeout=None):
+        record = log_record.to_record(message)
+        record.host = self._label
+        self._log_queue.put(record, block, timeout)
+
+
+class _HostStatusQueue:
+    """
+    ホストごとのステータスを記録し、必要に応じて (ホスト名, ステータス) の
+    タプルとしてホスト別ステータスキューへ転送するラッパー。
+    """
+
+    def __init__(self, label, host_status_queue, on_status):
+        self._label = label
+        self._host_status_queue = host_status_queue
+        self._on_status = on_status
+
+    def put(self, status, block=True, timeout=None):
+        self._on_status(self._label, status)
+        if self._host_status_queue is not None:
+            self._host_status_queue.put((self._label, status), block, timeout)
+
+
+def parse_targets(text, default_port, user, password):
+    """
+    カンマまたは空白区切りのホスト指定文字列をターゲットのリストに変換する。
+
+    "host" または "host:port" 形式を受け付ける。IPv6アドレスにポートを
+    付ける場合は "[addr]:port" と記述する。
+
+    Args:
+        text (str): ホスト指定文字列 (例: "10.0.0.1, 10.0.0.2:2222")。
+        default_port (int): ポート省略時に使うポート番号。
+        user (str): 全ホスト共通のユーザー名。
+        password (str): 全ホスト共通のパスワード。
+
+    Returns:
+        list: ターゲット({'host', 'port', 'user', 'password'})のリスト。
+
+    Raises:
+        ValueError: ポート番号が無効な場合、同じホストが重複して指定されている場合
+            (実行結果はホストの表示名ごとにまとめるため)。
+    """
+    targets = []
+    labels = set()
+    for token in text.replace(',', ' ').split():
+        host, port = token, default_port
+        if token.startswith('['):
+            # [IPv6]:port 形式
+            addr, _, rest = token[1:].partition(']')
+            host = addr
+            if rest.startswith(':'):
+                port = rest[1:]
+        elif token.count(':') == 1:
+            host, port = token.split(':')
+        try:
+            port = int(port)
+            if not 1 <= port <= 65535:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"ポート番号が無効です: {token}")
+        target = {'host': host, 'port': port, 'user': user, 'password': password}
+        label = target_label(target)
+        if label in labels:
+            raise ValueError(f"同じホストが重複して指定されています: {label}")
+        labels.add(label)
+        targets.append(target)
+    return targets
+
+
+def target_label(target):
+    """ログやステータス表示に使うターゲットの表示名を返す。"""
+    if target.get('name'):
+        return target['name']
+    if target.get('port', 22) != 22:
+        return f"{target['host']}:{target['port']}"
+    return target['host']
+
+
+def execute_fleet(targets, commands, log_queue, status_queue, cancel_event,
+                  max_workers=DEFAULT_MAX_WORKERS, host_status_queue=None, pool=None,
+                  params=None, dedup_output=False, **options):
+    """
+    複数ホストに対して同じコマンドリストを並列に実行する。
+    同時に処理するホスト数は max_workers で制限する。
+    バックグラウンドスレッドで実行されることを想定。
+
+    各ホストのログはホスト名を設定した log_record.LogRecord として log_queue に流れ
+    (表示では "[ホスト名] ..." になる)、
+    ホスト別のステータスは host_status_queue に (ホスト名, ステータス) として送られる。
+    status_queue には全体のステータス (STATUS_*) のみを送る。
+
+    Args:
+        targets (list): ターゲット({'host', 'port', 'user', 'password', 'name'(任意),
+            'transport_profile'(任意), 'jump'(任意), 'vars'(任意)})のリスト。
+            transport_profile / jump を持つターゲットには options の値の代わりにそれを使う。
+            結果は表示名 (target_label) ごとにまとめるため、表示名が重複しないこと
+            (parse_targets / inventory.select_targets のターゲットは重複しない)。
+        commands (list): 実行するコマンドオブジェクトのリスト。
+        log_queue: ログメッセージの送信先キュー。
+        status_queue: 全体ステータスの送信先キュー。
+        cancel_event (threading.Event): キャンセル通知用イベント。
+        max_workers (int): 同時に処理する最大ホスト数。
+        host_status_queue: ホスト別ステータスの送信先キュー (省略可)。
+        pool (connection_pool.ConnectionPool): 接続を再利用する場合の接続プール (省略可)。
+        params (dict): コマンドのテンプレートに埋め込む、全ホスト共通の変数 (省略可)。
+            テンプレートはホストごとに command_template.target_variables() の変数で展開する。
+            変数の不足は呼び出し前に command_template.check_targets() で確認しておくこと。
+        dedup_output (bool): True の場合、各コマンドの出力を受信しながらハッシュを計算し、
+            先に終了したホストと同じ出力は表示せずに1行のメッセージにする
+            (output_dedup を参照)。終了時にコマンドごとの同じ出力のホストをまとめて出力する。
+            output_dedup.OutputGroups を渡した場合はそれを使って比較し、まとめは出力しない
+            (段階実行で全バッチをまとめて比較するため)。
+        **options: execute_ssh_commands にそのまま渡すオプション (pipelined など)。
+
+    Returns:
+        dict: ホスト表示名をキー、execute_ssh_commands の結果
+        ({'status': 最終ステータス, 'exit_codes': {...}, 'outputs': {...}, 'spool': ...,
+        'metrics': metrics.RunMetrics}) を値とする辞書。
+    """
+    # concurrent.futures は logging などを読み込むため、起動時間を抑えるよう使用時に import する
+    from concurrent.futures import ThreadPoolExecutor
+
+    results = {}  # ホスト表示名 -> 最新のステータス
+    details = {}  # ホスト表示名 -> execute_ssh_commands の結果
+    results_lock = threading.Lock()
+    running_reported = threading.Event()
+    if isinstance(dedup_output, output_dedup.OutputGroups):
+        groups = dedup_output
+    else:
+        groups = output_dedup.OutputGroups() if dedup_output else None
+
+    def on_status(label, status):
+        with results_lock:
+            results[label] = status
+        if status == ssh_executor.STATUS_RUNNING and not running_reported.is_set():
+            running_reported.set()
+            status_queue.put(ssh_executor.STATUS_RUNNING)
+
+    def run_host(target):
+        label = target_label(target)
+        host_options = options
+        if groups is not None:
+            host_options = dict(options, dedup=groups.for_host(label))
+        details[label] = execute_target(
+            target, commands, _HostLogQueue(log_queue, label),
+            _HostStatusQueue(label, host_status_queue, on_status),
+            cancel_event, pool=pool, params=params, **host_options)
+
+    status_queue.put(ssh_executor.STATUS_CONNECTING)
+    log_queue.put(f"{len(targets)} 台のホストで実行します (最大同時実行数: {max_workers})")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                thread_name_prefix="ssh-fleet") as executor:
+            futures = [executor.submit(run_host, t) for t in targets]
+            for future in futures:
+                future.result()
+    except Exception as e:
+        import traceback
+        log_queue.put(f"[予期せぬエラー] {e}\n{traceback.format_exc()}")
+        status_queue.put(ssh_executor.STATUS_ERROR)
+        return details
+
+    if groups is not None and groups is not dedup_output:
+        output_dedup.report_groups(details, log_queue)
+    report_summary(results.values(), log_queue, status_queue, cancel_event)
+    return details
+
+
+def execute_target(target, commands, log_queue, status_queue, cancel_event, pool=None,
+                   params=None, **options):
+    """
+    1台のターゲットに対して execute_ssh_commands を実行し、その結果を返す。
+    ターゲットの transport_profile / jump と、テンプレートの展開 (params) を反映する。
+    開始前にキャンセルされていた場合は接続せず、STATUS_STOPPED の結果を返す。
+    """
+    if cancel_event.is_set():
+        # 開始前にキャンセルされたホストは接続しない
+        status_queue.put(ssh_executor.STATUS_STOPPED)
+        run_metrics = metrics.RunMetrics(target['host'], target.get('port', 22), target['user'])
+        run_metrics.finish(ssh_executor.STATUS_STOPPED)
+        return {'status': ssh_executor.STATUS_STOPPED, 'exit_codes': {}, 'outputs': {},
+                'spool': None, 'metrics': run_metrics}
+    host_options = options
+    if target.get('transport_profile') is not None:
+        # インベントリでホストごとに指定された転送設定を優先する
+        host_options = dict(options, transport_profile=target['transport_profile'])
+    if target.get('jump') is not None:
+        # インベントリでホストごとに指定された踏み台 (bastion.JumpHost) を優先する
+        host_options = dict(host_options, jump=target['jump'])
+    host_commands = commands
+    if getattr(commands, 'templates', None):
+        host_commands = commands.render(command_template.target_variables(target, params))
+    return ssh_executor.execute_ssh_commands(
+        target['host'], target.get('port', 22), target['user'], target.get('password'),
+        host_commands, log_queue, status_queue, cancel_event, pool=pool, **host_options)
+
+
+def report_summary(statuses, log_queue, status_queue, cancel_event):
+    """各ホストの最終ステータスを集計してログに出力し、全体のステータスを送信する"""
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    done = counts.get(ssh_executor.STATUS_DONE, 0)
+    errors = counts.get(ssh_executor.STATUS_ERROR, 0)
+    stopped = counts.get(ssh_executor.STATUS_STOPPED, 0)
+    log_queue.put(f"全ホストの処理が終了しました (成功: {done} / エラー: {errors} / 停止: {stopped})")
+
+    if cancel_event.is_set():
+        status_queue.put(ssh_executor.STATUS_STOPPED)
+    elif errors:
+        status_queue.put(ssh_executor.STATUS_ERROR)
+    else:
+        status_queue.put(ssh_executor.STATUS_DONE)
@@ -0,0 +1,372 @@
+# inventory.py
+# ホスト一覧 (インベントリ) の読み込みと、グループ・タグ・名前のパターンによるホストの選択
+import bisect
+import fnmatch
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import bastion
+import config_manager
+
+INVENTORY_FILENAME = "inventory.json"
+# 接続先として扱うホスト変数 (それ以外の変数は vars としてそのまま渡す)
+CONNECTION_VARS = ('address', 'port', 'user', 'transport_profile', 'jump')
+# 読み込み済みのインベントリを保持するファイル数の上限
+CACHE_MAX_ENTRIES = 4
+_WILDCARDS = '*?['
+
+_cache = OrderedDict()  # 絶対パス -> ((mtime_ns, size), Inventory)
+_cache_lock = threading.Lock()
+
+
+def get_inventory_path():
+    """既定のインベントリファイルのパス (設定ファイルと同じフォルダの inventory.json)"""
+    return config_manager.get_config_path().parent / INVENTORY_FILENAME
+
+
+def _check_vars(owner, value):
+    if not isinstance(value, dict):
+        raise ValueError(f"{owner} の vars はオブジェクト({{}})である必要があります。")
+    if 'port' in value:
+        port = value['port']
+        if isinstance(port, bool) or not isinstance(port, int) or not 1 <= port <= 65535:
+            raise ValueError(f"{owner} の port は1から65535の整数である必要があります。")
+    for key in ('address', 'user', 'transport_profile', 'jump'):
+        if key in value and not isinstance(value[key], str):
+            raise ValueError(f"{owner} の {key} は文字列である必要があります。")
+    return value
+
+
+def _as_list(owner, key, value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"{owner} の {key} は文字列または文字列の配列である必要があります。")
+    return value
+
+
+class _GroupTree:
+    """groups の定義から作る、グループの変数・直接のホスト・親子関係"""
+
+    def __init__(self, specs, hosts):
+        self.vars = {}           # グループ名 -> vars
+        self.members = {}        # グループ名 -> groups の hosts に書かれたホスト名の集合
+        self.children = {}       # グループ名 -> 子グループ名のリスト
+        self.parents = {}        # グループ名 -> 親グループ名の集合
+        self.listed_in = {}      # ホスト名 -> hosts にそのホストを書いたグループ名のリスト
+        for name, spec in specs.items():
+            owner = f"グループ '{name}'"
+            if not isinstance(spec, dict):
+                raise ValueError(f"{owner} の定義はオブジェクト({{}})である必要があります。")
+            self.vars[name] = _check_vars(owner, spec.get('vars', {}))
+            members = self.members[name] = set()
+            for host in _as_list(owner, 'hosts', spec.get('hosts')):
+                if host not in hosts:
+                    raise ValueError(f"{owner} のホスト '{host}' は hosts に定義されていません。")
+                members.add(host)
+                self.listed_in.setdefault(host, []).append(name)
+            self.children[name] = _as_list(owner, 'children', spec.get('children'))
+            for child in self.children[name]:
+                self.parents.setdefault(child, set()).add(name)
+
+        # 子グループが先に並ぶ順序 (展開済みのグループは再度たどらない)
+        self.order = []
+        done = set()
+
+        def visit(name, visiting):
+            if name in done or name not in self.children:
+                return
+            if name in visiting:
+                raise ValueError(f"グループ '{name}' の children が循環しています。")
+            visiting.add(name)
+            for child in self.children[name]:
+                visit(child, visiting)
+            visiting.discard(name)
+            done.add(name)
+            self.order.append(name)
+
+        for name in self.children:
+            visit(name, set())
+
+    def ancestors(self, groups):
+        """groups とその親グループを全てたどったグループ名の集合"""
+        result = set()
+        pending = list(groups)
+        while pending:
+            name = pending.pop()
+            if name not in result:
+                result.add(name)
+                pending.extend(self.parents.get(name, ()))
+        return result
+
+
+class Inventory:
+    """
+    ホストの一覧と、選択を高速に行うための索引。
+
+    ファイルの形式:
+        {
+          "vars":   {全ホスト共通の変数},
+          "groups": {"グループ名": {"hosts": [...], "children": [...], "vars": {...}}},
+          "hosts":  {"ホスト名": {"address": ..., "port": ..., "user": ...,
+                                  "transport_profile": ..., "jump": "[user@]host[:port]",
+                                  "tags": [...], "groups": [...], "vars": {...}}}
+        }
+
+    変数は 全体の vars → グループの vars (グループ名順) → ホストの vars →
+    ホストに直接書いた address / port / user / transport_profile / jump の順に上書きされる。
+
+    JSONの解析は読み込み時に全体を行うが、索引は選択に使われたときに種類ごとに作る
+    (名前のパターン → ソート済みのホスト名、tag: → タグの索引、group: → 子グループを
+    含むグループの索引)。ホストの定義の検証と変数の解決は、索引を作るときと
+    選択されたホストに対してのみ行う。変数の解決に使うグループの親子関係は
+    groups の定義だけから作るため、全ホストを走査しない。
+    """
+
+    def __init__(self, data, source=''):
+        if not isinstance(data, dict):
+            raise ValueError("インベントリのルートはオブジェクト({})である必要があります。")
+        self.source = source
+        self._vars = _check_vars("インベントリ", data.get('vars', {}))
+        self._hosts = data.get('hosts', {})     # ホスト名 -> ホストの定義 (未検証)
+        if not isinstance(self._hosts, dict):
+            raise ValueError("インベントリの hosts はオブジェクト({})である必要があります。")
+        self._group_specs = data.get('groups', {})
+        if not isinstance(self._group_specs, dict):
+            raise ValueError("インベントリの groups はオブジェクト({})である必要があります。")
+        self._lock = threading.RLock()
+        self._tree = None            # groups の定義から作る親子関係 (_GroupTree)
+        self._groups = None          # グループ名 -> ホスト名の集合 (子グループを含む)
+        self._tags = None            # タグ -> ホスト名の集合
+        self._sorted_names = None    # ソート済みのホスト名
+
+    def __len__(self):
+        return len(self._hosts)
+
+    @property
+    def groups(self):
+        return sorted(self._group_index())
+
+    @property
+    def tags(self):
+        return sorted(self._tag_index())
+
+    def _host_spec(self, name):
+        """検証済みのホストの定義"""
+        owner = f"ホスト '{name}'"
+        spec = self._hosts[name]
+        if spec is None:
+            return {}
+        if not isinstance(spec, dict):
+            raise ValueError(f"{owner} の定義はオブジェクト({{}})である必要があります。")
+        _check_vars(owner, spec)
+        _check_vars(owner, spec.get('vars', {}))
+        return spec
+
+    def _group_tree(self):
+        """groups の定義だけから作るグループの変数・直接のホスト・親子関係"""
+        with self._lock:
+            if self._tree is None:
+                self._tree = _GroupTree(self._group_specs, self._hosts)
+            return self._tree
+
+    def _tag_index(self):
+        with self._lock:
+            if self._tags is None:
+                tags = {}
+                for name in self._hosts:
+                    owner = f"ホスト '{name}'"
+                    for tag in _as_list(owner, 'tags', self._host_spec(name).get('tags')):
+                        tags.setdefault(tag, set()).add(name)
+                self._tags = tags
+            return self._tags
+
+    def _group_index(self):
+        with self._lock:
+            if self._groups is None:
+                tree = self._group_tree()
+                groups = {name: set(hosts) for name, hosts in tree.members.items()}
+                for name in self._hosts:
+                    owner = f"ホスト '{name}'"
+                    for group in _as_list(owner, 'groups', self._host_spec(name).get('groups')):
+                        groups.setdefault(group, set()).add(name)
+                for name, children in tree.children.items():
+                    for child in children:
+                        if child not in groups:
+                            raise ValueError(
+                                f"グループ '{name}' の子グループ '{child}' が見つかりません。")
+                # 子グループのホストを親グループに含める (子から先に展開する)
+                for name in tree.order:
+                    for child in tree.children[name]:
+                        groups[name] |= groups[child]
+                self._groups = groups
+            return self._groups
+
+    def _name_index(self):
+        with self._lock:
+            if self._sorted_names is None:
+                self._sorted_names = sorted(self._hosts)
+            return self._sorted_names
+
+    def _match_glob(self, pattern):
+        """名前のパターンに一致するホスト名の集合"""
+        wildcard_at = min((pattern.find(c) for c in _WILDCARDS if c in pattern),
+                          default=-1)
+        if wildcard_at == -1:
+            return {pattern} if pattern in self._hosts else set()
+        # ワイルドカードより前の固定部分で、ソート済みの名前から候補を絞り込む
+        prefix = pattern[:wildcard_at]
+        names = self._name_index()
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff') if prefix else len(names)
+        return {name for name in names[start:end] if fnmatch.fnmatchcase(name, pattern)}
+
+    def _match_term(self, term):
+        kind, _, value = term.partition(':')
+        if kind == 'tag' and value:
+            tags = self._tag_index()
+            if any(c in value for c in _WILDCARDS):
+                return set().union(*(hosts for tag, hosts in tags.items()
+                                     if fnmatch.fnmatchcase(tag, value)))
+            return set(tags.get(value, ()))
+        if kind == 'group' and value:
+            groups = self._group_index()
+            if any(c in value for c in _WILDCARDS):
+                return set().union(*(hosts for group, hosts in groups.items()
+                                     if fnmatch.fnmatchcase(group, value)))
+            if value not in groups:
+                raise ValueError(f"グループ '{value}' はインベントリにありません。")
+            return set(groups[value])
+        if term == 'all':
+            return set(self._hosts)
+        return self._match_glob(term)
+
+    def select(self, expression):
+        """
+        選択式に一致するホスト名のリストを返す (インベントリの名前順)。
+
+        選択式はカンマまたは空白で区切った項目の並び:
+            web-*        ホスト名のパターン (* ? [...])
+            tag:arm64    タグ (パターン可)
+            group:lab    グループ (子グループを含む。パターン可)
+            all          全てのホスト
+        先頭に '&' を付けた項目は絞り込み (共通部分)、'!' を付けた項目は除外になる。
+        例: "group:factory, &tag:arm64, !web-0[1-3]"
+
+        Raises:
+            ValueError: 選択式が空の場合、存在しないグループを指定した場合、
+                選択に使う索引の元になるホストやグループの定義が無効な場合。
+        """
+        terms = expression.replace(',', ' ').split()
+        if not terms:
+            raise ValueError("ホストの選択式が空です。")
+        selected, required, excluded = set(), [], set()
+        for term in terms:
+            if term.startswith('&'):
+                required.append(self._match_term(term[1:]))
+            elif term.startswith('!'):
+                excluded |= self._match_term(term[1:])
+            else:
+                selected |= self._match_term(term)
+        if not any(not t.startswith(('&', '!')) for t in terms):
+            selected = set(self._hosts)  # 絞り込みと除外だけの場合は全ホストが対象
+        for hosts in required:
+            selected &= hosts
+        selected -= excluded
+        return sorted(selected)
+
+    def host_vars(self, name):
+        """ホストの変数を全て解決した辞書を返す"""
+        spec = self._host_spec(name)
+        tree = self._group_tree()
+        direct = _as_list(f"ホスト '{name}'", 'groups', spec.get('groups'))
+        resolved = dict(self._vars)
+        for group in sorted(tree.ancestors(direct + tree.listed_in.get(name, []))):
+            resolved.update(tree.vars.get(group, {}))
+        resolved.update(spec.get('vars', {}))
+        resolved.update({key: spec[key] for key in CONNECTION_VARS if key in spec})
+        return resolved
+
+    def to_targets(self, names, default_port, default_user, password, **auth):
+        """
+        ホスト名のリストを fleet_executor のターゲットのリストに変換する。
+        インベントリに port / user がないホストは default_port / default_user を使う。
+        transport_profile は config_manager の転送設定に、jump (踏み台) は共有の
+        bastion.JumpHost に解決する (踏み台のユーザー名の省略時はホストのユーザー名、
+        パスワードは password、認証のオプションは auth を使う)。
+
+        Raises:
+            ValueError: ユーザー名が決まらないホストや、存在しない転送設定、
+                無効な踏み台を指定したホスト、定義が無効なホストがある場合。
+        """
+        targets = []
+        profiles = {}
+        for name in names:
+            host_vars = self.host_vars(name)
+            user = host_vars.get('user') or default_user
+            if not user:
+                raise ValueError(f"ホスト '{name}' のユーザー名が指定されていません。")
+            target = {'name': name, 'host': host_vars.get('address', name),
+                      'port': host_vars.get('port', default_port), 'user': user,
+                      'password': password,
+                      'vars': {k: v for k, v in host_vars.items() if k not in CONNECTION_VARS}}
+            profile_name = host_vars.get('transport_profile')
+            if profile_name:
+                if profile_name not in profiles:
+                    profiles[profile_name] = config_manager.get_transport_profile(profile_name)
+                target['transport_profile'] = profiles[profile_name]
+            jump = host_vars.get('jump')
+            if jump:
+                target['jump'] = bastion.get_jump_host(
+                    bastion.parse_jump(jump, default_user=user), password, **auth)
+            targets.append(target)
+        return targets
+
+
+def load_inventory(path=None):
+    """
+    インベントリファイルを読み込む。省略時は既定のパス (get_inventory_path)。
+    更新日時とサイズが変わっていないファイルは前回読み込んだ Inventory を返す。
+    JSONの解析とルートの形式の確認はここで行い、索引とホストの定義の検証は
+    選択時に必要な分だけ行う (Inventory を参照)。
+
+    Raises:
+        FileNotFoundError: ファイルが存在しない場合。
+        json.JSONDecodeError: JSONの解析に失敗した場合。
+        ValueError: インベントリのルート・vars・hosts・groups の形式が無効な場合
+            (ホストやグループの定義の誤りは select / to_targets が報告する)。
+    """
+    path = os.path.abspath(str(path or get_inventory_path()))
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _cache.move_to_end(path)
+            return cached[1]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        result = Inventory(json.load(f), path)
+
+    with _cache_lock:
+        _cache[path] = (signature, result)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+def select_targets(expression, default_port, default_user, password, path=None, **auth):
+    """
+    インベントリを読み込み、選択式に一致するホストのターゲットのリストを返す。
+    auth は踏み台の認証のオプション (Inventory.to_targets を参照)。
+    """
+    inv = load_inventory(path)
+    names = inv.select(expression)
+    if not names:
+        raise ValueError(f"選択式 '{expression}' に一致するホストがありません。")
+    return inv.to_targets(names, default_port, default_user, password, **auth)
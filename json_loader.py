@@ -1,60 +1,433 @@
 # json_loader.py
+import heapq
 import json
 import os
+import re
+import threading
+from collections import OrderedDict
 
+import command_template
 
-def load_commands_from_json(filepath):
+
+class CommandList(list):
+    """
+    検証済みのコマンドオブジェクトのリスト。
+
+    通常の list として扱えるほか、読み込み時に解析した依存関係と
+    command / description のテンプレート ({{ 変数名 }}。command_template を参照) を保持する。
+
+    Attributes:
+        dependencies (list): 各コマンドが依存するコマンドの位置 (インデックス) のタプル。
+        order (tuple): 依存関係を満たす実行順 (トポロジカル順序) のインデックス。
+        has_dependencies (bool): いずれかのコマンドに depends_on が指定されているか。
+        has_transfers (bool): ファイル転送 (upload / download) を含むか。
+        has_timeouts (bool): いずれかのコマンドに timeout が指定されているか。
+        templates (list): (インデックス, 項目名, command_template.Template) のリスト。
+        variables (frozenset): テンプレートで使われている変数名。
+    """
+
+    def __init__(self, commands=(), dependencies=None, order=None, templates=None):
+        super().__init__(commands)
+        if dependencies is None:
+            dependencies, order = plan_dependencies(self)
+        self.dependencies = dependencies
+        self.order = order
+        self.has_dependencies = any(dependencies)
+        self.has_transfers = any('upload' in c or 'download' in c for c in self)
+        self.has_timeouts = any('timeout' in c for c in self)
+        if templates is None:
+            templates = command_template.compile_commands(self)
+        self.templates = templates
+        self.variables = frozenset().union(*(t.variables for _, _, t in templates))
+        self._slots = tuple({slot for _, _, t in templates for slot in t.slots})
+
+    @property
+    def has_templates(self):
+        return bool(self.templates)
+
+    def missing_variables(self, values):
+        """values に含まれていないテンプレートの変数名 (ソート済みのリスト)"""
+        return sorted(name for name in self.variables if name not in values)
+
+    def render(self, values):
+        """
+        テンプレートに変数の値を埋め込んだ CommandList を返す。
+        テンプレートを含まないコマンドオブジェクトは元のものを共有する。
+
+        Raises:
+            ValueError: 値が指定されていない変数がある場合。
+        """
+        if not self.templates:
+            return self
+        missing = self.missing_variables(values)
+        if missing:
+            raise ValueError(f"テンプレートの変数が定義されていません: {', '.join(missing)}")
+        # 変数ごとの文字列への変換とフィルターの適用は1回だけ行う
+        resolved = command_template.resolve_slots(self._slots, values)
+        rendered = list(self)
+        copied = set()
+        for index, field, template in self.templates:
+            if index not in copied:
+                rendered[index] = dict(rendered[index])
+                copied.add(index)
+            rendered[index][field] = template.render_resolved(resolved)
+        result = list.__new__(CommandList)
+        list.__init__(result, rendered)
+        # 展開で変わるのは文字列だけなので、解析済みの情報はそのまま引き継ぐ
+        result.__dict__.update(self.__dict__, templates=[], variables=frozenset(), _slots=())
+        return result
+
+
+def plan_dependencies(commands):
+    """
+    コマンドの id / depends_on から依存関係を解決し、実行順を求める。
+
+    depends_on はコマンドの id (文字列) またはそのリストで指定する。
+    実行順は依存関係を満たす範囲でファイル上の順序を優先する。
+
+    Args:
+        commands (list): コマンドオブジェクトのリスト。
+
+    Returns:
+        tuple: (dependencies, order)。dependencies は各コマンドが依存する
+        コマンドのインデックスのタプルのリスト、order は実行順のインデックスのタプル。
+
+    Raises:
+        ValueError: id の重複、存在しない id への依存、循環依存がある場合。
+    """
+    if not any('depends_on' in cmd_obj for cmd_obj in commands):
+        # 依存関係がない場合はファイル順に実行する (id の重複のみ確認)
+        ids = set()
+        for i, cmd_obj in enumerate(commands):
+            cmd_id = cmd_obj.get('id')
+            if cmd_id is not None and cmd_id in ids:
+                break
+            ids.add(cmd_id)
+        else:
+            return [()] * len(commands), tuple(range(len(commands)))
+
+    ids = {}
+    for i, cmd_obj in enumerate(commands):
+        cmd_id = cmd_obj.get('id')
+        if cmd_id is None:
+            continue
+        if cmd_id in ids:
+            raise ValueError(
+                f"JSON配列の {i+1} 番目の要素の id '{cmd_id}' は {ids[cmd_id]+1} 番目の要素と重複しています。")
+        ids[cmd_id] = i
+
+    dependencies = []
+    for i, cmd_obj in enumerate(commands):
+        depends_on = cmd_obj.get('depends_on') or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        indices = []
+        for dep_id in depends_on:
+            if dep_id not in ids:
+                raise ValueError(
+                    f"JSON配列の {i+1} 番目の要素が存在しない id '{dep_id}' に依存しています。")
+            if ids[dep_id] == i:
+                raise ValueError(f"JSON配列の {i+1} 番目の要素が自分自身に依存しています。")
+            if ids[dep_id] not in indices:
+                indices.append(ids[dep_id])
+        dependencies.append(tuple(indices))
+
+    # Kahnのアルゴリズムでトポロジカル順序を求める (同時に実行可能なものはファイル順)
+    remaining = [len(deps) for deps in dependencies]
+    dependents = [[] for _ in commands]
+    for i, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(i)
+    ready = [i for i, count in enumerate(remaining) if count == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        i = heapq.heappop(ready)
+        order.append(i)
+        for dependent in dependents[i]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, dependent)
+
+    if len(order) != len(commands):
+        cycle = [f"{i+1}" for i, count in enumerate(remaining) if count > 0]
+        raise ValueError(
+            f"コマンドの依存関係が循環しています (関係する要素: {', '.join(cycle)} 番目)。")
+    return dependencies, tuple(order)
+
+
+# ストリーミング読み込みで一度に読み込む文字数
+READ_CHUNK_SIZE = 65536
+# 解析済みのコマンドリストを保持するファイル数の上限
+CACHE_MAX_ENTRIES = 8
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DELIMITER = re.compile(r'[ \t\n\r]*([,\]])[ \t\n\r]*')
+
+_cache = OrderedDict()  # 絶対パス -> ((mtime_ns, size), CommandList)
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    """解析済みのコマンドリストのキャッシュを破棄する。"""
+    with _cache_lock:
+        _cache.clear()
+
+
+def _validate_transfer(i, kind, spec, base_dir):
+    """upload / download の指定を検証し、{'src': ..., 'dest': ...} を返す。"""
+    if not isinstance(spec, dict) or not all(
+            isinstance(spec.get(key), str) and spec[key].strip() for key in ('src', 'dest')):
+        raise ValueError(
+            f"JSON配列の {i+1} 番目の要素の '{kind}' には、空でない文字列の 'src' と 'dest' が必須です。")
+    src, dest = spec['src'], spec['dest']
+    # ローカル側の相対パスはJSONファイルのフォルダを基準にする
+    if kind == 'upload':
+        src = os.path.join(base_dir, src)
+    else:
+        dest = os.path.join(base_dir, dest)
+    return {'src': src, 'dest': dest}
+
+
+def _validate_item(i, item, base_dir=''):
+    """JSON配列の i 番目の要素を検証し、コマンドオブジェクトを返す。"""
+    if not isinstance(item, dict):
+        raise ValueError(
+            f"JSON配列の {i+1} 番目の要素が無効です。オブジェクト({{}})である必要があります。")
+    kinds = [key for key in ('command', 'upload', 'download') if key in item]
+    if len(kinds) > 1:
+        raise ValueError(
+            f"JSON配列の {i+1} 番目の要素には 'command'、'upload'、'download' のいずれか1つだけを指定してください。")
+
+    if kinds and kinds[0] != 'command':
+        # ファイル転送 (file_transfer を参照)
+        command_obj = {kinds[0]: _validate_transfer(i, kinds[0], item[kinds[0]], base_dir)}
+    elif 'command' not in item or not isinstance(item['command'], str) or not item['command'].strip():
+        raise ValueError(
+            f"JSON配列の {i+1} 番目の要素に、空でない文字列の 'command' キーが必須です。")
+    else:
+        # 有効なコマンドのみをリストに追加（必要に応じて他のキーも検証・保持）
+        command_obj = {'command': item['command']}
+    if 'description' in item and isinstance(item['description'], str):
+        command_obj['description'] = item['description']
+
+    # 成功済みなら再実行しない (オプション。run_journal を参照)
+    if 'cache' in item:
+        if not isinstance(item['cache'], bool):
+            raise ValueError(
+                f"JSON配列の {i+1} 番目の要素の 'cache' は true または false である必要があります。")
+        if item['cache']:
+            command_obj['cache'] = True
+
+    # コマンドごとのタイムアウト秒数 (オプション)
+    if 'timeout' in item:
+        timeout = item['timeout']
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not timeout > 0:
+            raise ValueError(
+                f"JSON配列の {i+1} 番目の要素の 'timeout' は正の数 (秒) である必要があります。")
+        command_obj['timeout'] = timeout
+
+    # 依存関係 (オプション)
+    if 'id' in item:
+        if not isinstance(item['id'], str) or not item['id'].strip():
+            raise ValueError(
+                f"JSON配列の {i+1} 番目の要素の 'id' は空でない文字列である必要があります。")
+        command_obj['id'] = item['id']
+    if 'depends_on' in item:
+        depends_on = item['depends_on']
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if not isinstance(depends_on, list) or not all(isinstance(d, str) for d in depends_on):
+            raise ValueError(
+                f"JSON配列の {i+1} 番目の要素の 'depends_on' は id の文字列または文字列の配列である必要があります。")
+        command_obj['depends_on'] = depends_on
+    return command_obj
+
+
+class _ArrayStream:
+    """
+    ファイルを少しずつ読み込み、ルートの配列の要素を1つずつ取り出すクラス。
+
+    ファイル全体を文字列として読み込まずに済むよう、読み込み済みの部分のうち
+    解析し終えた部分は破棄する。エラー位置はファイル先頭からの位置で報告する。
+    """
+
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0        # バッファ内の解析位置
+        self._eof = False
+        self._base_pos = 0   # 破棄した文字数
+        self._base_line = 1  # 破棄した部分の行数
+        self._base_col = 0   # 破棄した部分の最終行の文字数
+
+    def _fill(self):
+        """データを追加で読み込む。ファイル末尾に達していれば False を返す。"""
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        if self._pos:
+            consumed = self._buffer[:self._pos]
+            newlines = consumed.count('\n')
+            if newlines:
+                self._base_line += newlines
+                self._base_col = len(consumed) - consumed.rfind('\n') - 1
+            else:
+                self._base_col += len(consumed)
+            self._base_pos += self._pos
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += chunk
+        return True
+
+    def _error(self, msg, pos):
+        """ファイル先頭からの位置を持つ JSONDecodeError を作る"""
+        error = json.JSONDecodeError(msg, self._buffer, pos)
+        line = self._base_line + self._buffer.count('\n', 0, pos)
+        if line == self._base_line:
+            column = self._base_col + pos + 1
+        else:
+            column = pos - self._buffer.rfind('\n', 0, pos)
+        error.pos = self._base_pos + pos
+        error.lineno, error.colno = line, column
+        error.args = (f"{msg}: line {line} column {column} (char {error.pos})",)
+        return error
+
+    def _next_char(self):
+        """空白を読み飛ばし、次の文字を返す (ファイル末尾なら空文字列)"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _decode_value(self):
+        """現在位置から値を1つ解析する。値が途中で切れている場合は追加で読み込む。"""
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue  # 値の途中でバッファが終わっていた
+                raise self._error(f"JSON解析エラー: {e.msg}", e.pos)
+            # 数値などはバッファの末尾で切れていても解析できてしまうため、続きを確認する
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        first = self._next_char()
+        if first != '[':
+            if not first:
+                raise self._error("JSON解析エラー: Expecting value", self._pos)
+            # 配列以外の値は構文を確認してから形式エラーとする
+            self._decode_value()
+            raise ValueError("JSONファイルの形式が無効です。ルート要素は配列([])である必要があります。")
+        self._pos += 1
+        if self._next_char() == ']':
+            self._pos += 1
+        else:
+            at_value = True  # 現在位置が空白を読み飛ばした値の先頭か
+            while True:
+                if not at_value and not self._next_char():
+                    raise self._error("JSON解析エラー: Expecting value", self._pos)
+                yield self._decode_value()
+                # 区切り文字と続く空白がバッファ内に収まっていれば正規表現1回で読み飛ばす
+                match = _DELIMITER.match(self._buffer, self._pos)
+                if match is not None and match.end() < len(self._buffer):
+                    self._pos = match.end()
+                    if match.group(1) == ']':
+                        break
+                    at_value = True
+                    continue
+                at_value = False
+                separator = self._next_char()
+                self._pos += 1
+                if separator == ']':
+                    break
+                if separator != ',':
+                    raise self._error(
+                        "JSON解析エラー: Expecting ',' delimiter", self._pos - 1)
+        if self._next_char():
+            raise self._error("JSON解析エラー: Extra data", self._pos)
+
+
+def _parse_commands(f, base_dir=''):
+    """ファイルを読み込みながら要素を検証し、CommandList を返す"""
+    validated_commands = [_validate_item(i, item, base_dir)
+                          for i, item in enumerate(_ArrayStream(f))]
+    # 依存関係の検証と実行順の計算は読み込み時に一度だけ行う
+    return CommandList(validated_commands)
+
+
+def load_commands_from_json(filepath, use_cache=True):
     """
     指定されたファイルパスからJSONを読み込み、コマンドオブジェクトのリストを返す。
 
+    ファイルは少しずつ読み込みながら要素ごとに検証するため、大きなファイルでも
+    全体を一度にメモリへ読み込まない。解析・検証済みの結果はパス・更新日時・サイズを
+    キーとしてキャッシュし、変更のないファイルの再読み込みでは解析と検証を省略する。
+    キャッシュされたリストは共有されるため、呼び出し側で変更しないこと。
+
     Args:
         filepath (str): JSONファイルのパス。
+        use_cache (bool): False の場合はキャッシュを使わずに必ず読み込む。
 
     Returns:
-        list: コマンドオブジェクト({'command': '...', 'description': '...'})のリスト。
+        CommandList: コマンドオブジェクト({'command': '...', 'description': '...'})のリスト。
+            依存関係 (id / depends_on) を解析した結果を属性として持つ。
 
     Raises:
         FileNotFoundError: ファイルが存在しない場合。
         json.JSONDecodeError: JSONの解析に失敗した場合。
-        ValueError: JSONの形式が無効な場合 (ルートがリストでない、要素が無効など)。
+        ValueError: JSONの形式が無効な場合 (ルートがリストでない、要素が無効、依存関係が循環しているなど)。
         IOError: ファイル読み込みに関するその他のエラー。
     """
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"ファイルが見つかりません: {filepath}")
 
+    path = os.path.abspath(filepath)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise IOError(f"ファイル読み込みエラー: {e}")
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    if use_cache:
+        with _cache_lock:
+            cached = _cache.get(path)
+            if cached is not None and cached[0] == signature:
+                _cache.move_to_end(path)
+                return cached[1]
+
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError as e:
+        with open(path, 'r', encoding='utf-8') as f:
+            commands = _parse_commands(f, os.path.dirname(path))
+            after = os.fstat(f.fileno())
+    except (json.JSONDecodeError, ValueError):
         # JSONDecodeErrorはエラーメッセージに役立つ情報が含まれているのでそのまま送出
-        raise json.JSONDecodeError(f"JSON解析エラー: {e.msg}", e.doc, e.pos)
+        raise
     except IOError as e:
         raise IOError(f"ファイル読み込みエラー: {e}")
     except Exception as e:
         # 予期せぬエラー
         raise Exception(f"ファイルの処理中に予期せぬエラーが発生しました: {e}")
 
-    # 構造の検証
-    if not isinstance(data, list):
-        raise ValueError("JSONファイルの形式が無効です。ルート要素は配列([])である必要があります。")
-
-    # 配列内の要素を検証 (オプションだが推奨)
-    validated_commands = []
-    for i, item in enumerate(data):
-        if not isinstance(item, dict):
-            raise ValueError(
-                f"JSON配列の {i+1} 番目の要素が無効です。オブジェクト({{}})である必要があります。")
-        if 'command' not in item or not isinstance(item['command'], str) or not item['command'].strip():
-            raise ValueError(
-                f"JSON配列の {i+1} 番目の要素に、空でない文字列の 'command' キーが必須です。")
-
-        # 有効なコマンドのみをリストに追加（必要に応じて他のキーも検証・保持）
-        command_obj = {'command': item['command']}
-        if 'description' in item and isinstance(item['description'], str):
-            command_obj['description'] = item['description']
-        validated_commands.append(command_obj)
-
-    return validated_commands
+    # 読み込み中に変更されたファイルはキャッシュしない
+    if use_cache and (after.st_mtime_ns, after.st_size) == signature:
+        with _cache_lock:
+            _cache[path] = (signature, commands)
+            _cache.move_to_end(path)
+            while len(_cache) > CACHE_MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return commands
 
 
 # --- テスト用 ---
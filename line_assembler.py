@@ -0,0 +1,91 @@
+# line_assembler.py
+import codecs
+
+# 改行が現れないまま溜まった場合に、途中で1行として送り出すバイト数
+DEFAULT_MAX_LINE_BYTES = 64 * 1024
+
+
+class LineAssembler:
+    """
+    受信したバイト列のチャンクを行単位の文字列に組み立てるクラス。
+
+    各チャンクは一度だけ走査し、確定した行はまとめてデコードする。
+    未確定の行の断片は再利用される bytearray に保持するため、
+    チャンクごとにバッファ全体をコピーし直すことはない。
+    デコードにはインクリメンタルデコーダを使用するので、
+    チャンクの境界で分断されたマルチバイト文字も正しく復元される。
+    raw=True の場合はデコードせず、行をバイト列のまま返す (デコードは表示する側で行う)。
+    """
+
+    def __init__(self, encoding='utf-8', max_line_bytes=DEFAULT_MAX_LINE_BYTES, raw=False):
+        self._buffer = bytearray()
+        self._decoder = codecs.getincrementaldecoder(
+            encoding)(errors='replace')
+        self._max_line_bytes = max_line_bytes
+        self._raw = raw
+
+    def feed(self, data):
+        """
+        チャンクを追加し、確定した行のリストを返す。
+
+        Args:
+            data (bytes): 受信したデータ。
+
+        Returns:
+            list: 改行で確定した行 (改行文字を含まない str。raw=True の場合は bytes) のリスト。
+        """
+        buffer = self._buffer
+        scanned = len(buffer)  # 既存の断片には改行がないので新しい部分だけ走査する
+        buffer += data
+        last_newline = buffer.rfind(b'\n', scanned)
+        if last_newline != -1:
+            with memoryview(buffer) as view:
+                if self._raw:
+                    lines = bytes(view[:last_newline]).split(b'\n')
+                else:
+                    lines = self._decoder.decode(view[:last_newline]).split('\n')
+            del buffer[:last_newline + 1]
+        else:
+            lines = []
+
+        if len(buffer) > self._max_line_bytes:
+            # 改行のない巨大な出力はメモリを抑えるため途中で送り出す
+            # (文字の途中で切れた場合はデコーダが残りを保持する。raw=True の場合は
+            # 途中で切れた文字の先頭のバイトを次の行に残す)
+            if self._raw:
+                cut = _utf8_boundary(buffer)
+                lines.append(bytes(buffer[:cut]))
+                del buffer[:cut]
+            else:
+                lines.append(self._decoder.decode(bytes(buffer)))
+                del buffer[:]
+        return lines
+
+    def flush(self):
+        """
+        改行で終わっていない残りのデータを返し、内部状態をリセットする。
+
+        Returns:
+            str: 残りの文字列 (残りがない場合は空文字列。raw=True の場合は bytes)。
+        """
+        if self._raw:
+            rest = bytes(self._buffer)
+            del self._buffer[:]
+            return rest
+        text = self._decoder.decode(bytes(self._buffer), final=True)
+        del self._buffer[:]
+        self._decoder.reset()
+        return text
+
+
+def _utf8_boundary(buffer):
+    """末尾で途中までしか届いていないUTF-8の文字を除いた長さを返す"""
+    end = len(buffer)
+    for back in range(1, min(4, end) + 1):
+        byte = buffer[end - back]
+        if byte & 0xC0 != 0x80:  # 文字の先頭のバイト
+            width = 2 if byte >= 0xC0 else 1
+            width = 3 if byte >= 0xE0 else width
+            width = 4 if byte >= 0xF0 else width
+            return end - back if width > back else end
+    return end
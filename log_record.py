@@ -0,0 +1,272 @@
+# log_record.py
+# 実行ログの1件分のレコードと、実行ログファイル (JSONL / バイナリ) の書き込み・読み出し。
+# 表示用の文字列への変換 (format_record) は表示する側 (GUI / CLI) で行う
+import datetime
+import json
+import mmap
+import os
+import struct
+import time
+
+import config_manager
+
+# レコードの種類 (stream)
+STREAM_MESSAGE = "message"  # 接続・実行状況などのメッセージ
+STREAM_STDOUT = "stdout"
+STREAM_STDERR = "stderr"
+STREAMS = (STREAM_MESSAGE, STREAM_STDOUT, STREAM_STDERR)
+_STREAM_CODES = {stream: code for code, stream in enumerate(STREAMS)}
+
+# 実行ログファイルの形式
+FORMAT_JSONL = "jsonl"
+FORMAT_BINARY = "binary"
+RUN_LOG_DIRNAME = "runs"  # 設定ファイルと同じフォルダの下に作る
+# バイナリ形式のファイルの先頭
+BINARY_MAGIC = b'SSHRLOG1'
+# レコードの本体: 種類, 時刻 (UNIX時間), コマンドの位置 (-1 はなし) + データ
+_BODY = struct.Struct('<Bdi')
+# バイナリ形式の1件: ホスト番号, 本体の長さ + 本体。ホスト番号に HOST_DEFINITION を立てた
+# 件はホスト名の定義 (本体はホスト名)。ホスト番号 0 はホストなし
+_ENTRY = struct.Struct('<II')
+HOST_DEFINITION = 0x80000000
+# 書き込みをまとめる単位 (バイト)
+WRITE_BUFFER_SIZE = 256 * 1024
+# JSONL 形式の1行 (json.dumps はオプションを指定すると呼び出しごとにエンコーダーを作るため使い回す)
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+class LogRecord:
+    """
+    ログの1件。data はコマンド出力の場合は受信したままのバイト列 (改行を含まない1行)、
+    メッセージの場合は文字列。host は複数ホストの実行でのホスト表示名 (1台の場合は None)、
+    step はコマンドリスト上の位置 (コマンドに属さない場合は None)。
+    parallel はコマンドを並列に実行している場合に True (表示時にコマンド番号を付ける)。
+    """
+
+    __slots__ = ('time', 'host', 'step', 'stream', 'data', 'parallel')
+
+    def __init__(self, stream, data, step=None, host=None, timestamp=None, parallel=False):
+        self.time = time.time() if timestamp is None else timestamp
+        self.host = host
+        self.step = step
+        self.stream = stream
+        self.data = data
+        self.parallel = parallel
+
+    @property
+    def text(self):
+        """data を文字列として返す (不正なUTF-8は置換文字にする)"""
+        data = self.data
+        return data if isinstance(data, str) else data.decode('utf-8', 'replace')
+
+    def to_dict(self):
+        return {'time': self.time, 'host': self.host, 'step': self.step,
+                'stream': self.stream, 'text': self.text, 'parallel': self.parallel}
+
+    def __repr__(self):
+        return (f"LogRecord({self.stream!r}, {self.data!r}, step={self.step!r}, "
+                f"host={self.host!r})")
+
+
+def message(text, step=None):
+    """メッセージのレコードを作る"""
+    return LogRecord(STREAM_MESSAGE, text, step)
+
+
+def to_record(item, host=None):
+    """ログキューの要素 (文字列または LogRecord) を LogRecord にする"""
+    if isinstance(item, LogRecord):
+        return item
+    return LogRecord(STREAM_MESSAGE, item, host=host)
+
+
+def format_record(item):
+    """ログキューの要素を表示用の1行にする (文字列はそのまま返す)"""
+    if not isinstance(item, LogRecord):
+        return item
+    if item.stream == STREAM_MESSAGE:
+        text = item.text
+    else:
+        tag = f"#{item.step + 1} " if item.parallel and item.step is not None else ''
+        text = f"[{tag}{item.stream}] {item.text}"
+    return f"[{item.host}] {text}" if item.host is not None else text
+
+
+# --- バイナリ形式 (sharded_executor のプロセス間の転送と共通) ---
+def encode(record):
+    """LogRecord をバイト列にする (host は含めない)"""
+    data = record.data
+    if isinstance(data, str):
+        data = data.encode('utf-8', 'replace')
+    step = -1 if record.step is None else record.step
+    if record.parallel:
+        step = -2 - step  # 並列実行の出力は負の値で表す (-1 はコマンドなし)
+    return _BODY.pack(_STREAM_CODES[record.stream], record.time, step) + data
+
+
+def decode(body, host=None):
+    """encode() のバイト列を LogRecord に戻す。メッセージの data は文字列にする"""
+    code, timestamp, step = _BODY.unpack_from(body)
+    stream = STREAMS[code]
+    data = bytes(body[_BODY.size:])
+    if stream == STREAM_MESSAGE:
+        data = data.decode('utf-8', 'replace')
+    parallel = step < -1
+    if parallel:
+        step = -2 - step
+    return LogRecord(stream, data, None if step == -1 else step, host, timestamp, parallel)
+
+
+# --- 実行ログファイル ---
+def get_run_log_dir():
+    """GUIで実行ログを保存するフォルダ"""
+    return config_manager.get_config_path().parent / RUN_LOG_DIRNAME
+
+
+def new_run_log_path(file_format=FORMAT_JSONL, number=1):
+    """
+    実行ごとの新しい実行ログファイルのパス (実行ログのフォルダ内、開始日時の名前)。
+    number が2以上の場合は日時の後に "-番号" を付ける。
+    """
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    if number > 1:
+        stamp += f"-{number}"
+    suffix = '.jsonl' if file_format == FORMAT_JSONL else '.sshlog'
+    return get_run_log_dir() / f"run-{stamp}{suffix}"
+
+
+def open_new_run_log(file_format=FORMAT_JSONL):
+    """
+    実行ごとの新しい実行ログファイルを作成し、RunLogWriter を返す。
+    同じ秒に開始した実行のファイルを上書きしないよう、同じ名前のファイルが既にある
+    場合は番号を付けた名前で作成する。
+    """
+    number = 1
+    while True:
+        try:
+            return RunLogWriter(new_run_log_path(file_format, number), file_format, exclusive=True)
+        except FileExistsError:
+            number += 1
+
+
+def format_for_path(path):
+    """拡張子から実行ログファイルの形式を決める (.jsonl は JSONL、それ以外はバイナリ)"""
+    return FORMAT_JSONL if str(path).lower().endswith('.jsonl') else FORMAT_BINARY
+
+
+class RunLogWriter:
+    """
+    ログキューの要素を実行ログファイルに追記する。
+
+    書き込みはメモリ上でまとめ、WRITE_BUFFER_SIZE ごとにファイルへ書き出す
+    (数GBのログでも1件ごとにシステムコールを呼ばない)。JSONL 形式は1行1件の
+    JSON (コマンド出力の不正なUTF-8は置換文字になる)、バイナリ形式は受信した
+    バイト列をそのまま保存し、ホスト名は最初の1回だけ書く。
+    1つのスレッド (ログキューを読み出すスレッド) から使うこと。
+    exclusive=True の場合は新しいファイルとして作成する (既にあれば FileExistsError)。
+    """
+
+    def __init__(self, path, file_format=None, exclusive=False):
+        self.path = str(path)
+        self.format = file_format or format_for_path(path)
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'xb' if exclusive else 'wb')
+        self._buffer = bytearray()
+        self._hosts = {None: 0}  # ホスト名 -> ホスト番号 (バイナリ形式)
+        if self.format == FORMAT_BINARY:
+            self._buffer += BINARY_MAGIC
+
+    def write(self, item):
+        """ログキューの要素 (文字列または LogRecord) を1件書き込む"""
+        record = to_record(item)
+        buffer = self._buffer
+        if self.format == FORMAT_JSONL:
+            buffer += _encode_json(record.to_dict()).encode('utf-8')
+            buffer += b'\n'
+        else:
+            host_id = self._hosts.get(record.host)
+            if host_id is None:
+                host_id = self._hosts[record.host] = len(self._hosts)
+                name = record.host.encode('utf-8')
+                buffer += _ENTRY.pack(host_id | HOST_DEFINITION, len(name))
+                buffer += name
+            body = encode(record)
+            buffer += _ENTRY.pack(host_id, len(body))
+            buffer += body
+        self.count += 1
+        if len(buffer) >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_run_log(path, host=None, stream=None, step=None):
+    """
+    実行ログファイル (JSONL / バイナリ。形式はファイルの先頭で判定する) の
+    レコードを順に返す。host / stream / step を指定した場合は一致するものだけを返す。
+    バイナリ形式では、条件に一致しないレコードは本体を復元せずに読み飛ばす。
+    """
+    with open(path, 'rb') as f:
+        is_binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        if not is_binary:
+            f.seek(0)
+            # ホスト名を含まない行は JSON として解析せずに読み飛ばす
+            needle = _encode_json(host).encode('utf-8') if host is not None else None
+            for line in f:
+                if not line.strip() or (needle is not None and needle not in line):
+                    continue
+                item = json.loads(line)
+                if (host is not None and item['host'] != host) or \
+                        (stream is not None and item['stream'] != stream) or \
+                        (step is not None and item['step'] != step):
+                    continue
+                data = item['text']
+                if item['stream'] != STREAM_MESSAGE:
+                    data = data.encode('utf-8')
+                # parallel を持たない以前の形式のファイルも読み込めるようにする
+                yield LogRecord(item['stream'], data, item['step'], item['host'], item['time'],
+                                item.get('parallel', False))
+            return
+        # 数GBのファイルでも全体を読み込まないよう、メモリマップして順に参照する
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    names = {0: None}
+    wanted_code = None if stream is None else _STREAM_CODES[stream]
+    offset = len(BINARY_MAGIC)
+    try:
+        while offset + _ENTRY.size <= len(data):
+            host_id, length = _ENTRY.unpack_from(data, offset)
+            offset += _ENTRY.size
+            start, offset = offset, offset + length
+            if offset > len(data):
+                break  # 書き込みの途中で終了したファイルの末尾は読み飛ばす
+            if host_id & HOST_DEFINITION:
+                names[host_id & ~HOST_DEFINITION] = data[start:offset].decode('utf-8')
+                continue
+            name = names[host_id]
+            if host is not None and name != host:
+                continue
+            if wanted_code is not None and data[start] != wanted_code:
+                continue
+            record = decode(data[start:offset], name)
+            if step is not None and record.step != step:
+                continue
+            yield record
+    finally:
+        data.close()
@@ -0,0 +1,286 @@
+# log_store.py
+# ログビューア (log_viewer.py) 用のログの保存先と索引。
+# 行はホスト・コマンド・種類・重要度ごとの索引とともに追記し、表示する側は
+# 条件に一致する行番号の一覧 (LogView) から表示範囲の行だけを読み出す
+import bisect
+import re
+from array import array
+
+import log_record
+import output_capture
+
+# 重要度 (メッセージ・出力とも内容から判定する)
+SEVERITY_INFO = 0
+SEVERITY_WARNING = 1
+SEVERITY_ERROR = 2
+SEVERITY_NAMES = {SEVERITY_INFO: "情報", SEVERITY_WARNING: "警告", SEVERITY_ERROR: "エラー"}
+_ERROR_PATTERN = re.compile(
+    "エラー|失敗|タイムアウト|(?i:\\b(?:error|fatal|failed|failure|panic|traceback)\\b)".encode('utf-8'))
+_WARNING_PATTERN = re.compile("警告|注意|(?i:\\bwarn(?:ing)?\\b)".encode('utf-8'))
+
+_STREAM_CODES = {stream: code for code, stream in enumerate(log_record.STREAMS)}
+# 文字列検索でファイルから一度に読み出す大きさ (バイト)
+SEARCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def classify(data):
+    """行 (バイト列) の重要度を返す"""
+    if _ERROR_PATTERN.search(data):
+        return SEVERITY_ERROR
+    if _WARNING_PATTERN.search(data):
+        return SEVERITY_WARNING
+    return SEVERITY_INFO
+
+
+class LogStore:
+    """
+    ログの全ての行を保持し、ホスト・コマンド・種類・重要度ごとの索引を追記のたびに更新する。
+
+    行の属性 (時刻, ホスト, コマンドの位置, 種類, 重要度) は行番号で引ける配列に、
+    本文は改行区切りで1つのバッファに保存する。on_disk=True の場合は本文を一時ファイル
+    (output_capture.OutputSpool) に書き出し、メモリには属性と索引だけを残す。
+    索引は条件ごとの行番号の昇順の配列で、重要度の索引はその重要度以上の行を持つ。
+    複数行のメッセージは1行ずつに分けて保存する。
+    1つのスレッド (GUIのスレッド) から使うこと。
+    """
+
+    def __init__(self, on_disk=False):
+        self._on_disk = on_disk
+        self._spool = None
+        self.generation = 0  # clear() のたびに増やす (古い LogView を作り直すため)
+        self._reset()
+
+    def _reset(self):
+        if self._spool is not None:
+            self._spool.close()
+        self._spool = output_capture.OutputSpool() if self._on_disk else None
+        self._text = bytearray()  # 本文 (on_disk の場合はまだ書き出していない部分)
+        self._flushed = 0         # 一時ファイルに書き出したバイト数
+        self._offsets = array('Q', [0])  # 行 i の本文は offsets[i] から offsets[i + 1] - 1 まで
+        self._times = array('d')
+        self._hosts = array('I')      # ホスト番号 (0 はホストなし)
+        self._steps = array('i')      # コマンドの位置 (-1 はなし)
+        self._parallel = array('B')   # コマンドを並列に実行していたか
+        self._streams = array('B')
+        self._severities = array('B')
+        self._host_names = [None]
+        self._host_ids = {None: 0}
+        self._index = {}  # ('host', ホスト番号) / ('step', 位置) / ('stream', 種類) / ('severity', 重要度) -> 行番号
+
+    def __len__(self):
+        return len(self._times)
+
+    @property
+    def hosts(self):
+        """現れた順のホスト表示名のリスト"""
+        return self._host_names[1:]
+
+    @property
+    def steps(self):
+        """出力のあったコマンドの位置 (0始まり) の昇順のリスト"""
+        return sorted(value for kind, value in self._index if kind == 'step')
+
+    def clear(self):
+        self._reset()
+        self.generation += 1
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def append(self, item):
+        """ログキューの要素 (文字列または log_record.LogRecord) を追加する"""
+        record = log_record.to_record(item)
+        data = record.data
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'replace')
+        host_id = self._host_ids.get(record.host)
+        if host_id is None:
+            host_id = self._host_ids[record.host] = len(self._host_names)
+            self._host_names.append(record.host)
+        step = -1 if record.step is None else record.step
+        stream = _STREAM_CODES[record.stream]
+        severity = classify(data)
+        parts = data.split(b'\n') if b'\n' in data else (data,)
+        for part in parts:
+            line = len(self._times)
+            self._text += part
+            self._text += b'\n'
+            self._offsets.append(self._offsets[-1] + len(part) + 1)
+            self._times.append(record.time)
+            self._hosts.append(host_id)
+            self._steps.append(step)
+            self._parallel.append(record.parallel)
+            self._streams.append(stream)
+            self._severities.append(severity)
+            self._add_index(('host', host_id), line)
+            self._add_index(('stream', stream), line)
+            if step != -1:
+                self._add_index(('step', step), line)
+            for level in range(SEVERITY_WARNING, severity + 1):
+                self._add_index(('severity', level), line)
+        if self._spool is not None and len(self._text) >= output_capture.SEGMENT_SIZE:
+            self._flush()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def _add_index(self, key, line):
+        lines = self._index.get(key)
+        if lines is None:
+            lines = self._index[key] = array('I')
+        lines.append(line)
+
+    def _flush(self):
+        if self._text:
+            self._spool.append(bytes(self._text))
+            self._flushed += len(self._text)
+            self._text.clear()
+
+    def _read(self, start, end):
+        """本文の start から end までのバイト列を返す"""
+        if self._spool is None:
+            return bytes(self._text[start:end])
+        if end > self._flushed:
+            self._flush()
+        return self._spool.read(start, end - start)
+
+    def get(self, line):
+        """行を log_record.LogRecord として返す"""
+        data = self._read(self._offsets[line], self._offsets[line + 1] - 1)
+        stream = log_record.STREAMS[self._streams[line]]
+        if stream == log_record.STREAM_MESSAGE:
+            data = data.decode('utf-8', 'replace')
+        step = self._steps[line]
+        return log_record.LogRecord(stream, data, None if step == -1 else step,
+                                    self._host_names[self._hosts[line]], self._times[line],
+                                    bool(self._parallel[line]))
+
+    def severity(self, line):
+        return self._severities[line]
+
+    def find(self, host=None, step=None, stream=None, severity=SEVERITY_INFO, search=None,
+             start=0, end=None):
+        """
+        条件に一致する行番号を昇順の配列で返す (start 行目から end 行目の手前まで)。
+        severity はその重要度以上、search は本文に含まれる文字列 (大文字と小文字を区別する)。
+
+        最も行数の少ない索引から候補を取り出し、残りの条件は行の属性で確認する。
+        文字列検索は、候補が多い場合は本文のバッファ全体をまとめて検索する。
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return array('I')
+        tests = []  # (索引のキー, 属性の配列, 値)
+        if host is not None:
+            host_id = self._host_ids.get(host)
+            if host_id is None:
+                return array('I')
+            tests.append((('host', host_id), self._hosts, host_id))
+        if step is not None:
+            tests.append((('step', step), self._steps, step))
+        if stream is not None:
+            code = _STREAM_CODES[stream]
+            tests.append((('stream', code), self._streams, code))
+        if severity > SEVERITY_INFO:
+            tests.append((('severity', severity), None, severity))
+        needle = search.encode('utf-8') if search else None
+
+        candidates = None
+        rest = tests
+        if tests:
+            sized = []
+            for key, column, value in tests:
+                lines = self._index.get(key)
+                if lines is None:
+                    return array('I')
+                first = bisect.bisect_left(lines, start)
+                sized.append((bisect.bisect_left(lines, end) - first, first, key))
+            count, first, chosen = min(sized)
+            candidates = self._index[chosen][first:first + count]
+            rest = [test for test in tests if test[0] != chosen]
+        if needle is not None and (candidates is None or len(candidates) * 8 > end - start):
+            # 候補が多い場合は本文をまとめて検索し、索引の条件は全て属性で確認する
+            candidates, rest, needle = self._search(needle, start, end), tests, None
+        for key, column, value in rest:
+            if column is None:
+                severities = self._severities
+                candidates = array('I', [line for line in candidates if severities[line] >= value])
+            else:
+                candidates = array('I', [line for line in candidates if column[line] == value])
+        if candidates is None:
+            return array('I', range(start, end))
+        if needle is not None:
+            offsets, read = self._offsets, self._read
+            candidates = array('I', [line for line in candidates
+                                     if needle in read(offsets[line], offsets[line + 1] - 1)])
+        return candidates
+
+    def _search(self, needle, start, end):
+        """本文に needle を含む行番号を返す (SEARCH_CHUNK_SIZE 程度ずつ行の境界で区切って検索する)"""
+        hits = array('I')
+        offsets = self._offsets
+        line = start
+        while line < end:
+            last = bisect.bisect_right(offsets, offsets[line] + SEARCH_CHUNK_SIZE, line, end + 1) - 1
+            last = min(end, max(line + 1, last))
+            base = offsets[line]
+            chunk = self._read(base, offsets[last])
+            position = chunk.find(needle)
+            while position != -1:
+                hit = bisect.bisect_right(offsets, base + position, line, last + 1) - 1
+                line_end = offsets[hit + 1] - base
+                if position + len(needle) < line_end:
+                    hits.append(hit)
+                    position = chunk.find(needle, line_end)  # 同じ行の2つ目以降の一致は探さない
+                else:
+                    position = chunk.find(needle, position + 1)  # 改行をまたいだ一致は除く
+            line = last
+        return hits
+
+
+class LogView:
+    """
+    LogStore の条件に一致する行番号の一覧。update() で前回以降に追加された行を取り込む
+    (ストアを clear() した場合は最初から作り直す)。
+    """
+
+    def __init__(self, store, host=None, step=None, stream=None, severity=SEVERITY_INFO, search=None):
+        self.store = store
+        self.criteria = {'host': host, 'step': step, 'stream': stream,
+                         'severity': severity, 'search': search}
+        self.lines = array('I')
+        self._scanned = 0
+        self._generation = store.generation
+        self.update()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def update(self):
+        """追加された行のうち条件に一致するものを取り込み、取り込んだ行数を返す"""
+        store = self.store
+        if self._generation != store.generation:
+            self._generation = store.generation
+            self.lines = array('I')
+            self._scanned = 0
+        total = len(store)
+        if self._scanned >= total:
+            return 0
+        found = store.find(start=self._scanned, end=total, **self.criteria)
+        self._scanned = total
+        self.lines.extend(found)
+        return len(found)
+
+
+def load_run_log(path, on_disk=False):
+    """実行ログファイル (log_record.RunLogWriter の形式) を読み込んだ LogStore を返す"""
+    store = LogStore(on_disk)
+    try:
+        store.extend(log_record.read_run_log(path))
+    except Exception:
+        store.close()
+        raise
+    return store
@@ -0,0 +1,223 @@
+# log_viewer.py
+# ログ表示欄。全ての行は log_store.LogStore に保持し、テキストボックスには
+# 絞り込み条件に一致する行のうち表示範囲の行だけを描画する
+import bisect
+
+import customtkinter as ctk
+
+import log_record
+import log_store
+
+ALL_LABEL = "すべて"
+STREAM_LABELS = {ALL_LABEL: None, "メッセージ": log_record.STREAM_MESSAGE,
+                 "stdout": log_record.STREAM_STDOUT, "stderr": log_record.STREAM_STDERR}
+SEVERITY_LABELS = {ALL_LABEL: log_store.SEVERITY_INFO, "警告以上": log_store.SEVERITY_WARNING,
+                   "エラー": log_store.SEVERITY_ERROR}
+# 検索文字列の入力後、絞り込みを行うまでの待ち時間 (ミリ秒)
+SEARCH_DELAY_MS = 300
+SEVERITY_COLORS = {log_store.SEVERITY_WARNING: "#d08000", log_store.SEVERITY_ERROR: "#e04040"}
+
+
+class LogViewer(ctk.CTkFrame):
+    """
+    絞り込みと検索ができるログ表示欄。
+
+    append() で追加した行は LogStore に保存し、絞り込み条件 (ホスト / コマンド番号 /
+    種類 / 重要度 / 検索文字列) に一致する行番号の一覧 (log_store.LogView) を追記のたびに
+    更新する。描画はテキストボックスに収まる行数だけを行うため、数百万行のログでも
+    スクロールや絞り込みの速度は変わらない。末尾を表示している間は新しい行に追従する。
+    """
+
+    def __init__(self, master, on_disk=True, **kwargs):
+        super().__init__(master, **kwargs)
+        self.store = log_store.LogStore(on_disk)
+        self.view = log_store.LogView(self.store)
+        self.top = 0          # 表示範囲の先頭 (view.lines 上の位置)
+        self.follow = True    # 末尾に追従するか
+        self._shown = None    # 描画済みの内容 (同じ内容なら描画し直さない)
+        self._host_count = 0  # ホストの選択肢に反映したホスト数
+        self._search_job = None
+
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        # --- 絞り込み ---
+        filter_frame = ctk.CTkFrame(self, fg_color="transparent")
+        filter_frame.grid(row=0, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="ew")
+        filter_frame.grid_columnconfigure(9, weight=1)
+
+        ctk.CTkLabel(filter_frame, text="ホスト:").grid(row=0, column=0, padx=(0, 2))
+        self.host_var = ctk.StringVar(value=ALL_LABEL)
+        self.host_menu = ctk.CTkOptionMenu(filter_frame, variable=self.host_var, values=[ALL_LABEL],
+                                           width=110, command=lambda _: self.apply_filter())
+        self.host_menu.grid(row=0, column=1, padx=(0, 5))
+
+        ctk.CTkLabel(filter_frame, text="コマンド:").grid(row=0, column=2, padx=(0, 2))
+        self.step_entry = ctk.CTkEntry(filter_frame, width=50, placeholder_text="番号")
+        self.step_entry.grid(row=0, column=3, padx=(0, 5))
+        self.step_entry.bind("<Return>", lambda _: self.apply_filter())
+        self.step_entry.bind("<FocusOut>", lambda _: self.apply_filter())
+
+        self.stream_var = ctk.StringVar(value=ALL_LABEL)
+        ctk.CTkOptionMenu(filter_frame, variable=self.stream_var, values=list(STREAM_LABELS),
+                          width=95, command=lambda _: self.apply_filter()).grid(row=0, column=4, padx=(0, 5))
+
+        self.severity_var = ctk.StringVar(value=ALL_LABEL)
+        ctk.CTkOptionMenu(filter_frame, variable=self.severity_var, values=list(SEVERITY_LABELS),
+                          width=95, command=lambda _: self.apply_filter()).grid(row=0, column=5, padx=(0, 5))
+
+        ctk.CTkLabel(filter_frame, text="検索:").grid(row=0, column=6, padx=(0, 2))
+        self.search_entry = ctk.CTkEntry(filter_frame, width=140)
+        self.search_entry.grid(row=0, column=7, padx=(0, 5))
+        self.search_entry.bind("<KeyRelease>", self._schedule_search)
+        self.search_entry.bind("<Return>", lambda _: self.apply_filter())
+
+        self.count_label = ctk.CTkLabel(filter_frame, text="")
+        self.count_label.grid(row=0, column=9, padx=(5, 0), sticky="e")
+
+        # --- ログ本体 (表示範囲の行だけを描画し、縦方向のスクロールは自前で行う) ---
+        self.textbox = ctk.CTkTextbox(self, state="disabled", wrap="none")
+        self.textbox.grid(row=1, column=0, padx=(5, 0), pady=5, sticky="nsew")
+        self.textbox.tag_config("match", background="#806000")
+        for severity, color in SEVERITY_COLORS.items():
+            self.textbox.tag_config(f"severity{severity}", foreground=color)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, padx=(0, 5), pady=5, sticky="ns")
+
+        self.textbox.bind("<Configure>", lambda _: self.refresh())
+        self.textbox.bind("<MouseWheel>", self._on_mousewheel)
+        self.textbox.bind("<Button-4>", lambda _: self._scroll_by(-3))
+        self.textbox.bind("<Button-5>", lambda _: self._scroll_by(3))
+        for key, rows in (("<Prior>", -1), ("<Next>", 1)):
+            self.textbox.bind(key, lambda _, rows=rows: self._scroll_by(rows * self._visible_rows()))
+        self.textbox.bind("<Control-Home>", lambda _: self._scroll_to(0))
+        self.textbox.bind("<Control-End>", lambda _: self._scroll_to(len(self.view)))
+
+    # --- 行の追加と消去 ---
+    def append(self, items):
+        """ログキューの要素 (文字列または log_record.LogRecord) のリストを追加して表示を更新する"""
+        self.store.extend(items)
+        self.refresh()
+
+    def clear(self):
+        self.store.clear()
+        self.top = 0
+        self.follow = True
+        self._host_count = 0
+        self.host_var.set(ALL_LABEL)
+        self.host_menu.configure(values=[ALL_LABEL])
+        self.refresh()
+
+    def load_run_log(self, path):
+        """実行ログファイルを読み込み、現在の内容と置き換える"""
+        store = log_store.load_run_log(path, on_disk=True)
+        self.store.close()
+        self.store = store
+        self.view = log_store.LogView(store)
+        self._host_count = 0
+        self.host_var.set(ALL_LABEL)
+        self.host_menu.configure(values=[ALL_LABEL])
+        self.top = 0
+        self.follow = False
+        self.apply_filter()
+
+    def close(self):
+        self.store.close()
+
+    # --- 絞り込み ---
+    def _schedule_search(self, _event=None):
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DELAY_MS, self.apply_filter)
+
+    def apply_filter(self):
+        """入力された条件で表示する行の一覧を作り直す"""
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+            self._search_job = None
+        host = self.host_var.get()
+        step_text = self.step_entry.get().strip()
+        step = int(step_text) - 1 if step_text.isdigit() and int(step_text) > 0 else None
+        if step is None and step_text:
+            self.step_entry.delete(0, "end")  # 数値以外はコマンドの絞り込みを解除する
+        old_lines = self.view.lines
+        self.view = log_store.LogView(
+            self.store, host=None if host == ALL_LABEL else host, step=step,
+            stream=STREAM_LABELS.get(self.stream_var.get()),
+            severity=SEVERITY_LABELS.get(self.severity_var.get(), log_store.SEVERITY_INFO),
+            search=self.search_entry.get() or None)
+        if not self.follow and self.top < len(old_lines):
+            # 表示していた位置の近くの行から表示する
+            self.top = bisect.bisect_left(self.view.lines, old_lines[self.top])
+        self.refresh()
+
+    # --- スクロール ---
+    def _visible_rows(self):
+        line_height = self.textbox.cget("font").metrics("linespace") or 1
+        return max(1, self.textbox.winfo_height() // line_height - 1)
+
+    def _scroll_to(self, top):
+        rows = self._visible_rows()
+        self.top = max(0, min(top, len(self.view) - rows))
+        self.follow = self.top >= len(self.view) - rows
+        self.refresh()
+        return "break"
+
+    def _scroll_by(self, rows):
+        return self._scroll_to(self.top + rows)
+
+    def _on_mousewheel(self, event):
+        if event.delta:
+            # Windows は1ノッチ 120、macOS は 1 単位
+            steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+            return self._scroll_by(-3 * steps)
+        return "break"
+
+    def _on_scrollbar(self, command, value, unit=None):
+        if command == "moveto":
+            self._scroll_to(int(float(value) * len(self.view)))
+        elif command == "scroll":
+            rows = self._visible_rows() if unit == "pages" else 3
+            self._scroll_by(int(value) * rows)
+
+    # --- 描画 ---
+    def refresh(self):
+        """追加された行を一覧に取り込み、表示範囲の行を描画する"""
+        view, store = self.view, self.store
+        view.update()
+        if len(store.hosts) != self._host_count:
+            self._host_count = len(store.hosts)
+            self.host_menu.configure(values=[ALL_LABEL] + store.hosts)
+
+        total = len(view)
+        rows = self._visible_rows()
+        if self.follow:
+            self.top = total - rows
+        self.top = max(0, min(self.top, total - rows))
+        lines = view.lines[self.top:self.top + rows]
+        shown = (store, store.generation, view, self.top, tuple(lines))
+        if shown != self._shown:
+            self._shown = shown
+            self._draw([store.get(line) for line in lines], [store.severity(line) for line in lines])
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.count_label.configure(text=f"{total:,} / {len(store):,} 行")
+
+    def _draw(self, records, severities):
+        textbox = self.textbox
+        textbox.configure(state="normal")
+        textbox.delete("1.0", "end")
+        textbox.insert("end", "\n".join(log_record.format_record(record) for record in records))
+        for row, severity in enumerate(severities, start=1):
+            if severity in SEVERITY_COLORS:
+                textbox.tag_add(f"severity{severity}", f"{row}.0", f"{row}.end")
+        needle = self.view.criteria['search']
+        if needle:
+            position = textbox.search(needle, "1.0", stopindex="end")
+            while position:
+                end = f"{position}+{len(needle)}c"
+                textbox.tag_add("match", position, end)
+                position = textbox.search(needle, end, stopindex="end")
+        textbox.configure(state="disabled")
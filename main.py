@@ -5,13 +5,29 @@ import json  # JSON読み込み用
 import threading  # スレッド用
 import queue  # キュー用
 import json_loader
+import log_record
+import log_viewer
 import config_manager
 import ssh_executor  # 作成したモジュールをインポート
+import command_template
+import fleet_executor
+import inventory
+import metrics
+import rollout
+import sharded_executor
+import connection_pool
+import bastion
+import ssh_auth
+import step_scheduler
 
 # --- アプリケーションの基本設定 ---
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 
+# --- ログ表示の設定 ---
+LOG_QUEUE_MAXSIZE = 10000       # ログキューの上限 (満杯時は送信側が待たされる)
+MAX_LOG_LINES_PER_TICK = 2000   # 1回のキュー処理でUIに反映する最大メッセージ数
+
 
 class App(ctk.CTk):
     def __init__(self):
@@ -19,7 +35,7 @@ class App(ctk.CTk):
 
         # --- ウィンドウ設定 ---
         self.title("簡易SBC設定ツール")
-        self.geometry("600x600")
+        self.geometry("760x640")
 
         # --- レイアウト設定 ---
         self.grid_columnconfigure(0, weight=1)
@@ -29,10 +45,15 @@ class App(ctk.CTk):
         self.password_visible = False
         self.selected_json_path = None  # 選択されたJSONファイルのパスを保持
         self.ssh_thread = None       # SSH実行スレッドを保持
+        self.last_results = {}       # 直前の実行結果 (ホスト表示名 -> execute_ssh_commands の結果)
         self.cancel_event = threading.Event()  # キャンセル通知用イベント
+        # 実行ごとのSSHハンドシェイクを省くための接続プール
+        self.connection_pool = connection_pool.ConnectionPool()
+        self.run_log = None  # 実行中のログの保存先 (log_record.RunLogWriter)
 
         # --- スレッド間通信用キュー ---
-        self.log_queue = queue.Queue()
+        # 大量の出力で際限なくメモリを使わないよう上限付きにする
+        self.log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
         self.status_queue = queue.Queue()
 
         # --- UI要素の作成 (変更なしの部分は省略) ---
@@ -47,7 +68,7 @@ class App(ctk.CTk):
         ctk.CTkLabel(conn_frame, text="IP/Host:", width=70,
                      anchor="w").grid(row=0, column=0, padx=(10, 5), pady=5, sticky="w")
         self.ip_entry = ctk.CTkEntry(
-            conn_frame, placeholder_text="例: 192.168.1.10 または raspberrypi.local")
+            conn_frame, placeholder_text="例: 192.168.1.10 (カンマ区切りで複数指定可。@tag:arm64 でインベントリから選択)")
         self.ip_entry.grid(row=0, column=1, columnspan=2,
                            padx=5, pady=5, sticky="ew")  # ボタンがない行は columnspan=2
 
@@ -82,6 +103,107 @@ class App(ctk.CTk):
         self.port_entry.grid(row=3, column=1, columnspan=2,
                              padx=5, pady=5, sticky="w")
 
+        # 同時実行数 (ホスト数は複数ホスト指定時、ステップ数は depends_on 指定時のみ使用)
+        ctk.CTkLabel(conn_frame, text="並列数:", width=70, anchor="w").grid(
+            row=4, column=0, padx=(10, 5), pady=5, sticky="w")
+        parallel_frame = ctk.CTkFrame(conn_frame, fg_color="transparent")
+        parallel_frame.grid(row=4, column=1, columnspan=2,
+                            padx=5, pady=5, sticky="w")
+        ctk.CTkLabel(parallel_frame, text="ホスト").grid(
+            row=0, column=0, padx=(0, 5))
+        self.workers_entry = ctk.CTkEntry(parallel_frame, width=60)
+        self.workers_entry.insert(0, str(fleet_executor.DEFAULT_MAX_WORKERS))
+        self.workers_entry.grid(row=0, column=1, padx=(0, 15))
+        ctk.CTkLabel(parallel_frame, text="ステップ").grid(
+            row=0, column=2, padx=(0, 5))
+        self.steps_entry = ctk.CTkEntry(parallel_frame, width=60)
+        self.steps_entry.insert(
+            0, str(step_scheduler.DEFAULT_MAX_PARALLEL_STEPS))
+        self.steps_entry.grid(row=0, column=3, padx=(0, 15))
+        # 数千台規模の実行を複数のプロセスに分ける (1 の場合はこのプロセス内のスレッドで実行)
+        ctk.CTkLabel(parallel_frame, text="プロセス").grid(
+            row=0, column=4, padx=(0, 5))
+        self.processes_entry = ctk.CTkEntry(parallel_frame, width=50)
+        self.processes_entry.insert(0, "1")
+        self.processes_entry.grid(row=0, column=5)
+        # 複数ホストで同じになったコマンド出力を1つにまとめて表示する
+        self.dedup_var = ctk.BooleanVar(value=False)
+        self.dedup_checkbox = ctk.CTkCheckBox(
+            parallel_frame, text="同じ出力をまとめる", variable=self.dedup_var)
+        self.dedup_checkbox.grid(row=0, column=6, padx=(15, 0))
+
+        # 転送設定 (圧縮・暗号方式・ウィンドウサイズ。transport_profiles.json で追加・変更可能)
+        ctk.CTkLabel(conn_frame, text="転送設定:", width=70, anchor="w").grid(
+            row=5, column=0, padx=(10, 5), pady=5, sticky="w")
+        self.profile_var = ctk.StringVar(
+            value=config_manager.DEFAULT_TRANSPORT_PROFILE)
+        self.profile_menu = ctk.CTkOptionMenu(
+            conn_frame, variable=self.profile_var,
+            values=sorted(config_manager.load_transport_profiles()))
+        self.profile_menu.grid(row=5, column=1, columnspan=2,
+                               padx=5, pady=5, sticky="w")
+
+        # 段階実行 (複数ホスト指定時のみ。バッチが空欄の場合は全ホストを一度に実行する)
+        ctk.CTkLabel(conn_frame, text="段階実行:", width=70, anchor="w").grid(
+            row=6, column=0, padx=(10, 5), pady=5, sticky="w")
+        rollout_frame = ctk.CTkFrame(conn_frame, fg_color="transparent")
+        rollout_frame.grid(row=6, column=1, columnspan=2,
+                           padx=5, pady=5, sticky="w")
+        ctk.CTkLabel(rollout_frame, text="カナリア").grid(
+            row=0, column=0, padx=(0, 5))
+        self.canary_entry = ctk.CTkEntry(rollout_frame, width=50)
+        self.canary_entry.insert(0, str(rollout.DEFAULT_CANARY))
+        self.canary_entry.grid(row=0, column=1, padx=(0, 15))
+        ctk.CTkLabel(rollout_frame, text="バッチ").grid(
+            row=0, column=2, padx=(0, 5))
+        self.batch_entry = ctk.CTkEntry(
+            rollout_frame, width=60, placeholder_text="例: 25%")
+        self.batch_entry.grid(row=0, column=3, padx=(0, 15))
+        ctk.CTkLabel(rollout_frame, text="許容失敗").grid(
+            row=0, column=4, padx=(0, 5))
+        self.max_failures_entry = ctk.CTkEntry(rollout_frame, width=50)
+        self.max_failures_entry.insert(0, "0")
+        self.max_failures_entry.grid(row=0, column=5)
+
+        # コマンドのテンプレート ({{ 変数名 }}) に埋め込む変数
+        ctk.CTkLabel(conn_frame, text="変数:", width=70, anchor="w").grid(
+            row=7, column=0, padx=(10, 5), pady=5, sticky="w")
+        self.params_entry = ctk.CTkEntry(
+            conn_frame, placeholder_text="例: role=web, version=1.2")
+        self.params_entry.grid(row=7, column=1, columnspan=2,
+                               padx=5, pady=5, sticky="ew")
+
+        # 踏み台ホスト (空欄の場合は直接接続する)
+        ctk.CTkLabel(conn_frame, text="踏み台:", width=70, anchor="w").grid(
+            row=8, column=0, padx=(10, 5), pady=5, sticky="w")
+        self.jump_entry = ctk.CTkEntry(
+            conn_frame, placeholder_text="例: admin@bastion.example.com:22 (空欄の場合は直接接続)")
+        self.jump_entry.grid(row=8, column=1, columnspan=2,
+                             padx=5, pady=5, sticky="ew")
+
+        # 公開鍵認証 (秘密鍵ファイル・SSHエージェント) とホスト鍵の確認方法
+        ctk.CTkLabel(conn_frame, text="認証:", width=70, anchor="w").grid(
+            row=9, column=0, padx=(10, 5), pady=5, sticky="w")
+        auth_frame = ctk.CTkFrame(conn_frame, fg_color="transparent")
+        auth_frame.grid(row=9, column=1, columnspan=2,
+                        padx=5, pady=5, sticky="ew")
+        auth_frame.grid_columnconfigure(0, weight=1)
+        self.key_entry = ctk.CTkEntry(
+            auth_frame, placeholder_text="秘密鍵ファイル (空欄の場合はパスワード認証)")
+        self.key_entry.grid(row=0, column=0, padx=(0, 10), sticky="ew")
+        self.agent_var = ctk.BooleanVar(value=False)
+        self.agent_checkbox = ctk.CTkCheckBox(
+            auth_frame, text="エージェント", variable=self.agent_var)
+        self.agent_checkbox.grid(row=0, column=1, padx=(0, 10))
+        ctk.CTkLabel(auth_frame, text="ホスト鍵").grid(
+            row=0, column=2, padx=(0, 5))
+        self.host_key_policy_var = ctk.StringVar(
+            value=ssh_auth.DEFAULT_HOST_KEY_POLICY)
+        self.host_key_policy_menu = ctk.CTkOptionMenu(
+            auth_frame, variable=self.host_key_policy_var,
+            values=list(ssh_auth.HOST_KEY_POLICIES), width=110)
+        self.host_key_policy_menu.grid(row=0, column=3)
+
         # --- 2. JSONファイル選択フレーム ---
         file_frame = ctk.CTkFrame(self)
         file_frame.grid(row=1, column=0, padx=10, pady=5, sticky="ew")
@@ -95,11 +217,35 @@ class App(ctk.CTk):
             file_frame, text="ファイルが選択されていません", anchor="w")
         self.file_label.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
 
+        # 一括送信モード (全コマンドを1つのシェルで実行し、コマンドごとの往復を省く)
+        self.pipelined_var = ctk.BooleanVar(value=False)
+        self.pipelined_checkbox = ctk.CTkCheckBox(
+            file_frame, text="一括送信", variable=self.pipelined_var)
+        self.pipelined_checkbox.grid(row=0, column=2, padx=5, pady=5)
+
+        # 再開 (前回の実行で成功したステップを飛ばす。実行記録は run_journal を参照)
+        self.resume_var = ctk.BooleanVar(value=False)
+        self.resume_checkbox = ctk.CTkCheckBox(
+            file_frame, text="再開", variable=self.resume_var)
+        self.resume_checkbox.grid(row=0, column=3, padx=5, pady=5)
+
+        # エラーで中断 (終了コードが0以外のコマンドがあれば、そのホストの残りを実行しない)
+        self.stop_on_error_var = ctk.BooleanVar(value=False)
+        self.stop_on_error_checkbox = ctk.CTkCheckBox(
+            file_frame, text="エラーで中断", variable=self.stop_on_error_var)
+        self.stop_on_error_checkbox.grid(row=0, column=4, padx=5, pady=5)
+
+        # ログ保存 (実行ごとのログを設定フォルダの runs に JSONL で保存する)
+        self.save_log_var = ctk.BooleanVar(value=False)
+        self.save_log_checkbox = ctk.CTkCheckBox(
+            file_frame, text="ログ保存", variable=self.save_log_var)
+        self.save_log_checkbox.grid(row=0, column=5, padx=(5, 10), pady=5)
+
         # --- 3. 実行ボタンフレーム ---
         button_frame = ctk.CTkFrame(self)
         button_frame.grid(row=2, column=0, padx=10, pady=5, sticky="ew")
         button_frame.grid_columnconfigure(
-            (0, 1, 2), weight=1, uniform="group1")
+            (0, 1, 2, 3), weight=1, uniform="group1")
 
         self.run_button = ctk.CTkButton(
             button_frame, text="実行", command=self.run_action)
@@ -113,15 +259,19 @@ class App(ctk.CTk):
             button_frame, text="ログ消去", command=self.clear_log_action)
         self.clear_button.grid(row=0, column=2, padx=5, pady=5, sticky="ew")
 
+        self.open_log_button = ctk.CTkButton(
+            button_frame, text="ログを開く", command=self.open_run_log_action)
+        self.open_log_button.grid(row=0, column=3, padx=5, pady=5, sticky="ew")
+
         # --- 4. ログ表示フレーム ---
         log_frame = ctk.CTkFrame(self)
         log_frame.grid(row=3, column=0, padx=10, pady=(5, 10), sticky="nsew")
         log_frame.grid_rowconfigure(0, weight=1)
         log_frame.grid_columnconfigure(0, weight=1)
 
-        self.log_textbox = ctk.CTkTextbox(
-            log_frame, state="disabled", wrap="word")
-        self.log_textbox.grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
+        # 全ての行を保持し、絞り込み条件に一致する行のうち表示範囲の行だけを描画する
+        self.log_viewer = log_viewer.LogViewer(log_frame, fg_color="transparent")
+        self.log_viewer.grid(row=0, column=0, sticky="nsew")
 
         self.select_button.configure(command=self.select_json_file_action)
         self.run_button.configure(command=self.run_action)
@@ -145,6 +295,15 @@ class App(ctk.CTk):
             self.user_entry.insert(0, settings.get('user', ''))
             self.port_entry.delete(0, 'end')  # デフォルトの22を消去
             self.port_entry.insert(0, settings.get('port', '22'))  # 保存値がなければ22
+            self.jump_entry.insert(0, settings.get('jump', ''))
+            self.key_entry.insert(0, settings.get('key_file', ''))
+            self.agent_var.set(bool(settings.get('use_agent', False)))
+            if settings.get('host_key_policy') in ssh_auth.HOST_KEY_POLICIES:
+                self.host_key_policy_var.set(settings['host_key_policy'])
+            self.save_log_var.set(bool(settings.get('save_run_log', False)))
+            profile_name = settings.get('transport_profile')
+            if profile_name in self.profile_menu.cget('values'):
+                self.profile_var.set(profile_name)
             self.log_message("前回保存した設定を読み込みました。")
         else:
             self.log_message("保存された設定はありません。")
@@ -155,8 +314,19 @@ class App(ctk.CTk):
         current_user = self.user_entry.get().strip()
         current_port = self.port_entry.get().strip()
         # パスワードは保存しない！
-        config_manager.save_settings(current_ip, current_user, current_port)
+        config_manager.save_settings(current_ip, current_user, current_port,
+                                     transport_profile=self.profile_var.get(),
+                                     jump=self.jump_entry.get().strip(),
+                                     key_file=self.key_entry.get().strip(),
+                                     use_agent=self.agent_var.get(),
+                                     host_key_policy=self.host_key_policy_var.get(),
+                                     save_run_log=self.save_log_var.get())
         self.log_message("設定を保存しました。アプリケーションを終了します。")
+        self.connection_pool.close_all()  # 保持している接続を閉じる
+        bastion.close_all()  # 共有している踏み台への接続を閉じる
+        self._close_run_log()
+        self._release_outputs()  # 保存したコマンド出力の一時ファイルを削除
+        self.log_viewer.close()  # ログ欄の一時ファイルを削除
         self.destroy()  # ウィンドウを破棄して終了
 
     # --- アクションメソッド ---
@@ -185,11 +355,35 @@ class App(ctk.CTk):
         user = self.user_entry.get().strip()
         password = self.pass_entry.get()  # パスワードはstripしない
         port_str = self.port_entry.get().strip()
-
-        if not all([host, user, password, port_str, self.selected_json_path]):
+        key_file = self.key_entry.get().strip()
+        # 公開鍵認証の場合、パスワードは公開鍵認証に失敗したときのみ使う (空欄でもよい)
+        auth = {'key_files': [key_file] if key_file else [],
+                'use_agent': self.agent_var.get(),
+                'passphrase': None,
+                'host_key_policy': self.host_key_policy_var.get()}
+        use_keys = bool(key_file or auth['use_agent'])
+
+        # "@選択式" の場合はインベントリから選択する (ユーザー名はインベントリの値を優先)
+        use_inventory = host.startswith('@')
+        if not all([host, user or use_inventory, password or use_keys, port_str,
+                    self.selected_json_path]):
             messagebox.showerror(
-                "入力エラー", "ホスト、ユーザー名、パスワード、ポート、JSONファイルをすべて指定してください。")
+                "入力エラー", "ホスト、ユーザー名、パスワード (または秘密鍵)、ポート、"
+                "JSONファイルをすべて指定してください。")
             return
+        if key_file:
+            # 鍵の誤りは接続前にエラーにする。パスフレーズ付きの鍵はパスワード欄の値で復号する
+            try:
+                try:
+                    ssh_auth.load_private_key(key_file)
+                except Exception:
+                    if not password:
+                        raise
+                    ssh_auth.load_private_key(key_file, password)
+                    auth['passphrase'] = password
+            except Exception as e:
+                messagebox.showerror("認証エラー", f"秘密鍵 {key_file} を読み込めません:\n{e}")
+                return
 
         try:
             port = int(port_str)
@@ -199,17 +393,48 @@ class App(ctk.CTk):
             messagebox.showerror("入力エラー", f"ポート番号が無効です: {e}")
             return
 
+        try:
+            if use_inventory:
+                targets = inventory.select_targets(host[1:], port, user, password, **auth)
+                self.log_message(f"インベントリから {len(targets)} 台のホストを選択しました。")
+            else:
+                targets = fleet_executor.parse_targets(host, port, user, password)
+            max_workers = int(self.workers_entry.get().strip())
+            max_parallel_steps = int(self.steps_entry.get().strip())
+            processes = int(self.processes_entry.get().strip() or 1)
+            if max_workers < 1 or max_parallel_steps < 1 or processes < 1:
+                raise ValueError("並列数は1以上である必要があります。")
+            # 実行のたびに読み直し、transport_profiles.json の変更を反映する
+            transport_profile = config_manager.get_transport_profile(
+                self.profile_var.get())
+            jump = None
+            jump_text = self.jump_entry.get().strip()
+            if jump_text:
+                # 踏み台への接続は実行をまたいで共有する (パスワードは接続先と共通)
+                jump = bastion.get_jump_host(
+                    bastion.parse_jump(jump_text, default_user=user), password, **auth)
+            batch = self.batch_entry.get().strip()
+            canary = self.canary_entry.get().strip()
+            max_failures = self.max_failures_entry.get().strip()
+            if batch:
+                rollout.parse_amount(batch, len(targets), "バッチの台数")
+                rollout.parse_amount(canary, len(targets), "カナリアの台数")
+                rollout.parse_amount(max_failures, len(targets), "許容する失敗数")
+        except FileNotFoundError:
+            messagebox.showerror(
+                "エラー", f"インベントリファイルが見つかりません:\n{inventory.get_inventory_path()}")
+            return
+        except json.JSONDecodeError as e:
+            messagebox.showerror("JSONエラー", f"インベントリファイルの解析に失敗しました:\n{e}")
+            return
+        except ValueError as e:
+            messagebox.showerror("入力エラー", str(e))
+            return
+
         # --- JSONファイルの読み込み ---
         try:
-            with open(self.selected_json_path, 'r', encoding='utf-8') as f:
-                commands = json.load(f)
-            if not isinstance(commands, list):
-                raise ValueError("JSONのルート要素は配列である必要があります。")
-            # コマンドオブジェクトの簡単なチェック (例: commandキーが存在するか)
-            for i, cmd_obj in enumerate(commands):
-                if not isinstance(cmd_obj, dict) or 'command' not in cmd_obj:
-                    raise ValueError(
-                        f"JSON配列の {i+1} 番目の要素に 'command' キーがありません。")
+            # 検証と依存関係 (depends_on) の解析を含む。変更のないファイルはキャッシュを使う
+            commands = json_loader.load_commands_from_json(self.selected_json_path)
 
         except FileNotFoundError:
             messagebox.showerror(
@@ -226,6 +451,14 @@ class App(ctk.CTk):
                 "ファイルエラー", f"JSONファイルの読み込み中に予期せぬエラーが発生しました:\n{e}")
             return
 
+        # --- テンプレートの変数の確認 (接続前に不足をエラーにする) ---
+        try:
+            params = command_template.parse_params(self.params_entry.get())
+            command_template.check_targets(commands, targets, params)
+        except ValueError as e:
+            messagebox.showerror("変数エラー", str(e))
+            return
+
         # --- 実行準備 ---
         self.cancel_event.clear()  # キャンセルイベントをリセット
         self.run_button.configure(state="disabled")  # 実行ボタンを無効化
@@ -233,15 +466,116 @@ class App(ctk.CTk):
         self.log_message("--------------------")
         self.log_message("処理を開始します...")
 
+        # 前回の実行で保存したコマンド出力は不要になるので削除する
+        self._release_outputs()
+
+        if self.save_log_var.get():
+            self._close_run_log()
+            try:
+                self.run_log = log_record.open_new_run_log()
+                self.log_message(f"ログを保存します: {self.run_log.path}")
+            except OSError as e:
+                self.log_message(f"[警告] ログファイルを作成できませんでした: {e}")
+
         # --- バックグラウンドスレッドの開始 ---
-        self.ssh_thread = threading.Thread(
-            target=ssh_executor.execute_ssh_commands,
-            args=(host, port, user, password, commands, self.log_queue,
-                  self.status_queue, self.cancel_event),
-            daemon=True  # メインスレッド終了時に道連れにする
-        )
+        options = {'pool': self.connection_pool,
+                   'pipelined': self.pipelined_var.get(),
+                   'max_parallel_steps': max_parallel_steps,
+                   'transport_profile': transport_profile,
+                   'resume': self.resume_var.get(),
+                   'stop_on_error': self.stop_on_error_var.get(),
+                   'jump': jump,
+                   **auth}
+        if len(targets) == 1:
+            target = targets[0]
+            self.ssh_thread = threading.Thread(
+                target=self._run_and_keep_results,
+                args=(fleet_executor.target_label(target), ssh_executor.execute_ssh_commands,
+                      target['host'], target['port'], target['user'], password,
+                      commands.render(command_template.target_variables(target, params)),
+                      self.log_queue, self.status_queue, self.cancel_event),
+                kwargs=dict(options, transport_profile=target.get(
+                    'transport_profile', transport_profile), jump=target.get('jump', jump)),
+                daemon=True  # メインスレッド終了時に道連れにする
+            )
+        elif batch:
+            # 段階実行 (カナリア → バッチ)。失敗が上限を超えたら続行するかを確認する
+            self.ssh_thread = threading.Thread(
+                target=self._run_and_keep_results,
+                args=(None, rollout.execute_rollout, targets, commands, self.log_queue,
+                      self.status_queue, self.cancel_event),
+                kwargs={'canary': canary, 'batch_size': batch,
+                        'max_failures': max_failures,
+                        'confirm_continue': self._confirm_from_worker,
+                        'max_workers': max_workers, 'processes': processes,
+                        'params': params, 'dedup_output': self.dedup_var.get(), **options},
+                daemon=True
+            )
+        elif processes > 1:
+            # 数千台規模の場合は複数のワーカープロセスに分けて実行
+            self.ssh_thread = threading.Thread(
+                target=self._run_and_keep_results,
+                args=(None, sharded_executor.execute_sharded, targets, commands, self.log_queue,
+                      self.status_queue, self.cancel_event),
+                kwargs={'processes': processes, 'max_workers': max_workers, 'params': params,
+                        'dedup_output': self.dedup_var.get(), **options},
+                daemon=True
+            )
+        else:
+            # 複数ホストの場合は並列実行エンジンを使用
+            self.ssh_thread = threading.Thread(
+                target=self._run_and_keep_results,
+                args=(None, fleet_executor.execute_fleet, targets, commands, self.log_queue,
+                      self.status_queue, self.cancel_event),
+                kwargs={'max_workers': max_workers, 'params': params,
+                        'dedup_output': self.dedup_var.get(), **options},
+                daemon=True
+            )
         self.ssh_thread.start()
 
+    def _run_and_keep_results(self, label, func, *args, **kwargs):
+        """
+        バックグラウンドスレッドで実行し、結果を last_results に保持する。
+        label が None の場合、func は複数ホスト分の結果の辞書を返す (execute_fleet)。
+        """
+        result = func(*args, **kwargs)
+        self.last_results = result if label is None else {label: result}
+        # フェーズ別の所要時間を設定フォルダの metrics に書き出す
+        try:
+            paths = metrics.write_reports(
+                [r['metrics'] for r in self.last_results.values() if r.get('metrics')],
+                metrics.get_metrics_dir())
+            self.log_queue.put(f"処理時間の計測結果を保存しました: {paths[0]}")
+        except OSError as e:
+            self.log_queue.put(f"[警告] 処理時間の計測結果を保存できませんでした: {e}")
+
+    def _confirm_from_worker(self, message):
+        """
+        バックグラウンドスレッドから呼ばれ、メインスレッドで続行するかを確認する。
+        確認中に停止ボタンが押された場合は続行しない。
+        """
+        answer = []
+        answered = threading.Event()
+
+        def ask():
+            answer.append(messagebox.askyesno(
+                "段階実行", f"{message}\n残りのホストの実行を続行しますか？"))
+            answered.set()
+
+        self.after(0, ask)
+        while not answered.wait(timeout=0.1):
+            if self.cancel_event.is_set():
+                return False
+        return answer[0] and not self.cancel_event.is_set()
+
+    def _release_outputs(self):
+        """直前の実行で保存したコマンド出力 (一時ファイル) を削除する"""
+        for result in self.last_results.values():
+            spool = result.get('spool')
+            if spool is not None:
+                spool.close()
+        self.last_results = {}
+
     def stop_action(self):
         if self.ssh_thread and self.ssh_thread.is_alive():
             self.cancel_event.set()  # キャンセルイベントをセット
@@ -251,10 +585,24 @@ class App(ctk.CTk):
             self.log_message("現在実行中の処理はありません。")
 
     def clear_log_action(self):
-        # [ ... (変更なし) ... ]
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.delete("1.0", "end")
-        self.log_textbox.configure(state="disabled")
+        self.log_viewer.clear()
+
+    def open_run_log_action(self):
+        """保存した実行ログを開いてログ欄に表示する (実行中は開かない)"""
+        if self.ssh_thread and self.ssh_thread.is_alive():
+            self.log_message("[注意] 実行中はログを開けません。")
+            return
+        filepath = filedialog.askopenfilename(
+            title="実行ログを選択",
+            initialdir=str(log_record.get_run_log_dir()),
+            filetypes=[("実行ログ", "*.jsonl *.sshlog"), ("All files", "*.*")]
+        )
+        if not filepath:
+            return
+        try:
+            self.log_viewer.load_run_log(filepath)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            messagebox.showerror("エラー", f"実行ログを読み込めませんでした:\n{e}")
 
     def toggle_password_visibility(self):
         # [ ... (変更なし) ... ]
@@ -270,13 +618,29 @@ class App(ctk.CTk):
     # --- キュー処理メソッド ---
     def process_queues(self):
         """キューからメッセージを読み取り、UIを更新する"""
+        # ログキューの処理 (1回あたりの処理量に上限を設け、まとめて挿入する)
+        items = []
         try:
-            # ログキューの処理
-            while True:  # 一度にキューにあるものを全て処理
-                log_msg = self.log_queue.get_nowait()
-                self.log_message(log_msg)
+            while len(items) < MAX_LOG_LINES_PER_TICK:
+                items.append(self.log_queue.get_nowait())
         except queue.Empty:
             pass  # キューが空なら何もしない
+        if items:
+            if self.run_log is not None:
+                try:
+                    for item in items:
+                        self.run_log.write(item)
+                except OSError as e:
+                    self.log_message(f"[警告] ログファイルの書き込みに失敗したため保存を中止します: {e}")
+                    self._close_run_log()
+            # 出力のデコードと整形は表示範囲の行を描画する時点で行う
+            self.log_viewer.append(items)
+
+        if len(items) >= MAX_LOG_LINES_PER_TICK:
+            # まだログが残っている場合は、終了メッセージが先に出ないよう
+            # ステータスの処理を後回しにして早めに次回のチェックを行う
+            self.after(10, self.process_queues)
+            return
 
         try:
             # ステータスキューの処理
@@ -302,16 +666,25 @@ class App(ctk.CTk):
         except queue.Empty:
             pass
 
+        if self.run_log is not None and not (self.ssh_thread and self.ssh_thread.is_alive()) \
+                and self.log_queue.empty():
+            # 実行が終わり、残りのログも書き込んだらファイルを閉じる
+            self._close_run_log()
+
         # 次回のチェックを予約
         self.after(100, self.process_queues)
 
+    def _close_run_log(self):
+        if self.run_log is not None:
+            try:
+                self.run_log.close()
+            except OSError as e:
+                self.log_message(f"[警告] ログファイルの書き込みに失敗しました: {e}")
+            self.run_log = None
+
     # --- ログメッセージ表示用メソッド ---
     def log_message(self, message):
-        # [ ... (変更なし) ... ]
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.insert("end", message + "\n")
-        self.log_textbox.see("end")
-        self.log_textbox.configure(state="disabled")
+        self.log_viewer.append([message])
 
     # --- 実行可能かチェックし、実行ボタンの状態を更新 ---
     def _check_runnable(self):
@@ -0,0 +1,218 @@
+# metrics.py
+# ホストごと・コマンドごとの処理時間 (フェーズ別) の記録と出力 (JSON / Prometheus テキスト形式)
+import json
+import os
+import threading
+import time
+
+# 記録するフェーズ
+#   接続: dns (名前解決), tcp (TCP接続), jump (踏み台経由のチャンネル開設。踏み台への接続を含む),
+#         kex (鍵交換), auth (認証)
+#   コマンドごと: channel_open (チャンネル開設), ttfb (実行要求から最初の出力まで),
+#                 command (実行要求から終了まで), transfer (ファイル転送全体)
+CONNECT_PHASES = ('dns', 'tcp', 'jump', 'kex', 'auth')
+STEP_PHASES = ('channel_open', 'ttfb', 'command', 'transfer')
+PHASES = CONNECT_PHASES + STEP_PHASES
+
+METRICS_DIRNAME = "metrics"
+REPORT_BASENAME = "last_run"
+PROMETHEUS_PREFIX = "ssh_runner"
+
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+def add_collector(collector):
+    """
+    実行の終了時に呼び出す関数を登録する。
+    collector(run_metrics) の形で、ホストごとの RunMetrics を受け取る
+    (複数ホストの実行では、各ホストの実行スレッドから呼ばれる)。
+    """
+    with _collectors_lock:
+        _collectors.append(collector)
+
+
+def remove_collector(collector):
+    """add_collector で登録した関数を削除する"""
+    with _collectors_lock:
+        if collector in _collectors:
+            _collectors.remove(collector)
+
+
+def notify_collectors(run_metrics):
+    """登録済みの collector を呼び出す (通常は RunMetrics.finish() から呼ばれる)"""
+    with _collectors_lock:
+        collectors = list(_collectors)
+    for collector in collectors:
+        try:
+            collector(run_metrics)
+        except Exception as e:
+            print(f"[警告] メトリクスの collector でエラーが発生しました: {e}")
+
+
+class RunMetrics:
+    """
+    1ホスト分の実行の計測結果。
+
+    各区間 (span) はフェーズ名、コマンドのインデックス (接続のフェーズは None)、
+    実行開始からの経過時間 (start)、所要時間 (duration) を持つ辞書として spans に追加する。
+    """
+
+    def __init__(self, host, port, user):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.started_at = time.time()
+        self.status = None
+        self.duration = None
+        self.reused_connection = False
+        self.exit_codes = {}
+        self.spans = []
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, phase, start, end, step=None):
+        """time.monotonic() で計った開始・終了時刻から区間を追加する"""
+        span = {'phase': phase, 'step': step,
+                'start': round(start - self._origin, 6),
+                'duration': round(max(0.0, end - start), 6)}
+        with self._lock:
+            self.spans.append(span)
+
+    def span(self, phase, step=None):
+        """with 文で囲んだ処理の区間を追加するコンテキストマネージャー"""
+        return _Span(self, phase, step)
+
+    def finish(self, status, exit_codes=None):
+        """実行の終了時に呼ぶ。最終ステータスを記録し、登録済みの collector を呼び出す。"""
+        self.status = status
+        self.duration = round(time.monotonic() - self._origin, 6)
+        if exit_codes is not None:
+            self.exit_codes = dict(exit_codes)
+        notify_collectors(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """to_dict() の辞書から RunMetrics を復元する (別のプロセスで記録した結果の受け取り用)"""
+        run = cls(data['host'], data['port'], data['user'])
+        run.started_at = data['started_at']
+        run.status = data['status']
+        run.duration = data['duration']
+        run.reused_connection = data['reused_connection']
+        run.exit_codes = {int(i): code for i, code in data['exit_codes'].items()}
+        run.spans = list(data['spans'])
+        return run
+
+    def phase_totals(self):
+        """フェーズごとの所要時間の合計"""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span['phase']] = totals.get(span['phase'], 0.0) + span['duration']
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {'host': self.host, 'port': self.port, 'user': self.user,
+                'started_at': self.started_at, 'status': self.status,
+                'duration': self.duration, 'reused_connection': self.reused_connection,
+                'exit_codes': {str(i): code for i, code in sorted(self.exit_codes.items())},
+                'spans': spans}
+
+
+class _Span:
+    __slots__ = ('_metrics', '_phase', '_step', '_start')
+
+    def __init__(self, metrics, phase, step):
+        self._metrics = metrics
+        self._phase = phase
+        self._step = step
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 失敗した処理も、失敗までにかかった時間として記録する
+        self._metrics.add(self._phase, self._start, time.monotonic(), self._step)
+        return False
+
+
+def get_metrics_dir():
+    """GUIの実行結果を保存するフォルダ (設定ファイルと同じフォルダの metrics)"""
+    import config_manager
+
+    return config_manager.get_config_path().parent / METRICS_DIRNAME
+
+
+def to_json(runs):
+    """RunMetrics のリストを JSON 文字列にする"""
+    return json.dumps({'generated_at': time.time(),
+                       'runs': [run.to_dict() for run in runs]},
+                      ensure_ascii=False, indent=2)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items())
+
+
+def to_prometheus(runs):
+    """RunMetrics のリストを Prometheus のテキスト形式 (node_exporter の textfile 形式) にする"""
+    prefix = PROMETHEUS_PREFIX
+    metrics = {
+        'run_duration_seconds': ('gauge', "実行全体の所要時間", []),
+        'run_success': ('gauge', "実行が正常に完了したか (1: DONE)", []),
+        'connection_reused': ('gauge', "接続プールの接続を再利用したか", []),
+        'phase_seconds': ('gauge', "フェーズごとの所要時間の合計", []),
+        'step_phase_seconds': ('gauge', "コマンドごと・フェーズごとの所要時間", []),
+        'step_exit_code': ('gauge', "コマンドの終了コード", []),
+    }
+    for run in runs:
+        host = {'host': run.host, 'port': run.port}
+        samples = metrics['run_duration_seconds'][2]
+        samples.append((_labels(**host, status=run.status), run.duration or 0))
+        metrics['run_success'][2].append((_labels(**host), int(run.status == 'DONE')))
+        metrics['connection_reused'][2].append((_labels(**host), int(run.reused_connection)))
+        for phase, total in sorted(run.phase_totals().items()):
+            metrics['phase_seconds'][2].append((_labels(**host, phase=phase), round(total, 6)))
+        for span in run.to_dict()['spans']:
+            if span['step'] is not None:
+                metrics['step_phase_seconds'][2].append(
+                    (_labels(**host, step=span['step'] + 1, phase=span['phase']),
+                     span['duration']))
+        for index, code in sorted(run.exit_codes.items()):
+            metrics['step_exit_code'][2].append((_labels(**host, step=index + 1), code))
+
+    lines = []
+    for name, (kind, help_text, samples) in metrics.items():
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        lines.extend(f"{prefix}_{name}{{{labels}}} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_reports(runs, directory, basename=REPORT_BASENAME):
+    """
+    RunMetrics のリストを directory に basename.json と basename.prom として書き出す。
+    書き出したファイルのパスのタプルを返す。
+    """
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, f"{basename}.json")
+    prom_path = os.path.join(directory, f"{basename}.prom")
+    _write_atomic(json_path, to_json(runs))
+    # 読み取り中の Prometheus (textfile collector) が途中までのファイルを読まないよう置き換える
+    _write_atomic(prom_path, to_prometheus(runs))
+    return json_path, prom_path
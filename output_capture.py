@@ -0,0 +1,256 @@
+# output_capture.py
+# コマンド出力の保存 (メモリには先頭と末尾だけを保持し、全体はスプールファイルに書き出す)
+import bisect
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+from collections import deque
+
+import log_record
+
+# ログに表示する先頭・末尾の行数の既定値 (これを超えた分はスプールファイルにのみ保存する)
+DEFAULT_HEAD_LINES = 2000
+DEFAULT_TAIL_LINES = 500
+# スプールファイルへまとめて書き込む単位 (バイト)
+SEGMENT_SIZE = 65536
+SPOOL_PREFIX = "ssh_run_"
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class OutputSpool:
+    """
+    1回の実行 (1ホスト) 分のコマンド出力を保存する一時ファイル。
+
+    複数のコマンドの出力を一定の大きさの区間 (セグメント) 単位で追記し、
+    読み出すときはファイルをメモリマップして必要な部分だけを参照する。
+    free() で解放した区間は後の append() で再利用し、ファイルの末尾の区間は切り詰める
+    (そのため free() を使う場合、append() の位置は連続するとは限らない)。
+    ファイルは書き込む間だけ開いておき、release() で閉じる (読み出しはメモリマップで行うため、
+    閉じた後も読み出せる。追記すると開き直す)。多数のホストの結果を保持しても
+    ファイル記述子を使い続けないよう、書き込みを終えたら release() を呼ぶこと。
+    close() を呼ぶか、オブジェクトが破棄されるとファイルは削除される。
+    """
+
+    def __init__(self, directory=None):
+        fd, self.path = tempfile.mkstemp(prefix=SPOOL_PREFIX, suffix=".spool", dir=directory)
+        self._file = os.fdopen(fd, 'r+b')
+        self._lock = threading.Lock()
+        self._size = 0
+        self._free = []  # 再利用できる区間 (位置, 長さ) の位置の昇順のリスト
+        self._dirty = False  # まだファイルに書き出していない書き込みがあるか
+        self._map = None
+        self._map_size = 0
+        self._finalizer = weakref.finalize(self, _remove_file, self.path)
+
+    def new_capture(self, head_lines=DEFAULT_HEAD_LINES, tail_lines=DEFAULT_TAIL_LINES):
+        """コマンド1つ分の出力を保存する CommandCapture を作る"""
+        return CommandCapture(self, head_lines, tail_lines)
+
+    @property
+    def size(self):
+        return self._size
+
+    def append(self, data):
+        """データを書き込み、その開始位置を返す (複数スレッドから呼び出し可)"""
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'r+b')
+            length = len(data)
+            for index, (offset, free_length) in enumerate(self._free):
+                if free_length >= length:
+                    if free_length == length:
+                        del self._free[index]
+                    else:
+                        self._free[index] = (offset + length, free_length - length)
+                    break
+            else:
+                offset = self._size
+                self._size += length
+            self._file.seek(offset)
+            self._file.write(data)
+            self._dirty = True
+            return offset
+
+    def free(self, segments):
+        """不要になった区間 ((位置, 長さ) のリスト) を解放する"""
+        with self._lock:
+            extents = sorted(self._free + [segment for segment in segments if segment[1] > 0])
+            merged = []
+            for offset, length in extents:
+                if merged and merged[-1][0] + merged[-1][1] == offset:
+                    merged[-1] = (merged[-1][0], merged[-1][1] + length)
+                else:
+                    merged.append((offset, length))
+            if merged and merged[-1][0] + merged[-1][1] == self._size:
+                # 末尾の区間はファイルを切り詰める (切り詰めた範囲をメモリマップで参照しないよう作り直す)
+                self._size = merged.pop()[0]
+                if self._file is not None:
+                    self._file.flush()
+                    self._file.truncate(self._size)
+                else:
+                    os.truncate(self.path, self._size)
+                self._dirty = False
+                if self._map is not None:
+                    self._map.close()
+                    self._map = None
+            self._free = merged
+
+    def read(self, offset, length):
+        """指定した範囲のデータを返す。メモリマップは必要に応じて作り直す。"""
+        if length <= 0:
+            return b''
+        with self._lock:
+            if self._dirty:
+                # 解放した区間に書き込んだ内容もメモリマップに反映されるよう、常に書き出す
+                self._file.flush()
+                self._dirty = False
+            if self._map is None or offset + length > self._map_size:
+                if self._map is not None:
+                    self._map.close()
+                # メモリマップはファイルを閉じても有効なため、書き込み用のファイルとは別に開いてすぐ閉じる
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map_size = self._size
+            return self._map[offset:offset + length]
+
+    def release(self):
+        """書き込み用に開いているファイルを閉じる (ファイルは残し、読み出しと追記は引き続き可能)"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._dirty = False
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self._finalizer()
+
+
+class CommandCapture:
+    """
+    コマンド1つ分の出力。
+
+    ログに表示する行 (先頭 head_lines 行) と末尾 tail_lines 行はメモリに保持し、
+    全ての行は OutputSpool に保存する。行番号を指定して任意の範囲を読み出せる。
+    行は "[stdout] ..." のようにログと同じ形式で保存する (受信したバイト列のまま)。
+    """
+
+    def __init__(self, spool, head_lines=DEFAULT_HEAD_LINES, tail_lines=DEFAULT_TAIL_LINES):
+        self._spool = spool
+        self._head_lines = head_lines
+        self.tail = deque(maxlen=tail_lines)
+        self.line_count = 0
+        self.byte_count = 0
+        self._buffer = bytearray()
+        self._segments = []      # (スプール上の位置, 長さ)
+        self._segment_lines = []  # 各セグメントの先頭の行番号
+        self._lock = threading.Lock()
+
+    @property
+    def omitted(self):
+        """ログに表示しなかった行数"""
+        return max(0, self.line_count - self._head_lines - len(self.tail))
+
+    def add_lines(self, stream_name, lines, timestamp=None):
+        """
+        出力の行 (受信したバイト列のまま。改行を含まない) をまとめて保存する。
+        ログにそのまま表示すべき行 (先頭 head_lines 行以内) の数を返す (先頭からその数の行)。
+        timestamp は行を受信した時刻 (末尾の行をログに表示するときに使う)。
+        """
+        if not lines:
+            return 0
+        prefix = b'[%s] ' % stream_name.encode('ascii')
+        data = prefix + (b'\n' + prefix).join(lines) + b'\n'
+        with self._lock:
+            if not self._buffer:
+                self._segment_lines.append(self.line_count)
+            self._buffer += data
+            shown = max(0, min(len(lines), self._head_lines - self.line_count))
+            self.line_count += len(lines)
+            self.byte_count += len(data)
+            if len(self._buffer) >= SEGMENT_SIZE:
+                self._flush()
+            if shown < len(lines):
+                tail = self.tail
+                tail.extend((stream_name, line, timestamp)
+                            for line in lines[max(shown, len(lines) - tail.maxlen):])
+            return shown
+
+    def finish(self, step=None, parallel=False):
+        """
+        出力の終了時に呼ぶ。表示を省略した行がある場合は、省略した行数のメッセージと
+        末尾の行 (log_record.LogRecord。step / parallel はコマンドの位置と並列実行か)
+        の、ログに表示するためのリストを返す。
+        """
+        with self._lock:
+            self._flush()
+        if self.line_count <= self._head_lines:
+            return []
+        messages = []
+        if self.omitted:
+            messages.append(log_record.message(
+                f"... {self.omitted} 行省略 (全 {self.line_count} 行は {self._spool.path} に保存) ...",
+                step))
+        messages.extend(log_record.LogRecord(stream_name, line, step, None, timestamp, parallel)
+                        for stream_name, line, timestamp in self.tail)
+        return messages
+
+    def discard(self):
+        """
+        保存した全ての行を破棄し、一時ファイルに書き出した区間を解放する
+        (他のホストと同じ出力だったため、そちらの保存した出力を使う場合)。
+        """
+        with self._lock:
+            self._buffer.clear()
+            self.tail.clear()
+            segments, self._segments, self._segment_lines = self._segments, [], []
+            self.line_count = self.byte_count = 0
+        self._spool.free(segments)
+
+    def _flush(self):
+        if self._buffer:
+            offset = self._spool.append(bytes(self._buffer))
+            self._segments.append((offset, len(self._buffer)))
+            self._buffer.clear()
+
+    def get_lines(self, start, count):
+        """start 行目 (0始まり) から最大 count 行を返す"""
+        with self._lock:
+            self._flush()
+            if start < 0 or start >= self.line_count or count <= 0:
+                return []
+            index = bisect.bisect_right(self._segment_lines, start) - 1
+            segments = list(zip(self._segments[index:], self._segment_lines[index:]))
+        lines = []
+        for (offset, length), first_line in segments:
+            data = self._spool.read(offset, length).decode('utf-8', 'replace')
+            segment_lines = data.split('\n')[:-1]
+            skip = max(0, start - first_line)
+            lines.extend(segment_lines[skip:skip + count - len(lines)])
+            if len(lines) >= count:
+                break
+        return lines
+
+    def iter_lines(self, batch=10000):
+        """全ての行を順に返す (一度に batch 行ずつ読み出す)"""
+        start = 0
+        while True:
+            lines = self.get_lines(start, batch)
+            if not lines:
+                return
+            yield from lines
+            start += len(lines)
@@ -0,0 +1,170 @@
+# output_dedup.py
+# 複数ホストの実行で、同じコマンドの出力がホスト間で同じになった場合に1つにまとめる。
+# 出力は受信しながらハッシュを計算し、コマンドの終了時に他のホストの出力と比較する
+import hashlib
+import threading
+
+import log_record
+
+# 出力を比較するハッシュの長さ (バイト)
+DIGEST_SIZE = 16
+# まとめの表示で列挙するホスト数の上限
+SUMMARY_HOSTS = 10
+# コマンドの終了まで保留する表示行の合計の上限 (バイト)。超えた場合はそのコマンドの出力を比較しない
+MAX_HELD_BYTES = 8 * 1024 * 1024
+
+
+class OutputHash:
+    """
+    コマンド1つ分の stdout / stderr のハッシュ。受信した行をそのまま渡して更新する。
+    stdout と stderr は別々に計算するため、チャンクの区切りや両者の届く順序には依存しない。
+    """
+
+    __slots__ = ('_hashes', 'lines')
+
+    def __init__(self):
+        self._hashes = {log_record.STREAM_STDOUT: hashlib.sha256(),
+                        log_record.STREAM_STDERR: hashlib.sha256()}
+        self.lines = 0
+
+    def add_lines(self, stream_name, lines):
+        """出力の行 (受信したバイト列のまま。改行を含まない) を追加する"""
+        digest = self._hashes[stream_name]
+        digest.update(b'\n'.join(lines))
+        digest.update(b'\n')
+        self.lines += len(lines)
+
+    def digest(self):
+        return hashlib.sha256(self._hashes[log_record.STREAM_STDOUT].digest()
+                              + self._hashes[log_record.STREAM_STDERR].digest()).digest()[:DIGEST_SIZE]
+
+
+class OutputGroups:
+    """
+    実行全体 (全ホスト) で共有する、コマンドごとの同じ出力のまとまり。
+    同じ出力の最初のホストの保存した出力 (output_capture.CommandCapture) を
+    まとまりの代表として保持する。複数スレッドから呼び出し可。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}  # (コマンドの位置, ハッシュ) -> {'hosts': [...], 'lines': 行数, 'capture': ...}
+
+    def add(self, step, digest, host, lines, capture=None):
+        """ホストのコマンドの出力を登録し、(まとまり, 最初のホストか) を返す"""
+        with self._lock:
+            group = self._groups.get((step, digest))
+            first = group is None
+            if first:
+                group = self._groups[(step, digest)] = {'hosts': [], 'lines': lines, 'capture': capture}
+            group['hosts'].append(host)
+            return group, first
+
+    def for_host(self, host):
+        """execute_ssh_commands の dedup に渡す、ホスト1台分の HostDedup を作る"""
+        return HostDedup(self, host)
+
+
+class HostDedup:
+    """ホスト1台分の出力のまとめ。コマンドごとに new_step() で HeldOutput を作る"""
+
+    def __init__(self, groups, host):
+        self.groups = groups
+        self.host = host
+        self.digests = {}  # コマンドの位置 -> (ハッシュ, 行数)
+
+    def new_step(self, step):
+        return HeldOutput(self, step)
+
+
+class HeldOutput:
+    """
+    ホスト1台・コマンド1つ分の出力のハッシュを計算し、ログに表示する行をコマンドの終了まで保留する。
+
+    finish() で、同じ出力のホストが既にあれば保留した行を捨てて1行のメッセージに置き換える
+    (保存した出力も最初のホストのものを共有する)。最初のホストであれば保留した行を返す。
+    保留した行が MAX_HELD_BYTES を超えた場合は、それまでの行を返してそのコマンドの出力の
+    比較をやめる (capture_output=False で大量の出力がある場合にメモリを使い続けないため)。
+    """
+
+    def __init__(self, host_dedup, step):
+        self._host_dedup = host_dedup
+        self._step = step
+        self.hash = OutputHash()
+        self._held = []
+        self._held_bytes = 0
+        self.overflowed = False  # 保留する行が上限を超え、比較をやめたか
+        self.group = None  # finish() 後のまとまり
+        self.duplicate = False
+
+    def add_lines(self, stream_name, lines):
+        self.hash.add_lines(stream_name, lines)
+
+    def hold(self, records):
+        """表示する行のレコードを保留し、今すぐログに送るレコードのリストを返す"""
+        if self.overflowed:
+            return records
+        self._held.extend(records)
+        self._held_bytes += sum(len(record.data) for record in records)
+        if self._held_bytes <= MAX_HELD_BYTES:
+            return []
+        self.overflowed = True
+        held, self._held = self._held, []
+        return [log_record.message(
+            f"出力が多いため、コマンド {self._step+1} の出力は他のホストと比較せずに表示します。",
+            self._step)] + held
+
+    def release(self):
+        """比較せずに保留した行を返す (コマンドが終了しないまま出力が終わった場合)"""
+        held, self._held = self._held, []
+        return held
+
+    def finish(self, capture=None):
+        """
+        出力を他のホストと比較し、ログに送るレコードのリストを返す。
+        同じ出力が既にある場合は duplicate が True になり、group['capture'] が共有の保存先になる。
+        """
+        host_dedup = self._host_dedup
+        digest = self.hash.digest()
+        host_dedup.digests[self._step] = (digest, self.hash.lines)
+        held, self._held = self._held, []
+        if not self.hash.lines or self.overflowed:
+            return held
+        self.group, first = host_dedup.groups.add(
+            self._step, digest, host_dedup.host, self.hash.lines, capture)
+        if first:
+            return held
+        self.duplicate = True
+        return [log_record.message(
+            f"出力 ({self.hash.lines} 行) は {self.group['hosts'][0]} と同じため表示を省略します "
+            f"(sha256: {digest.hex()[:12]})", self._step)]
+
+
+def report_groups(details, log_queue):
+    """
+    各ホストの実行結果の 'digests' から、コマンドごとに同じ出力のホストをまとめてログに出力する。
+    全てのホストで同じだったコマンドは1行、異なる出力があったコマンドはまとまりごとに1行
+    (ホスト数の多い順) を出力する。出力のなかったコマンドは省略する。
+    """
+    steps = {}  # コマンドの位置 -> {ハッシュ: [行数, [ホスト表示名]]}
+    for label, result in details.items():
+        for step, (digest, lines) in (result.get('digests') or {}).items():
+            if lines:
+                steps.setdefault(step, {}).setdefault(digest, [lines, []])[1].append(label)
+    if not steps:
+        return
+    log_queue.put("--- 出力のまとめ (同じ出力のホスト) ---")
+    for step in sorted(steps):
+        groups = sorted(steps[step].values(), key=lambda group: -len(group[1]))
+        if len(groups) == 1:
+            lines, hosts = groups[0]
+            log_queue.put(log_record.message(
+                f"コマンド {step+1}: {len(hosts)} 台とも同じ出力 ({lines} 行)", step))
+            continue
+        for number, (lines, hosts) in enumerate(groups, start=1):
+            shown = ", ".join(hosts[:SUMMARY_HOSTS])
+            if len(hosts) > SUMMARY_HOSTS:
+                shown += f" 他 {len(hosts) - SUMMARY_HOSTS} 台"
+            log_queue.put(log_record.message(
+                f"コマンド {step+1}: 出力 {number}/{len(groups)} ({lines} 行) {len(hosts)} 台: {shown}",
+                step))
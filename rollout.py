@@ -0,0 +1,199 @@
+# rollout.py
+# 複数ホストへの段階的な実行 (カナリア → 一定数ずつのバッチ) と、失敗したホスト数による中止
+import math
+from fractions import Fraction
+
+import fleet_executor
+import output_dedup
+import sharded_executor
+import ssh_executor
+
+# 最初に単独で実行するホスト数のデフォルト値
+DEFAULT_CANARY = 1
+
+
+class _BatchStatusQueue:
+    """
+    バッチごとの execute_fleet が送る全体ステータスのうち、RUNNING だけを転送するラッパー
+    (バッチの完了ごとに DONE などが表示されないようにするため)。
+    """
+
+    def __init__(self, status_queue):
+        self._status_queue = status_queue
+        self._running_sent = False
+
+    def put(self, status, block=True, timeout=None):
+        if status == ssh_executor.STATUS_RUNNING and not self._running_sent:
+            self._running_sent = True
+            self._status_queue.put(status, block, timeout)
+
+
+def parse_amount(value, total, name="値"):
+    """
+    台数の指定 (整数、または "25%" のような全ホスト数に対する割合) を台数に変換する。
+    割合は切り上げる (バッチの大きさが0にならないようにするため)。
+
+    Raises:
+        ValueError: 指定が無効な場合。
+    """
+    text = str(value).strip()
+    try:
+        if text.endswith('%'):
+            percent = Fraction(text[:-1])  # 33.4% のような小数を誤差なく扱う
+            if not 0 <= percent <= 100:
+                raise ValueError
+            return math.ceil(total * percent / 100)
+        amount = int(text)
+        if amount < 0:
+            raise ValueError
+        return amount
+    except ValueError:
+        raise ValueError(f"{name}は0以上の整数または割合 (例: 25%) で指定してください: {value}")
+
+
+def plan_batches(targets, canary=DEFAULT_CANARY, batch_size=None):
+    """
+    ターゲットのリストを実行順のバッチに分ける。
+
+    先頭の canary 台を最初のバッチ (カナリア) とし、残りを batch_size 台ずつに分ける。
+    batch_size が None または0の場合、残りは1つのバッチにする。
+
+    Returns:
+        list: ターゲットのリストのリスト。
+    """
+    canary = min(canary, len(targets))
+    batches = [targets[:canary]] if canary else []
+    rest = targets[canary:]
+    step = batch_size or len(rest)
+    batches.extend(rest[i:i + step] for i in range(0, len(rest), step) if step)
+    return batches
+
+
+def host_failed(result):
+    """ホストの実行結果が失敗 (正常終了しなかった、または終了コードが0以外のコマンドがある) か"""
+    if result['status'] != ssh_executor.STATUS_DONE:
+        return True
+    return any(code != 0 for code in result['exit_codes'].values())
+
+
+def execute_rollout(targets, commands, log_queue, status_queue, cancel_event,
+                    canary=DEFAULT_CANARY, batch_size=None, max_failures=0,
+                    confirm_continue=None, max_workers=fleet_executor.DEFAULT_MAX_WORKERS,
+                    host_status_queue=None, pool=None, processes=1, dedup_output=False,
+                    **options):
+    """
+    複数ホストに対して同じコマンドリストを段階的に実行する。
+    バックグラウンドスレッドで実行されることを想定。
+
+    最初に canary 台だけで実行し、成功したら残りのホストを batch_size 台ずつ実行する
+    (各バッチ内は execute_fleet で並列に実行)。失敗したホストが1台でもあるカナリア、
+    または失敗したホストの累計が max_failures 台を超えた時点で、次のバッチに進むかを
+    confirm_continue(メッセージ) に問い合わせる。confirm_continue が None または False を
+    返した場合は残りのホストを実行せずに中止する。続行した場合は、それ以降に1台でも
+    失敗すれば再び問い合わせる。
+
+    Args:
+        targets (list): ターゲット({'host', 'port', 'user', 'password', 'name'(任意)})のリスト。
+        commands (list): 実行するコマンドオブジェクトのリスト。
+        log_queue: ログメッセージの送信先キュー。
+        status_queue: 全体ステータスの送信先キュー。
+        cancel_event (threading.Event): キャンセル通知用イベント。
+        canary (int | str): 最初に単独で実行するホスト数 (整数または "10%" のような割合)。
+        batch_size (int | str): カナリア以降に一度に実行するホスト数 (整数または割合)。
+            None または0の場合は残りを一度に実行する。
+        max_failures (int | str): 中止せずに許容する失敗ホスト数 (整数または割合)。
+        confirm_continue (callable): 失敗が上限を超えたときに続行するかを返す関数 (省略可)。
+        max_workers (int): バッチ内で同時に処理する最大ホスト数。
+        host_status_queue: ホスト別ステータスの送信先キュー (省略可)。
+        pool (connection_pool.ConnectionPool): 接続プール (省略可)。
+        processes (int): 2以上の場合、各バッチを sharded_executor で複数のプロセスに分けて実行する。
+        dedup_output (bool): True の場合、コマンドの出力を全バッチのホストで比較し
+            (fleet_executor.execute_fleet の dedup_output と同じ)、終了時にまとめて出力する。
+        **options: execute_ssh_commands にそのまま渡すオプション (stop_on_error など)。
+
+    Returns:
+        dict: execute_fleet と同じ、ホスト表示名をキーとする実行結果の辞書。
+        実行しなかったホストの結果は STATUS_STOPPED で、'not_run' が True になる
+        (中止やキャンセルで実行しなかったことを、実行して停止したホストと区別するため)。
+
+    Raises:
+        ValueError: canary / batch_size / max_failures の指定が無効な場合。
+    """
+    total = len(targets)
+    canary = parse_amount(canary, total, "カナリアの台数")
+    batch_size = parse_amount(batch_size or 0, total, "バッチの台数")
+    budget = parse_amount(max_failures, total, "許容する失敗数")
+    batches = plan_batches(targets, canary, batch_size)
+
+    status_queue.put(ssh_executor.STATUS_CONNECTING)
+    log_queue.put(f"段階実行: {total} 台を {len(batches)} 回に分けて実行します "
+                  f"(カナリア: {min(canary, total)} 台, バッチ: {batch_size or '残り全て'} 台, "
+                  f"許容する失敗: {budget} 台)")
+
+    batch_status_queue = _BatchStatusQueue(status_queue)
+    # 出力の比較は全バッチで共通にする (別プロセスで実行するバッチはプロセスごと)
+    groups = output_dedup.OutputGroups() if dedup_output else None
+    details = {}
+    failures = 0
+    aborted = False
+    for number, batch in enumerate(batches, 1):
+        if cancel_event.is_set():
+            break
+        is_canary = number == 1 and canary > 0
+        log_queue.put(f"--- {'カナリア' if is_canary else 'バッチ'} {number}/{len(batches)} "
+                      f"({len(batch)} 台) を開始します ---")
+        if processes > 1 and len(batch) > 1:
+            results = sharded_executor.execute_sharded(
+                batch, commands, log_queue, batch_status_queue, cancel_event,
+                processes=min(processes, len(batch)), max_workers=min(max_workers, len(batch)),
+                host_status_queue=host_status_queue, dedup_output=groups, **options)
+        else:
+            results = fleet_executor.execute_fleet(
+                batch, commands, log_queue, batch_status_queue, cancel_event,
+                max_workers=min(max_workers, len(batch)), host_status_queue=host_status_queue,
+                pool=pool, dedup_output=groups, **options)
+        details.update(results)
+        batch_failures = sum(1 for result in results.values() if host_failed(result))
+        failures += batch_failures
+        if cancel_event.is_set() or number == len(batches):
+            break
+
+        if is_canary and batch_failures:
+            reason = f"カナリアのホストで失敗しました ({batch_failures} 台)。"
+        elif failures > budget:
+            reason = f"失敗したホストが {failures} 台になり、上限 ({budget} 台) を超えました。"
+        else:
+            continue
+        log_queue.put(f"[段階実行] {reason}")
+        if confirm_continue is not None and confirm_continue(reason):
+            log_queue.put("[段階実行] 続行します。")
+            budget = failures  # 以降は1台でも失敗したら再び確認する
+            continue
+        log_queue.put("[段階実行] 残りのホストは実行せずに中止します。")
+        aborted = True
+        break
+
+    # 実行しなかったホストは停止扱いにする
+    not_run = 0
+    for target in targets:
+        label = fleet_executor.target_label(target)
+        if label not in details:
+            not_run += 1
+            details[label] = {'status': ssh_executor.STATUS_STOPPED, 'exit_codes': {},
+                              'outputs': {}, 'spool': None, 'metrics': None, 'not_run': True}
+            if host_status_queue is not None:
+                host_status_queue.put((label, ssh_executor.STATUS_STOPPED))
+
+    if groups is not None:
+        output_dedup.report_groups(details, log_queue)
+    log_queue.put(f"段階実行が終了しました (成功: {len(details) - failures - not_run} / "
+                  f"失敗: {failures} / 未実行: {not_run} 台)")
+
+    if cancel_event.is_set():
+        status_queue.put(ssh_executor.STATUS_STOPPED)
+    elif aborted or any(result['status'] == ssh_executor.STATUS_ERROR
+                        for result in details.values()):
+        status_queue.put(ssh_executor.STATUS_ERROR)
+    else:
+        status_queue.put(ssh_executor.STATUS_DONE)
+    return details
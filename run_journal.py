@@ -0,0 +1,124 @@
+# run_journal.py
+# ホストごと・ステップごとの実行結果の記録 (再開モードと cache 指定のステップで使用)
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config_manager
+
+JOURNAL_DIRNAME = "journal"
+# 記録の行数が (有効な記録数 * この値 + COMPACT_MIN_LINES) を超えたらファイルを書き直す
+COMPACT_FACTOR = 2
+COMPACT_MIN_LINES = 64
+
+
+def get_journal_dir():
+    """実行記録を保存するフォルダ (設定ファイルと同じフォルダの journal)"""
+    return config_manager.get_config_path().parent / JOURNAL_DIRNAME
+
+
+def step_key(position, cmd_obj):
+    """
+    ステップを識別するキー。コマンドリスト上の位置と実行内容 (コマンド文字列または
+    ファイル転送の指定) のハッシュで、説明 (description) などは含めない。
+    """
+    body = {key: cmd_obj[key] for key in ('command', 'upload', 'download') if key in cmd_obj}
+    text = f"{position}\0{json.dumps(body, sort_keys=True, ensure_ascii=False)}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]
+
+
+class RunJournal:
+    """
+    1ホスト分の実行記録。
+
+    ファイルは1行1ステップの JSON Lines で、実行するたびに追記する
+    (途中でアプリケーションが終了しても、それまでの結果が残るようにするため)。
+    同じキーの記録は後のものが優先される。
+
+    記録の種類:
+        通常の記録   再開モードで成功済みのステップを飛ばすために使う。
+                     全てのステップが成功した時点で削除する (finish_run)。
+        cache の記録 cache: true のステップの結果。全体が成功した後も残し、
+                     以降の実行でも成功済みなら実行しない。
+    """
+
+    def __init__(self, host, port, user, directory=None):
+        directory = directory or get_journal_dir()
+        name = hashlib.sha256(f"{user}@{host}:{port}".encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self._lock = threading.Lock()
+        self._entries = {}  # キー -> 記録 (dict)
+        self._lines = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                        self._entries[entry['k']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue  # 書き込み途中で終了した行などは無視
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[警告] 実行記録の読み込みに失敗しました: {e}")
+
+    def succeeded(self, key):
+        """キーのステップが前回成功しているか"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry['rc'] == 0
+
+    def record(self, key, exit_status, duration, cacheable=False):
+        """ステップの結果を追記する"""
+        entry = {'k': key, 'rc': exit_status, 'd': round(duration, 3),
+                 'ts': int(time.time())}
+        if cacheable:
+            entry['c'] = 1
+        with self._lock:
+            self._entries[key] = entry
+            self._lines += 1
+            self._append(entry)
+            if self._lines > len(self._entries) * COMPACT_FACTOR + COMPACT_MIN_LINES:
+                self._rewrite()
+
+    def finish_run(self):
+        """全ステップが成功したときに呼ぶ。cache の記録以外を削除する。"""
+        with self._lock:
+            entries = {k: e for k, e in self._entries.items() if e.get('c')}
+            if len(entries) != len(self._entries) or self._lines != len(entries):
+                self._entries = entries
+                self._rewrite()
+
+    def _append(self, entry):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        except OSError as e:
+            print(f"[警告] 実行記録の書き込みに失敗しました: {e}")
+
+    def _rewrite(self):
+        """有効な記録だけでファイルを書き直す"""
+        if not self._entries:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self._lines = 0
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            os.replace(temp_path, self.path)
+            self._lines = len(self._entries)
+        except OSError as e:
+            print(f"[警告] 実行記録の書き込みに失敗しました: {e}")
@@ -0,0 +1,351 @@
+# sharded_executor.py
+# 多数のホストへの実行を複数のワーカープロセスに分割する (paramiko の暗号化・パケット処理は
+# GIL を保持したまま Python で行われるため、1プロセスではホスト数によらず約1コア分で頭打ちになる)
+import json
+import math
+import os
+import struct
+import threading
+
+import channel_reader
+import fleet_executor
+import log_record
+import metrics
+import output_dedup
+import ssh_executor
+
+# ワーカープロセス数のデフォルトの上限
+DEFAULT_MAX_PROCESSES = os.cpu_count() or 1
+# 1プロセスに割り当てるホスト数の下限 (これより少ない場合はプロセス数を減らす)
+MIN_TARGETS_PER_PROCESS = 8
+
+# ワーカーから親プロセスへ送るレコード: ヘッダー (種別, ターゲットの位置, 本体の長さ) + 本体
+#   LOG    本体はログのレコード (log_record.encode())
+#   STATUS 本体はステータスの番号 (1バイト)
+#   RESULT 本体はステータスの番号, 終了コードの数, 出力のハッシュの数,
+#          (コマンドの位置, 終了コード) の並び, (コマンドの位置, ハッシュ, 行数) の並び,
+#          計測結果 (metrics.RunMetrics.to_dict() の JSON)
+_RECORD = struct.Struct('<BII')
+_RESULT = struct.Struct('<BII')
+_EXIT_CODE = struct.Struct('<Ii')
+_DIGEST = struct.Struct(f'<I{output_dedup.DIGEST_SIZE}sQ')
+RECORD_LOG = 1
+RECORD_STATUS = 2
+RECORD_RESULT = 3
+# 特定のターゲットに属さないレコード (ワーカー自体のエラーなど) のターゲットの位置
+NO_TARGET = 0xFFFFFFFF
+STATUSES = (ssh_executor.STATUS_CONNECTING, ssh_executor.STATUS_CONNECTED,
+            ssh_executor.STATUS_RUNNING, ssh_executor.STATUS_DONE,
+            ssh_executor.STATUS_ERROR, ssh_executor.STATUS_STOPPED)
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# ワーカーがレコードをまとめて送る間隔 (秒) と、間隔を待たずに送るバッファのサイズ
+FLUSH_INTERVAL = 0.02
+FLUSH_BYTES = 64 * 1024
+# 親プロセスが読み出しに追いつかない場合に、ワーカーが送信を待つバッファのサイズ
+MAX_BUFFER_BYTES = 4 * 1024 * 1024
+# 親プロセスからワーカーへの停止要求
+_CANCEL_MESSAGE = b'C'
+
+
+def encode_result(result):
+    """execute_ssh_commands の結果を RECORD_RESULT の本体にする"""
+    exit_codes = result['exit_codes']
+    digests = result.get('digests') or {}
+    parts = [_RESULT.pack(_STATUS_CODES.get(result['status'], _STATUS_CODES['ERROR']),
+                          len(exit_codes), len(digests))]
+    parts.extend(_EXIT_CODE.pack(i, code) for i, code in exit_codes.items())
+    parts.extend(_DIGEST.pack(i, digest, lines) for i, (digest, lines) in digests.items())
+    run_metrics = result.get('metrics')
+    if run_metrics is not None:
+        parts.append(json.dumps(run_metrics.to_dict(), separators=(',', ':')).encode('utf-8'))
+    return b''.join(parts)
+
+
+def decode_result(payload):
+    """RECORD_RESULT の本体を結果の辞書 (outputs と spool は空) に戻す"""
+    status_code, count, digest_count = _RESULT.unpack_from(payload)
+    offset = _RESULT.size
+    exit_codes = {}
+    for _ in range(count):
+        i, code = _EXIT_CODE.unpack_from(payload, offset)
+        exit_codes[i] = code
+        offset += _EXIT_CODE.size
+    digests = {}
+    for _ in range(digest_count):
+        i, digest, lines = _DIGEST.unpack_from(payload, offset)
+        digests[i] = (digest, lines)
+        offset += _DIGEST.size
+    run_metrics = None
+    if offset < len(payload):
+        run_metrics = metrics.RunMetrics.from_dict(json.loads(bytes(payload[offset:])))
+    return {'status': STATUSES[status_code], 'exit_codes': exit_codes, 'outputs': {},
+            'spool': None, 'metrics': run_metrics, 'digests': digests}
+
+
+def iter_records(data):
+    """受信したデータに含まれるレコードを (種別, ターゲットの位置, 本体) として順に返す"""
+    offset = 0
+    view = memoryview(data)
+    while offset < len(data):
+        kind, index, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        yield kind, index, view[offset:offset + length]
+        offset += length
+
+
+# --- ワーカープロセス側 ---
+class _RecordWriter:
+    """
+    ワーカー内の各スレッドが書き込むレコードをバッファにまとめ、
+    FLUSH_INTERVAL ごと (またはバッファが FLUSH_BYTES を超えたとき) にパイプへ送る。
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="shard-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, kind, index, payload):
+        with self._condition:
+            # 親プロセスが読み出しに追いつくまで待つ (GUIのログキューの上限と同じ考え方)
+            while len(self._buffer) >= MAX_BUFFER_BYTES and not self._closed:
+                self._condition.wait()
+            self._buffer += _RECORD.pack(kind, index, len(payload))
+            self._buffer += payload
+            if len(self._buffer) >= FLUSH_BYTES:
+                self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < FLUSH_BYTES:
+                    self._condition.wait(FLUSH_INTERVAL)
+                data, self._buffer = bytes(self._buffer), bytearray()
+                closed = self._closed
+                self._condition.notify_all()
+            if data:
+                try:
+                    self._conn.send_bytes(data)
+                except OSError:
+                    return  # 親プロセスが終了した
+            if closed:
+                return
+
+
+class _RecordLogQueue:
+    """execute_ssh_commands のログを RECORD_LOG として送るキュー"""
+
+    def __init__(self, writer, index):
+        self._writer = writer
+        self._index = index
+
+    def put(self, message, block=True, timeout=None):
+        self._writer.write(RECORD_LOG, self._index,
+                           log_record.encode(log_record.to_record(message)))
+
+
+class _RecordStatusQueue:
+    """execute_ssh_commands のステータスを RECORD_STATUS として送るキュー"""
+
+    def __init__(self, writer, index):
+        self._writer = writer
+        self._index = index
+
+    def put(self, status, block=True, timeout=None):
+        self._writer.write(RECORD_STATUS, self._index, bytes((_STATUS_CODES[status],)))
+
+
+def _watch_parent(conn, cancel_event):
+    """親プロセスからの停止要求 (またはパイプの切断) を待ち、cancel_event をセットする"""
+    try:
+        conn.recv_bytes()
+    except (EOFError, OSError):
+        pass
+    cancel_event.set()
+
+
+def _worker_main(conn, shard, commands, max_workers, params, options):
+    """ワーカープロセスの処理。shard は (ターゲットの位置, ターゲット) のリスト。"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    # 出力の比較はワーカープロセス内のホストの間で行う
+    groups = output_dedup.OutputGroups() if options.pop('dedup_output', False) else None
+
+    cancel_event = threading.Event()
+    threading.Thread(target=_watch_parent, args=(conn, cancel_event), daemon=True).start()
+    writer = _RecordWriter(conn)
+
+    def run_host(index, target):
+        host_options = options
+        if groups is not None:
+            host_options = dict(options, dedup=groups.for_host(fleet_executor.target_label(target)))
+        result = fleet_executor.execute_target(
+            target, commands, _RecordLogQueue(writer, index),
+            _RecordStatusQueue(writer, index), cancel_event, params=params, **host_options)
+        if result.get('spool') is not None:
+            # 保存した出力は親プロセスに渡せないため、ログに表示した時点で破棄する
+            result['spool'].close()
+        writer.write(RECORD_RESULT, index, encode_result(result))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                thread_name_prefix="ssh-shard") as executor:
+            futures = [executor.submit(run_host, index, target) for index, target in shard]
+            for future in futures:
+                future.result()
+    except Exception as e:
+        import traceback
+        writer.write(RECORD_LOG, NO_TARGET, log_record.encode(log_record.message(
+            f"[予期せぬエラー] ワーカープロセス {os.getpid()}: {e}\n{traceback.format_exc()}")))
+    finally:
+        writer.close()
+        conn.close()
+
+
+# --- 親プロセス側 ---
+def plan_shards(targets, processes):
+    """
+    ターゲットを processes 個に分ける。地域などで並んだ遅いホストが1つのプロセスに
+    偏らないよう、先頭から順に各プロセスへ1台ずつ割り当てる。
+
+    Returns:
+        list: (ターゲットの位置, ターゲット) のリストのリスト。
+    """
+    shards = [[] for _ in range(max(1, processes))]
+    for index, target in enumerate(targets):
+        shards[index % len(shards)].append((index, target))
+    return [shard for shard in shards if shard]
+
+
+def execute_sharded(targets, commands, log_queue, status_queue, cancel_event,
+                    processes=None, max_workers=fleet_executor.DEFAULT_MAX_WORKERS,
+                    host_status_queue=None, pool=None, params=None, dedup_output=False,
+                    **options):
+    """
+    複数ホストに対して同じコマンドリストを、複数のワーカープロセスに分けて並列に実行する。
+    execute_fleet と同じ呼び出し方で使え、ログ・ステータスも同じ形で各キューへ送る。
+    バックグラウンドスレッドで実行されることを想定。
+
+    各ワーカープロセスは割り当てられたホストを execute_fleet と同様にスレッドで並列に
+    実行し、ログ・ステータス・結果を固定長のヘッダーを付けたレコードとしてパイプで送る。
+    親プロセスはレコードをホスト名を設定した log_record.LogRecord やホスト別ステータスに変換する。
+
+    Args:
+        processes (int): ワーカープロセス数。None の場合は CPU 数
+            (ホスト数が少ない場合は MIN_TARGETS_PER_PROCESS 台あたり1プロセスまで減らす)。
+        max_workers (int): 全プロセス合計で同時に処理する最大ホスト数。
+        pool: 接続プールはプロセス間で共有できないため使用しない (execute_fleet との互換用)。
+        dedup_output: execute_fleet と同じ。表示の省略はワーカープロセス内のホストの間で行い、
+            終了時のまとめ (output_dedup.report_groups) は全ホストの結果から作る。
+        その他の引数は execute_fleet と同じ。ターゲットとコマンドリストはワーカープロセスに
+        pickle で渡す (bastion.JumpHost はワーカープロセスごとに作り直される)。
+
+    Returns:
+        dict: execute_fleet と同じ、ホスト表示名をキーとする実行結果の辞書。
+        保存した出力はプロセス間で渡せないため、'outputs' は空、'spool' は None になる。
+        'metrics' は親プロセスで復元し、metrics.add_collector() で登録した関数を親プロセスで呼ぶ。
+    """
+    # multiprocessing は起動時間を抑えるよう使用時に import する
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    if processes is None:
+        processes = min(DEFAULT_MAX_PROCESSES, math.ceil(len(targets) / MIN_TARGETS_PER_PROCESS))
+    shards = plan_shards(targets, processes)
+    per_process = max(1, math.ceil(max_workers / max(1, len(shards))))
+    labels = [fleet_executor.target_label(target) for target in targets]
+    statuses = {}  # ターゲットの位置 -> 最新のステータス
+    details = {}
+    running_reported = False
+
+    status_queue.put(ssh_executor.STATUS_CONNECTING)
+    log_queue.put(f"{len(targets)} 台のホストを {len(shards)} 個のプロセスで実行します "
+                  f"(最大同時実行数: {per_process * len(shards)})")
+
+    # GUIのスレッドを引き継がないよう、ワーカーは新しいインタープリターで起動する
+    context = multiprocessing.get_context('spawn')
+    connections = {}
+    workers = []
+    try:
+        for shard in shards:
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(
+                target=_worker_main, name="ssh-shard",
+                args=(child_conn, shard, commands, per_process, params,
+                      dict(options, dedup_output=bool(dedup_output))), daemon=True)
+            worker.start()
+            child_conn.close()
+            connections[parent_conn] = worker
+            workers.append(worker)
+
+        cancel_sent = False
+        while connections:
+            if cancel_event.is_set() and not cancel_sent:
+                cancel_sent = True
+                for conn in connections:
+                    try:
+                        conn.send_bytes(_CANCEL_MESSAGE)
+                    except OSError:
+                        pass
+            for conn in wait(list(connections), timeout=channel_reader.CANCEL_CHECK_INTERVAL):
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, OSError):
+                    del connections[conn]
+                    conn.close()
+                    continue
+                for kind, index, payload in iter_records(data):
+                    if index == NO_TARGET:
+                        log_queue.put(log_record.decode(payload))
+                        continue
+                    label = labels[index]
+                    if kind == RECORD_LOG:
+                        log_queue.put(log_record.decode(payload, label))
+                    elif kind == RECORD_STATUS:
+                        status = STATUSES[payload[0]]
+                        statuses[index] = status
+                        if host_status_queue is not None:
+                            host_status_queue.put((label, status))
+                        if status == ssh_executor.STATUS_RUNNING and not running_reported:
+                            running_reported = True
+                            status_queue.put(ssh_executor.STATUS_RUNNING)
+                    elif kind == RECORD_RESULT:
+                        details[label] = decode_result(payload)
+                        if details[label]['metrics'] is not None:
+                            metrics.notify_collectors(details[label]['metrics'])
+        for worker in workers:
+            worker.join()
+    except Exception as e:
+        import traceback
+        log_queue.put(f"[予期せぬエラー] {e}\n{traceback.format_exc()}")
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        status_queue.put(ssh_executor.STATUS_ERROR)
+        return details
+
+    # 結果が届かなかったホスト (ワーカープロセスの異常終了など) はエラーとする
+    for index, label in enumerate(labels):
+        if label not in details:
+            statuses[index] = ssh_executor.STATUS_ERROR
+            details[label] = {'status': ssh_executor.STATUS_ERROR, 'exit_codes': {},
+                              'outputs': {}, 'spool': None, 'metrics': None}
+            log_queue.put(log_record.to_record(
+                "[エラー] ワーカープロセスから結果を受け取れませんでした。", label))
+            if host_status_queue is not None:
+                host_status_queue.put((label, ssh_executor.STATUS_ERROR))
+
+    if dedup_output is True:
+        output_dedup.report_groups(details, log_queue)
+    fleet_executor.report_summary(statuses.values(), log_queue, status_queue, cancel_event)
+    return details
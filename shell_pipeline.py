@@ -0,0 +1,279 @@
+# shell_pipeline.py
+import secrets
+import shlex
+import time
+
+import channel_reader
+import log_record
+from line_assembler import LineAssembler
+
+# 一括送信モードでスクリプトを読み込ませるリモートのシェル
+REMOTE_SHELL = "/bin/sh"
+
+
+def build_script(steps, token, stop_on_error=False):
+    """
+    コマンドリストを1本のシェルスクリプトに変換する。
+
+    各コマンドの前後に開始/終了マーカーを stdout と stderr の両方へ出力し、
+    受信側でコマンドごとの出力と終了コードを切り分けられるようにする。
+    コマンドは従来の exec_command と同様にログインシェルの子プロセスとして実行し、
+    標準入力は /dev/null にする (スクリプト自体を読み込ませないため)。
+    stop_on_error=True の場合は、終了コードが0以外のコマンドの後でシェルを終了する。
+
+    Args:
+        steps (list): (コマンドリスト上の位置, コマンド文字列) のリスト。
+        token (str): マーカーの識別に使うランダムな文字列。
+        stop_on_error (bool): 失敗したコマンドの後に続くコマンドを実行しない。
+
+    Returns:
+        str: リモートのシェルに送るスクリプト。
+    """
+    lines = []
+    for position, command in steps:
+        begin = f"printf '%s:B:%d\\n' {token} {position}"
+        end = f"printf '%s:E:%d:%d\\n' {token} {position} $__rc"
+        lines.append(f"{begin}; {begin} >&2")
+        lines.append(
+            f'"${{SHELL:-/bin/sh}}" -c {shlex.quote(command)} </dev/null')
+        lines.append(f"__rc=$?; {end} >&2; {end}")
+        if stop_on_error:
+            lines.append('[ "$__rc" -eq 0 ] || exit 0')
+    lines.append("exit 0")
+    return "\n".join(lines) + "\n"
+
+
+class _Step:
+    """一括送信モードの1コマンド分の状態"""
+
+    __slots__ = ('index', 'cmd_obj', 'skip', 'begun', 'start', 'exit_codes', 'pending',
+                 'capture', 'held')
+
+    def __init__(self, index, cmd_obj, skip_message=None):
+        self.index = index        # コマンドリスト上の位置
+        self.cmd_obj = cmd_obj
+        if skip_message is None and not cmd_obj.get('command'):
+            skip_message = "無効なコマンドオブジェクトです。"
+        self.skip = skip_message  # 実行しない場合はその理由
+        self.begun = False
+        self.start = None
+        self.exit_codes = {}      # stream_name -> 終了コード
+        self.pending = []         # 先行して届いた、まだ表示できないログ
+        self.capture = None       # 出力の保存先 (output_capture.CommandCapture)
+        self.held = None          # 他のホストとの出力の比較 (output_dedup.HeldOutput)
+
+
+class PipelineOutput:
+    """
+    一括送信モードのチャンネル出力を解析する sink。
+
+    マーカーを取り除いた出力をコマンドごとにまとめてログキューへ送り、
+    ログの順序と内容が通常モード (コマンドごとに exec_command) と同じになるようにする。
+    stdout と stderr は別々に届くため、現在のコマンドより先のコマンドの出力は
+    現在のコマンドが終了するまで保留する。
+    """
+
+    def __init__(self, token, commands, log_queue, skip=(), spool=None, captures=None,
+                 dedup=None):
+        self._token = token.encode('ascii')
+        self._steps = [_Step(index, cmd_obj,
+                             "前回の実行で成功済みです。" if index in skip else None)
+                       for index, cmd_obj in enumerate(commands)]
+        if spool is not None:
+            # 通常モードと同様に、各コマンドの出力を保存してログには先頭と末尾だけを表示する
+            for step in self._steps:
+                if not step.skip:
+                    step.capture = spool.new_capture()
+                    if captures is not None:
+                        captures[step.index] = step.capture
+        if dedup is not None:
+            # 出力のハッシュを計算し、表示する行はコマンドの終了まで保留する
+            for step in self._steps:
+                if not step.skip:
+                    step.held = dedup.new_step(step.index)
+        self._captures = captures
+        self._total = len(commands)
+        self._log_queue = log_queue
+        # 出力はバイト列のまま扱い、デコードは表示する側で行う
+        self._assemblers = {'stdout': LineAssembler(raw=True),
+                            'stderr': LineAssembler(raw=True)}
+        self._stream_step = {'stdout': 0, 'stderr': 0}
+        self._current = 0  # まだ終了していない最初のコマンドの位置
+        self.results = {}  # コマンドリスト上の位置 -> (終了コード, 所要時間)
+        self._try_finish()  # 先頭の無効なコマンドのスキップを記録
+
+    @property
+    def finished(self):
+        return self._current >= len(self._steps)
+
+    def feed(self, stream_name, data):
+        for line in self._assemblers[stream_name].feed(data):
+            self._handle_line(stream_name, line)
+
+    def close(self, error=None):
+        for stream_name, assembler in self._assemblers.items():
+            rest = assembler.flush()
+            if rest:
+                self._handle_line(stream_name, rest)
+        # 途中で終了した場合でも保留中のログは全て出力する
+        for step in self._steps[self._current:]:
+            for message in step.pending + (step.held.release() if step.held is not None else []):
+                self._log_queue.put(message)
+            step.pending = []
+        if error is not None:
+            self._log_queue.put(f"[Reader Error] {error}")
+
+    def _output(self, stream_name, line):
+        """コマンドの出力行を保存し、表示する行ならログへ送る"""
+        position = self._stream_step[stream_name]
+        step = None
+        if position < len(self._steps):
+            step = self._steps[position]
+            if step.held is not None:
+                step.held.add_lines(stream_name, [line])
+            if step.capture is not None and not step.capture.add_lines(stream_name, [line], time.time()):
+                return
+            if step.held is not None:
+                for record in step.held.hold([log_record.LogRecord(stream_name, line, step.index)]):
+                    self._emit(position, record)
+                return
+        self._emit(position, log_record.LogRecord(
+            stream_name, line, step.index if step is not None else None))
+
+    def _handle_line(self, stream_name, line):
+        marker_at = line.find(self._token)
+        if marker_at == -1:
+            self._output(stream_name, line)
+            return
+        if marker_at > 0:
+            # 改行で終わらない出力の直後にマーカーが続いた場合
+            self._output(stream_name, line[:marker_at])
+        fields = line[marker_at + len(self._token):].split(b':')
+        try:
+            kind, position = fields[1], int(fields[2])
+            step = self._steps[position]
+        except (IndexError, ValueError):
+            self._output(stream_name, line)
+            return
+        if kind == b'B':
+            self._stream_step[stream_name] = position
+            self._begin(position, step)
+        elif kind == b'E':
+            step.exit_codes[stream_name] = int(fields[3])
+            self._stream_step[stream_name] = position + 1
+            self._try_finish()
+
+    def _begin(self, position, step):
+        if step.begun:
+            return
+        step.begun = True
+        step.start = time.monotonic()
+        command = step.cmd_obj['command']
+        description = step.cmd_obj.get('description', '')
+        log_msg = f"実行中 ({step.index+1}/{self._total}): {command}"
+        if description:
+            log_msg += f" ({description})"
+        self._emit(position, log_record.message(log_msg, step.index), front=True)
+
+    def _emit(self, position, message, front=False):
+        if position == self._current or position >= len(self._steps):
+            self._log_queue.put(message)
+        elif front:
+            self._steps[position].pending.insert(0, message)
+        else:
+            self._steps[position].pending.append(message)
+
+    def _try_finish(self):
+        """stdout と stderr の両方で終了マーカーが揃ったコマンドを順に確定する"""
+        while not self.finished:
+            step = self._steps[self._current]
+            if step.skip:
+                self._log_queue.put(log_record.message(
+                    f"[スキップ] コマンド {step.index+1}: {step.skip}", step.index))
+            elif len(step.exit_codes) < 2:
+                return
+            else:
+                exit_status = step.exit_codes['stdout']
+                duration = time.monotonic() - (step.start or time.monotonic())
+                self.results[step.index] = (exit_status, duration)
+                duplicate = False
+                if step.held is not None:
+                    for message in step.held.finish(step.capture):
+                        self._log_queue.put(message)
+                    duplicate = step.held.duplicate
+                if duplicate and step.capture is not None:
+                    # 他のホストと同じ出力は、最初のホストの保存した出力を共有する
+                    step.capture.discard()
+                    if self._captures is not None and step.held.group['capture'] is not None:
+                        self._captures[step.index] = step.held.group['capture']
+                elif step.capture is not None:
+                    for message in step.capture.finish(step.index):
+                        self._log_queue.put(message)
+                command = step.cmd_obj['command']
+                self._log_queue.put(log_record.message(
+                    f"コマンド '{command[:30]}...' 終了 (終了コード: {exit_status})", step.index))
+                if exit_status != 0:
+                    self._log_queue.put(log_record.message(
+                        f"[エラー] コマンド {step.index+1} はエラーコード {exit_status} で終了しました。",
+                        step.index))
+            self._current += 1
+            if not self.finished:
+                # 次のコマンドで保留していたログを出力
+                following = self._steps[self._current]
+                for message in following.pending:
+                    self._log_queue.put(message)
+                following.pending = []
+
+
+def run_pipelined(open_channel, commands, log_queue, cancel_event, reader, skip=(),
+                  spool=None, captures=None, deadline=None, stop_on_error=False, dedup=None):
+    """
+    コマンドリスト全体を1つのリモートシェルのチャンネルで実行する。
+    コマンドごとのチャンネル開設と終了待ちの往復を省くためのモード。
+    skip に含まれる位置のコマンドは (前回成功済みとして) 実行しない。
+    spool (output_capture.OutputSpool) を渡した場合は各コマンドの出力を保存し、
+    captures にコマンドリスト上の位置をキーとして CommandCapture を格納する。
+    キャンセルされた場合と deadline (time.monotonic() の時刻) を過ぎた場合は
+    チャンネルを閉じてリモートのシェルごと終了させる。
+    dedup (output_dedup.HostDedup) を渡した場合は、コマンドごとに出力を他のホストと比較する
+    (execute_ssh_commands の dedup と同じ)。
+    stop_on_error=True の場合は、失敗したコマンドの後のコマンドを実行しない
+    (completed は False になる)。
+
+    Args:
+        open_channel (callable): 新しいセッションチャンネルを開いて返す関数。
+        commands (list): 実行するコマンドオブジェクトのリスト。
+        log_queue: ログメッセージの送信先キュー。
+        cancel_event (threading.Event): キャンセル通知用イベント。
+        reader (channel_reader.ChannelReader): 出力の読み取りに使うリーダー。
+
+    Returns:
+        tuple: (results, completed)。results はコマンドリスト上の位置をキー、
+        (終了コード, 所要時間[秒]) を値とする辞書。completed は全コマンドが
+        終了まで実行された場合に True。
+    """
+    token = f"__SSHRUN_{secrets.token_hex(8)}__"
+    output = PipelineOutput(token, commands, log_queue, skip, spool, captures, dedup)
+    steps = [(i, cmd_obj['command'])
+             for i, cmd_obj in enumerate(commands)
+             if cmd_obj.get('command') and i not in skip]
+    if not steps:
+        return output.results, True
+    script = build_script(steps, token, stop_on_error)
+
+    channel = open_channel()
+    channel.exec_command(REMOTE_SHELL)
+    read_done = reader.register(channel, output)
+    channel.sendall(script.encode('utf-8'))
+    channel.shutdown_write()  # スクリプトの終端を知らせる
+
+    while not read_done.wait(timeout=channel_reader.CANCEL_CHECK_INTERVAL):
+        if cancel_event.is_set() or (deadline is not None and time.monotonic() >= deadline):
+            # チャンネルを閉じてリモートのシェルごと終了させる
+            reader.close(channel)
+            read_done.wait()
+            break
+    else:
+        channel.close()
+
+    return output.results, output.finished
@@ -0,0 +1,289 @@
+# ssh_auth.py
+# 公開鍵認証 (秘密鍵ファイル・SSHエージェント) と、known_hosts によるホスト鍵の検証
+# paramiko は読み込みに時間がかかるため、接続時に初めて import する
+import base64
+import hashlib
+import hmac
+import os
+import threading
+
+import config_manager
+
+# ホスト鍵の確認方法
+#   strict     : known_hosts に登録されているホスト鍵と一致しない接続を全て拒否する (既定)
+#   accept-new : 未登録のホストは鍵を登録して接続し、登録済みのホストは一致しなければ拒否する
+#                (初回の接続ではなりすましを検出できないため、明示的に選択した場合のみ使う)
+#   off        : 確認しない (従来の動作。セキュリティリスクを理解の上で使用すること)
+POLICY_STRICT = "strict"
+POLICY_ACCEPT_NEW = "accept-new"
+POLICY_OFF = "off"
+HOST_KEY_POLICIES = (POLICY_STRICT, POLICY_ACCEPT_NEW, POLICY_OFF)
+DEFAULT_HOST_KEY_POLICY = POLICY_STRICT
+
+# このアプリが新しいホスト鍵を登録するファイル (設定ファイルと同じフォルダ)
+KNOWN_HOSTS_FILENAME = "known_hosts"
+# 読み取りのみ行う OpenSSH の known_hosts
+SYSTEM_KNOWN_HOSTS = os.path.join("~", ".ssh", "known_hosts")
+# RSA 鍵は known_hosts では ssh-rsa と書かれるが、署名方式ごとに別の名前で交渉する
+_KEY_TYPE_ALGORITHMS = {'ssh-rsa': ('rsa-sha2-512', 'rsa-sha2-256', 'ssh-rsa')}
+
+_key_cache = {}  # 秘密鍵ファイルの絶対パス -> ((mtime_ns, size), paramiko.PKey)
+_key_cache_lock = threading.Lock()
+_known_hosts = {}  # ファイルのパスのタプル -> KnownHosts
+_known_hosts_lock = threading.Lock()
+
+
+def get_known_hosts_path():
+    """このアプリが新しいホスト鍵を登録する known_hosts のパス"""
+    return config_manager.get_config_path().parent / KNOWN_HOSTS_FILENAME
+
+
+# --- 秘密鍵 ---
+def load_private_key(path, passphrase=None):
+    """
+    秘密鍵ファイルを読み込んで paramiko.PKey を返す。
+    一度読み込んだ鍵はプロセス内で保持し、ファイルが変更されていなければ再利用する
+    (多数のホストに接続する場合でも、鍵の解析と復号は1回で済む)。
+
+    Raises:
+        OSError: ファイルを読み込めない場合。
+        paramiko.PasswordRequiredException: パスフレーズが必要な場合。
+        paramiko.SSHException: 鍵の形式が無効な場合、パスフレーズが誤っている場合。
+    """
+    import paramiko
+
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _key_cache_lock:
+        cached = _key_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    key = paramiko.PKey.from_path(path, passphrase.encode('utf-8') if passphrase else None)
+    with _key_cache_lock:
+        _key_cache[path] = (signature, key)
+    return key
+
+
+def authenticate(transport, user, pwd=None, key_files=(), use_agent=False, passphrase=None):
+    """
+    鍵交換済みの Transport で認証する。秘密鍵ファイル (key_files の順) →
+    SSHエージェントの鍵 (use_agent=True の場合) → パスワードの順に試す。
+    秘密鍵もエージェントも使わない場合は、従来どおりパスワード認証のみを行う。
+
+    Returns:
+        str: 認証に成功した方法 ('publickey' / 'agent' / 'password')。
+
+    Raises:
+        paramiko.AuthenticationException: いずれの方法でも認証できなかった場合。
+        paramiko.SSHException: 秘密鍵ファイルを読み込めない場合。
+    """
+    import paramiko
+
+    if not key_files and not use_agent:
+        transport.auth_password(user, pwd)
+        return 'password'
+
+    allowed = None  # サーバーが受け付ける認証方法 (公開鍵認証を受け付けない場合に分かる)
+
+    def try_keys(keys):
+        nonlocal allowed
+        for key in keys:
+            if allowed is not None and 'publickey' not in allowed:
+                return False
+            try:
+                transport.auth_publickey(user, key)
+                return True
+            except paramiko.BadAuthenticationType as e:
+                allowed = e.allowed_types
+            except paramiko.AuthenticationException:
+                continue
+        return False
+
+    keys = []
+    for path in key_files:
+        try:
+            keys.append(load_private_key(path, passphrase))
+        except (OSError, paramiko.SSHException) as e:
+            raise paramiko.SSHException(f"秘密鍵 {path} を読み込めません: {e}") from e
+    if try_keys(keys):
+        return 'publickey'
+    if use_agent:
+        # エージェントへの接続は署名の要求を直列に扱うため、接続ごとに開く
+        agent = paramiko.Agent()
+        try:
+            if try_keys(agent.get_keys()):
+                return 'agent'
+        finally:
+            agent.close()
+    if pwd and (allowed is None or 'password' in allowed):
+        transport.auth_password(user, pwd)
+        return 'password'
+    raise paramiko.AuthenticationException("公開鍵認証に失敗しました。")
+
+
+# --- known_hosts ---
+def host_key_name(host, port):
+    """known_hosts でのホストの書き方 (ポート22以外は "[host]:port")"""
+    return host if int(port) == 22 else f"[{host}]:{port}"
+
+
+class KnownHosts:
+    """
+    known_hosts ファイルの内容を、ホスト名 (host_key_name) をキーとする索引として保持する。
+
+    鍵は base64 を復号したバイト列 (公開鍵のブロブ) のまま保持し、サーバーの鍵の
+    asbytes() と比較する (鍵オブジェクトへの変換は行わない)。ハッシュ化されたホスト名
+    (|1|salt|hash) は最初に問い合わせたときに照合し、結果を索引に追加する。
+    書き込みは最初のファイル (このアプリの known_hosts) に対してのみ行う。
+    """
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(os.path.expanduser(str(path))) for path in paths]
+        self._keys = {}      # ホスト名 -> {鍵の種類: set(ブロブ)}
+        self._hashed = []    # (salt, hash, 鍵の種類, ブロブ)
+        self._resolved = set()  # ハッシュ化された行と照合済みのホスト名
+        self._revoked = set()   # @revoked の鍵のブロブ
+        self._lock = threading.Lock()
+        self.signature = self._signature()
+        for path in self.paths:
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        self._parse_line(line)
+            except FileNotFoundError:
+                continue
+
+    def _signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _parse_line(self, line):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            return
+        marker = None
+        if fields[0].startswith('@'):
+            marker, fields = fields[0], fields[1:]
+        if len(fields) < 3:
+            return
+        names, key_type, key_data = fields[:3]
+        try:
+            blob = base64.b64decode(key_data, validate=True)
+        except ValueError:
+            return
+        if marker == '@revoked':
+            self._revoked.add(blob)
+            return
+        if marker is not None:
+            return  # @cert-authority (証明書) には対応しない
+        for name in names.split(','):
+            if name.startswith('|1|'):
+                try:
+                    salt, digest = (base64.b64decode(part) for part in name[3:].split('|'))
+                except ValueError:
+                    continue
+                self._hashed.append((salt, digest, key_type, blob))
+            elif not name.startswith('!'):
+                self._keys.setdefault(name, {}).setdefault(key_type, set()).add(blob)
+
+    def _lookup(self, name):
+        # ロックを保持した状態で呼び出すこと
+        if name not in self._resolved:
+            self._resolved.add(name)
+            encoded = name.encode('utf-8')
+            for salt, digest, key_type, blob in self._hashed:
+                if hmac.compare_digest(hmac.new(salt, encoded, hashlib.sha1).digest(), digest):
+                    self._keys.setdefault(name, {}).setdefault(key_type, set()).add(blob)
+        return self._keys.get(name, {})
+
+    def key_types(self, host, port):
+        """登録されているホスト鍵の種類のリスト"""
+        with self._lock:
+            return list(self._lookup(host_key_name(host, port)))
+
+    def check(self, host, port, key, policy=DEFAULT_HOST_KEY_POLICY):
+        """
+        サーバーのホスト鍵 (paramiko.PKey) を確認する。policy が accept-new で未登録の
+        ホストの場合は鍵を登録する。
+
+        Returns:
+            bool: 新しく登録した場合は True。
+
+        Raises:
+            paramiko.SSHException: 鍵が一致しない、または (strict で) 未登録の場合。
+        """
+        import paramiko
+
+        if policy == POLICY_OFF:
+            return False
+        name = host_key_name(host, port)
+        key_type, blob = key.get_name(), key.asbytes()
+        fingerprint = key.fingerprint
+        if blob in self._revoked:
+            raise paramiko.SSHException(
+                f"ホスト {name} のホスト鍵 ({key_type} {fingerprint}) は失効しています。")
+        with self._lock:
+            known = self._lookup(name)
+            if blob in known.get(key_type, ()):
+                return False
+            if known:
+                raise paramiko.SSHException(
+                    f"ホスト {name} のホスト鍵が known_hosts に登録されている鍵と一致しません "
+                    f"({key_type} {fingerprint})。ホスト鍵が変更された場合は known_hosts から"
+                    "古い鍵を削除してください。")
+            if policy != POLICY_ACCEPT_NEW:
+                raise paramiko.SSHException(
+                    f"ホスト {name} のホスト鍵が known_hosts に登録されていません "
+                    f"({key_type} {fingerprint})。鍵を確認した上で known_hosts に登録するか、"
+                    f"ホスト鍵の確認方法に {POLICY_ACCEPT_NEW} を指定してください。")
+            self._append(f"{name} {key_type} {base64.b64encode(blob).decode('ascii')}\n")
+            self._keys.setdefault(name, {}).setdefault(key_type, set()).add(blob)
+        return True
+
+    def _append(self, line):
+        # ロックを保持した状態で呼び出すこと
+        path = self.paths[0]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+        # 自分で追記した変更のためにファイル全体を読み直さないよう、記録を更新する
+        self.signature = self._signature()
+
+
+def get_known_hosts(paths=None):
+    """
+    known_hosts を読み込んだ KnownHosts を返す。省略時はこのアプリの known_hosts と
+    ~/.ssh/known_hosts。ファイルが (他のプロセスなどで) 変更されていなければ、
+    前回読み込んだものを返す。
+    """
+    if paths is None:
+        paths = (get_known_hosts_path(), SYSTEM_KNOWN_HOSTS)
+    key = tuple(str(path) for path in paths)
+    with _known_hosts_lock:
+        store = _known_hosts.get(key)
+        if store is None or store.signature != store._signature():
+            store = _known_hosts[key] = KnownHosts(paths)
+        return store
+
+
+def prefer_known_key_types(transport, key_types):
+    """
+    登録済みの種類のホスト鍵をサーバーに要求するよう、ホスト鍵の方式の優先順位を変更する
+    (サーバーが複数の種類の鍵を持つ場合に、未登録の種類の鍵で不一致にならないようにする)。
+    """
+    if not key_types:
+        return
+    options = transport.get_security_options()
+    current = list(options.key_types)
+    preferred = [algorithm for key_type in key_types
+                 for algorithm in _KEY_TYPE_ALGORITHMS.get(key_type, (key_type,))
+                 if algorithm in current]
+    if preferred:
+        options.key_types = preferred + [name for name in current if name not in preferred]
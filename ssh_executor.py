@@ -1,10 +1,23 @@
 # ssh_executor.py
-import paramiko
-import threading
-import queue
+# paramiko は読み込みに時間がかかるため、接続時に初めて import する
+import contextlib
+import json
 import socket
+import threading
 import time
 
+import channel_reader
+import connection_pool
+import file_transfer
+import log_record
+import metrics
+import output_capture
+import run_journal
+import shell_pipeline
+import ssh_auth
+import step_scheduler
+from line_assembler import LineAssembler
+
 # 処理状態を示す定数
 STATUS_CONNECTING = "CONNECTING"
 STATUS_CONNECTED = "CONNECTED"  # Optional status, RUNNING might suffice
@@ -13,146 +26,632 @@ STATUS_DONE = "DONE"
 STATUS_ERROR = "ERROR"
 STATUS_STOPPED = "STOPPED"
 
+# 接続確立 (TCP接続・鍵交換・認証) のタイムアウト (秒)
+CONNECT_TIMEOUT = 15
+# コマンドがタイムアウト (timeout 指定) で打ち切られたときの終了コード (coreutils の timeout と同じ)
+EXIT_TIMEOUT = 124
+
+
+class _Cancelled(Exception):
+    """実行中のコマンドがキャンセルされたことを示す例外"""
 
-def read_stream(stream, stream_name, log_queue, cancel_event):
+
+class _DeadlineExceeded(Exception):
+    """実行全体の制限時間 (run_timeout) を過ぎたことを示す例外"""
+
+
+class _StepStop:
     """
-    SSHチャンネルのストリーム(stdout/stderr)からデータを読み取り、
-    行ごとにデコードしてログキューに追加する関数。
-    バックグラウンドスレッドで実行されることを想定。
+    1ステップ分の停止条件 (キャンセル・ステップのタイムアウト・実行全体の制限時間)。
+    file_transfer には cancel_event の代わりに渡す (is_set() のみを使うため)。
     """
-    try:
-        buffer = b''
-        while not stream.channel.exit_status_ready() or stream.channel.recv_ready() or stream.channel.recv_stderr_ready():
-            # キャンセルイベントをチェック
-            if cancel_event.is_set():
-                break
-
-            chunk = b''
-            # 適切なストリームから読み込む
-            if stream_name == 'stdout' and stream.channel.recv_ready():
-                chunk = stream.channel.recv(4096)  # 読み取りサイズを調整可能
-            elif stream_name == 'stderr' and stream.channel.recv_stderr_ready():
-                chunk = stream.channel.recv_stderr(4096)
-
-            if not chunk:
-                # 終了していて読み取るものがない場合はループを抜ける
-                if stream.channel.exit_status_ready() and not stream.channel.recv_ready() and not stream.channel.recv_stderr_ready():
-                    break
-                # 終了していなくてもデータがない場合は少し待つ (CPU使用率を下げる)
-                time.sleep(0.05)
-                continue
-
-            buffer += chunk
-            # バッファを改行で分割して処理
-            while b'\n' in buffer:
-                line, buffer = buffer.split(b'\n', 1)
-                try:
-                    # デコードしてキューに入れる (エラー時は置換)
-                    log_queue.put(
-                        f"[{stream_name}] {line.decode(errors='replace')}")
-                except UnicodeDecodeError:
-                    log_queue.put(f"[{stream_name}] <デコードエラー>")
-            # ループ後もキャンセルチェック
-            if cancel_event.is_set():
-                break
 
-        # ループ終了後、バッファに残っているデータがあれば処理
-        if buffer:
+    __slots__ = ('cancel_event', 'step_deadline', 'run_deadline')
+
+    def __init__(self, cancel_event, step_timeout=None, run_deadline=None):
+        self.cancel_event = cancel_event
+        self.step_deadline = time.monotonic() + step_timeout if step_timeout else None
+        self.run_deadline = run_deadline
+
+    def reason(self):
+        """停止すべき理由 ('cancel' / 'timeout' / 'deadline') を返す。停止しない場合は None。"""
+        if self.cancel_event.is_set():
+            return 'cancel'
+        now = time.monotonic()
+        if self.run_deadline is not None and now >= self.run_deadline:
+            return 'deadline'
+        if self.step_deadline is not None and now >= self.step_deadline:
+            return 'timeout'
+        return None
+
+    def is_set(self):
+        return self.reason() is not None
+
+    def wait_time(self):
+        """次に停止条件を確認するまでの待ち時間"""
+        wait = channel_reader.CANCEL_CHECK_INTERVAL
+        now = time.monotonic()
+        for deadline in (self.step_deadline, self.run_deadline):
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - now))
+        return wait
+
+
+class _CommandOutput:
+    """
+    ChannelReader から受け取ったコマンド出力を行に分け、log_record.LogRecord
+    (受信したバイト列のまま。デコードは表示する側で行う) としてログキューに追加する sink。
+
+    capture (output_capture.CommandCapture) を渡した場合は全ての行を保存し、
+    ログには先頭と末尾の行だけを表示する。
+    held (output_dedup.HeldOutput) を渡した場合は出力のハッシュを計算し、表示する行を
+    出力の終了まで保留して、他のホストと同じ出力であれば1行のメッセージに置き換える。
+    """
+
+    def __init__(self, log_queue, step, parallel=False, capture=None, held=None):
+        self._log_queue = log_queue
+        self._step = step
+        self._parallel = parallel  # 並列実行時は表示に出力元のコマンド番号を付ける
+        self._capture = capture
+        self._held = held
+        self.first_output = None  # 最初の出力を受け取った時刻 (time.monotonic())
+        self._assemblers = {'stdout': LineAssembler(raw=True),
+                            'stderr': LineAssembler(raw=True)}
+
+    def _put_lines(self, stream_name, lines):
+        timestamp = time.time()  # 同じチャンクの行は同じ時刻にする
+        shown = len(lines)
+        if self._capture is not None:
+            shown = self._capture.add_lines(stream_name, lines, timestamp)
+        records = [log_record.LogRecord(stream_name, line, self._step, None, timestamp, self._parallel)
+                   for line in lines[:shown]]
+        if self._held is not None:
+            self._held.add_lines(stream_name, lines)
+            records = self._held.hold(records)
+        put = self._log_queue.put
+        for record in records:
+            put(record)
+
+    def feed(self, stream_name, data):
+        if self.first_output is None:
+            self.first_output = time.monotonic()
+        lines = self._assemblers[stream_name].feed(data)
+        if lines:
+            self._put_lines(stream_name, lines)
+
+    def close(self, error=None):
+        # 読み取り終了後、改行で終わっていない残りのデータがあれば処理
+        for stream_name, assembler in self._assemblers.items():
+            rest = assembler.flush()
+            if rest:
+                self._put_lines(stream_name, [rest])
+        duplicate = False
+        if self._held is not None:
+            # 他のホストと同じ出力であれば、保留した行の代わりにその旨のメッセージを表示する
+            for message in self._held.finish(self._capture):
+                self._log_queue.put(message)
+            duplicate = self._held.duplicate
+        if duplicate and self._capture is not None:
+            self._capture.discard()
+        elif self._capture is not None:
+            # 表示を省略した行数と末尾の行
+            for message in self._capture.finish(self._step, self._parallel):
+                self._log_queue.put(message)
+        if error is not None:
+            # ストリーム読み取り中の予期せぬエラー
+            self._log_queue.put(f"[Reader Error] {error}")
+
+
+def apply_transport_profile(transport, profile):
+    """
+    転送設定 (config_manager の transport profile) の圧縮・アルゴリズムの設定を
+    開始前の Transport に適用する。
+
+    優先アルゴリズムは指定された順で先頭に並べ、残りは paramiko の既定の順で後ろに続ける
+    (サーバーが対応していない場合でも接続できるようにするため)。
+
+    Returns:
+        list: paramiko が対応していないため無視したアルゴリズム名のリスト。
+    """
+    ignored = []
+    if 'compression' in profile:
+        transport.use_compression(profile['compression'])
+    options = transport.get_security_options()
+    # paramiko の SecurityOptions では MAC は digests という名前
+    for key, attribute in (('ciphers', 'ciphers'), ('macs', 'digests'), ('kex', 'kex')):
+        preferred = profile.get(key)
+        if not preferred:
+            continue
+        current = list(getattr(options, attribute))
+        supported = [name for name in preferred if name in current]
+        ignored.extend(name for name in preferred if name not in current)
+        setattr(options, attribute, supported + [name for name in current if name not in supported])
+    return ignored
+
+
+def _record_kex_name(transport):
+    """
+    鍵交換の開始時に、合意した鍵交換方式の名前を transport.negotiated_kex に記録する。
+    (paramiko は鍵交換の完了後に名前を保持しないため、鍵交換クラスの生成を包む)
+    """
+    def wrap(name, kex_class):
+        def create(t):
+            t.negotiated_kex = name
+            return kex_class(t)
+        return create
+
+    transport.negotiated_kex = None
+    transport._kex_info = {name: wrap(name, kex_class)
+                           for name, kex_class in transport._kex_info.items()}
+
+
+def describe_transport(transport):
+    """接続で実際に使われている鍵交換・暗号・MAC・圧縮方式を文字列で返す"""
+    kex = getattr(transport, 'negotiated_kex', None) or '?'
+    cipher = transport.local_cipher
+    if transport.remote_cipher != cipher:
+        cipher += f"/{transport.remote_cipher}"
+    mac = transport.local_mac
+    if transport.remote_mac != mac:
+        mac += f"/{transport.remote_mac}"
+    return (f"kex={kex}, cipher={cipher}, mac={mac}, "
+            f"compression={transport.local_compression}, hostkey={transport.host_key_type}")
+
+
+def _connect_socket(host, port, timeout, run_metrics):
+    """名前解決と TCP 接続を行う (socket.create_connection と同じ手順で、それぞれの時間を計る)"""
+    span = run_metrics.span if run_metrics is not None else lambda phase: contextlib.nullcontext()
+    with span('dns'):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    error = None
+    with span('tcp'):
+        for family, type_, proto, _, address in addresses:
+            sock = socket.socket(family, type_, proto)
             try:
-                log_queue.put(
-                    f"[{stream_name}] {buffer.decode(errors='replace')}")
-            except UnicodeDecodeError:
-                log_queue.put(f"[{stream_name}] <デコードエラー>")
+                sock.settimeout(timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+    raise error if error is not None else OSError(f"接続先のアドレスが見つかりません: {host}")
 
-    except Exception as e:
-        # ストリーム読み取り中の予期せぬエラー
-        log_queue.put(f"[{stream_name} Reader Error] {e}")
 
+def open_transport(host, port, user, pwd, timeout=CONNECT_TIMEOUT, profile=None,
+                   run_metrics=None, sock=None, key_files=(), use_agent=False, passphrase=None,
+                   host_key_policy=ssh_auth.DEFAULT_HOST_KEY_POLICY):
+    """
+    SSH接続を確立し、認証済みの paramiko.Transport を返す。
+
+    profile に転送設定の辞書を渡した場合は、圧縮・優先アルゴリズム・
+    ウィンドウサイズ・最大パケットサイズを設定してから接続する。
+    run_metrics (metrics.RunMetrics) を渡した場合は、名前解決・TCP接続・
+    鍵交換・認証の各フェーズの時間を記録する。
+    sock を渡した場合 (踏み台経由の接続など) は、名前解決と TCP 接続を行わずにそれを使う。
+    認証は ssh_auth.authenticate() (秘密鍵ファイル → SSHエージェント → パスワード) で行い、
+    ホスト鍵は host_key_policy に従って known_hosts (ssh_auth.get_known_hosts()) で確認する。
+    返す Transport の auth_method に認証方法、host_key_added に known_hosts に
+    新しく登録したかを記録する。
+
+    Raises:
+        paramiko.AuthenticationException: 認証に失敗した場合。
+        paramiko.SSHException: SSHのネゴシエーションに失敗した場合、ホスト鍵が一致しない場合。
+        socket.timeout / socket.error: ネットワークエラーの場合。
+    """
+    import paramiko
+
+    profile = profile or {}
+    sizes = {}
+    if 'window_size' in profile:
+        sizes['default_window_size'] = profile['window_size']
+    if 'max_packet_size' in profile:
+        sizes['default_max_packet_size'] = profile['max_packet_size']
+
+    if sock is None:
+        sock = _connect_socket(host, port, timeout, run_metrics)
+        # チャンネル開設やコマンド実行要求などの小さなパケットを遅延なく送る
+        # (Nagle アルゴリズムと遅延ACKの組み合わせで1往復ごとに約40ms待たされるのを防ぐ)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    transport = None
+    try:
+        transport = paramiko.Transport(sock, **sizes)
+        transport.banner_timeout = timeout
+        transport.auth_timeout = timeout
+        transport.ignored_algorithms = apply_transport_profile(transport, profile)
+        _record_kex_name(transport)
+        known_hosts = None
+        if host_key_policy != ssh_auth.POLICY_OFF:
+            known_hosts = ssh_auth.get_known_hosts()
+            ssh_auth.prefer_known_key_types(transport, known_hosts.key_types(host, port))
+        start = time.monotonic()
+        transport.start_client(timeout=timeout)
+        transport.host_key_added = False
+        if known_hosts is not None:
+            transport.host_key_added = known_hosts.check(
+                host, port, transport.get_remote_server_key(), host_key_policy)
+        kex_done = time.monotonic()
+        transport.auth_method = ssh_auth.authenticate(
+            transport, user, pwd, key_files, use_agent, passphrase)
+        if run_metrics is not None:
+            run_metrics.add('kex', start, kex_done)
+            run_metrics.add('auth', kex_done, time.monotonic())
+    except Exception:
+        if transport is not None:
+            transport.close()
+        sock.close()
+        raise
+    return transport
 
-def execute_ssh_commands(host, port, user, pwd, commands, log_queue, status_queue, cancel_event):
+
+def execute_ssh_commands(host, port, user, pwd, commands, log_queue, status_queue, cancel_event,
+                         pool=None, pipelined=False,
+                         max_parallel_steps=step_scheduler.DEFAULT_MAX_PARALLEL_STEPS,
+                         transport_profile=None, resume=False, journal=True,
+                         capture_output=True, run_metrics=None, run_timeout=None,
+                         stop_on_error=False, jump=None, key_files=(), use_agent=False,
+                         passphrase=None, host_key_policy=ssh_auth.DEFAULT_HOST_KEY_POLICY,
+                         dedup=None):
     """
     SSH接続を行い、コマンドリストを実行するメイン関数。
     バックグラウンドスレッドで実行されることを想定。
+
+    pool (connection_pool.ConnectionPool) を渡した場合は、同じ接続先への
+    認証済みの接続を再利用し、終了後も接続を閉じずにプールへ返却する。
+    pipelined=True の場合は、全コマンドを1つのリモートシェルのチャンネルに
+    まとめて送信する (一括送信モード。shell_pipeline を参照)。
+    コマンドに依存関係 (depends_on) が指定されている場合は、依存関係を満たした
+    コマンドを最大 max_parallel_steps 個まで同じ接続上で並列に実行する。
+    transport_profile には config_manager.get_transport_profile() で取得した
+    転送設定 (圧縮・暗号方式・ウィンドウサイズなど) を指定できる。
+    journal=True の場合はステップごとの結果をホスト単位の実行記録 (run_journal) に残す。
+    resume=True の場合は前回までに成功したステップを実行しない。cache: true を指定した
+    ステップは resume に関係なく、成功済みなら実行しない。
+    capture_output=True の場合、各コマンドの出力は全て一時ファイル (output_capture.OutputSpool)
+    に保存し、ログには先頭と末尾の行だけを表示する。保存した出力は戻り値の 'outputs' から
+    読み出せる。不要になったら戻り値の 'spool' の close() を呼ぶこと。
+    接続とコマンドの各フェーズの所要時間は metrics.RunMetrics に記録し、戻り値の
+    'metrics' で返す (run_metrics を渡した場合はそれに記録する)。終了時には
+    metrics.add_collector() で登録した関数が呼ばれる。
+    コマンドオブジェクトに timeout (秒) が指定されている場合、時間内に終わらなかった
+    コマンドはチャンネルを閉じて打ち切り、終了コード EXIT_TIMEOUT とする。
+    run_timeout (秒) を指定した場合は、実行全体がその時間を過ぎた時点で打ち切ってエラーとする。
+    キャンセル (cancel_event) も実行中のコマンドのチャンネルを閉じて直ちに停止する。
+    stop_on_error=True の場合は、終了コードが0以外のコマンドがあった時点で残りのコマンドを
+    実行せずに中断し、STATUS_ERROR とする。
+    jump (bastion.JumpHost) を渡した場合は、踏み台への共有の接続の上に開いた direct-tcpip
+    チャンネルを経由して接続する。この接続はチャンネル数の枠を使うため、pool には返却しない。
+    key_files (秘密鍵ファイルのパスのリスト) / use_agent (SSHエージェント) を指定した場合は
+    公開鍵認証を先に試し、失敗した場合に pwd があればパスワード認証を行う。秘密鍵は
+    プロセス内で一度だけ読み込む (ssh_auth.load_private_key)。
+    ホスト鍵は host_key_policy (ssh_auth.HOST_KEY_POLICIES) に従って known_hosts で確認する。
+    dedup (output_dedup.HostDedup) を渡した場合は、各コマンドの出力のハッシュを受信しながら
+    計算し、他のホストと同じ出力であれば表示せずに1行のメッセージに置き換える (保存した出力は
+    最初のホストのものを共有する)。その場合、表示する行はコマンドの終了後にまとめてログに送る。
+    ハッシュは戻り値の 'digests' に {コマンドのインデックス: (ハッシュ, 行数)} として返す。
+    log_queue には文字列のメッセージのほか、コマンドの出力とコマンドごとのメッセージを
+    log_record.LogRecord として送る。表示する側で log_record.format_record() で文字列にすること。
+
+    Returns:
+        dict: {'status': 最終ステータス (STATUS_*), 'exit_codes': {コマンドのインデックス: 終了コード},
+               'outputs': {コマンドのインデックス: output_capture.CommandCapture},
+               'spool': output_capture.OutputSpool または None,
+               'metrics': metrics.RunMetrics,
+               'digests': {コマンドのインデックス: (ハッシュ, 行数)} (dedup を渡した場合のみ)}
     """
-    client = None
+    import paramiko
+
+    transport = None
+    pool_key = None
+    reusable = False  # 正常に終了し、プールへ返却してよい接続か
+    reader = channel_reader.get_default_reader()
     current_status = None  # 最後に送信したステータスを追跡
+    exit_codes = {}  # コマンドのインデックス -> 終了コード
+    outputs = {}  # コマンドのインデックス -> 保存した出力
+    spool = None  # 出力の保存先 (capture_output の場合に try の中で作る)
+    if run_metrics is None:
+        run_metrics = metrics.RunMetrics(host, port, user)
+    result = {'status': None, 'exit_codes': exit_codes, 'outputs': outputs, 'spool': spool,
+              'metrics': run_metrics, 'digests': dedup.digests if dedup is not None else {}}
 
     def update_status(new_status):
         nonlocal current_status
         if new_status != current_status:
             status_queue.put(new_status)
             current_status = new_status
+            result['status'] = new_status
+
+    step_journal = run_journal.RunJournal(host, port, user) if journal else None
+    run_deadline = time.monotonic() + run_timeout if run_timeout else None
 
     try:
         update_status(STATUS_CONNECTING)
-        log_queue.put(f"接続試行中: {user}@{host}:{port}...")
+        if capture_output:
+            try:
+                spool = result['spool'] = output_capture.OutputSpool()
+            except OSError as e:
+                log_queue.put(f"[エラー] 出力を保存する一時ファイルを作成できません: {e}")
+                update_status(STATUS_ERROR)
+                return result
+        if jump is not None:
+            log_queue.put(f"接続試行中: {user}@{host}:{port} (踏み台: {jump.label})...")
+            # アイドル状態の接続が踏み台のチャンネル数の枠を使い続けないよう、プールは使わない
+            pool = None
+        else:
+            log_queue.put(f"接続試行中: {user}@{host}:{port}...")
 
-        client = paramiko.SSHClient()
-        # 初回接続時にknown_hostsに自動追加するポリシー。セキュリティリスクを理解の上で使用。
-        # 本番環境では `WarningPolicy` や手動での管理を推奨。
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        profile_name = (transport_profile or {}).get('name')
 
-        # 接続 (タイムアウトを設定)
-        client.connect(hostname=host, port=port,
-                       username=user, password=pwd, timeout=15)
-        log_queue.put("接続成功")
+        def connect():
+            timeout = CONNECT_TIMEOUT
+            if run_deadline is not None:
+                timeout = min(timeout, max(0.1, run_deadline - time.monotonic()))
+            sock = None
+            if jump is not None:
+                stop = _StepStop(cancel_event, None, run_deadline)
+                with run_metrics.span('jump'):
+                    sock = jump.open_socket(host, port, timeout, stop, log_queue)
+                if sock is None:
+                    # 踏み台のチャンネルの空きを待つ間にキャンセルされた、または制限時間を過ぎた
+                    if stop.reason() == 'deadline':
+                        raise _DeadlineExceeded()
+                    raise _Cancelled("キャンセルされました (踏み台の空き待ち中)。")
+            new_transport = open_transport(host, port, user, pwd, timeout=timeout,
+                                           profile=transport_profile, run_metrics=run_metrics,
+                                           sock=sock, key_files=key_files, use_agent=use_agent,
+                                           passphrase=passphrase,
+                                           host_key_policy=host_key_policy)
+            if new_transport.host_key_added:
+                log_queue.put(f"ホスト鍵を known_hosts に登録しました: "
+                              f"{new_transport.get_remote_server_key().get_name()} "
+                              f"{new_transport.get_remote_server_key().fingerprint}")
+            if new_transport.ignored_algorithms:
+                log_queue.put("[警告] 未対応のため無視したアルゴリズム: "
+                              + ", ".join(new_transport.ignored_algorithms))
+            return new_transport
+
+        if pool is not None:
+            # 同じ名前でも内容が変更された転送設定の接続は使い回さない
+            pool_key = connection_pool.make_key(
+                host, port, user, pwd,
+                json.dumps(transport_profile, sort_keys=True) if transport_profile else None,
+                key_files, use_agent)
+            transport, reused = pool.acquire(pool_key, connect)
+        else:
+            transport, reused = connect(), False
+        run_metrics.reused_connection = reused
+        log_queue.put("既存の接続を再利用します" if reused else "接続成功")
+        log_queue.put(f"転送設定: {profile_name or 'default'} ({describe_transport(transport)})")
         update_status(STATUS_RUNNING)  # 接続できたら即実行中ステータスへ
 
-        # コマンドリストの実行
-        for i, cmd_obj in enumerate(commands):
-            command = cmd_obj.get('command')
-            description = cmd_obj.get('description', '')  # 説明があれば取得
+        transport_lock = threading.Lock()
 
-            if not command:
-                log_queue.put(f"[スキップ] コマンド {i+1}: 無効なコマンドオブジェクトです。")
-                continue
+        def open_channel():
+            """コマンド実行用のチャンネルを開く (複数スレッドから呼び出し可)"""
+            nonlocal transport, reused
+            with transport_lock:
+                current, was_reused = transport, reused
+                reused = False
+            try:
+                return current.open_session()
+            except (paramiko.SSHException, EOFError, OSError):
+                if not was_reused:
+                    raise
+                with transport_lock:
+                    if transport is current:
+                        # プールの接続が切れていた場合は一度だけ再接続する
+                        log_queue.put("再利用した接続が切断されていたため再接続します...")
+                        pool.discard(current)
+                        transport = connect()
+                    current = transport
+                return current.open_session()
 
-            # 各コマンド実行前にキャンセルをチェック
-            if cancel_event.is_set():
-                log_queue.put("キャンセルされました (コマンド実行前)。")
-                update_status(STATUS_STOPPED)
-                return
+        def run_step(i, cmd_obj, parallel=False):
+            """コマンドを1つ実行して結果を実行記録に残し、終了コードを返す"""
+            key = run_journal.step_key(i, cmd_obj)
+            if step_journal is not None and (resume or cmd_obj.get('cache')) \
+                    and step_journal.succeeded(key):
+                log_queue.put(log_record.message(
+                    f"[スキップ] コマンド {i+1}: 前回の実行で成功済みです。", i))
+                exit_codes[i] = 0
+                return 0
+            start = time.monotonic()
+            exit_status = execute_step(i, cmd_obj, parallel)
+            exit_codes[i] = exit_status
+            if step_journal is not None:
+                step_journal.record(key, exit_status, time.monotonic() - start,
+                                    cmd_obj.get('cache', False))
+            return exit_status
+
+        def execute_step(i, cmd_obj, parallel=False):
+            """コマンドを1つ実行し、終了コードを返す"""
+            if file_transfer.is_transfer(cmd_obj):
+                command = file_transfer.describe(cmd_obj)
+            else:
+                command = cmd_obj['command']
+            description = cmd_obj.get('description', '')  # 説明があれば取得
 
             log_msg = f"実行中 ({i+1}/{len(commands)}): {command}"
             if description:
                 log_msg += f" ({description})"
-            log_queue.put(log_msg)
+            log_queue.put(log_record.message(log_msg, i))
+
+            stop = _StepStop(cancel_event, cmd_obj.get('timeout'), run_deadline)
+            if file_transfer.is_transfer(cmd_obj):
+                # ファイル転送は同じ接続上のSFTPチャンネルで行う
+                with run_metrics.span('transfer', i):
+                    exit_status = file_transfer.run_transfer(
+                        open_channel, cmd_obj, log_queue, stop, step=i)
+                if exit_status != 0:
+                    reason = stop.reason()
+                    if reason == 'cancel':
+                        raise _Cancelled()
+                    if reason == 'deadline':
+                        raise _DeadlineExceeded()
+                    if reason == 'timeout':
+                        log_queue.put(log_record.message(
+                            f"[タイムアウト] コマンド {i+1} (ファイル転送) は "
+                            f"{cmd_obj['timeout']} 秒以内に終わらなかったため中断しました。", i))
+                        return EXIT_TIMEOUT
+                    log_queue.put(log_record.message(
+                        f"[エラー] コマンド {i+1} (ファイル転送) は失敗しました。", i))
+                return exit_status
 
             # コマンド実行 (PTYは通常スクリプト実行では不要)
-            stdin, stdout, stderr = client.exec_command(command, get_pty=False)
+            with run_metrics.span('channel_open', i):
+                channel = open_channel()
+            exec_start = time.monotonic()
+            channel.exec_command(command)
 
-            # stdoutとstderrを読み取るためのスレッドを開始
-            stdout_thread = threading.Thread(target=read_stream, args=(
-                stdout, 'stdout', log_queue, cancel_event), daemon=True)
-            stderr_thread = threading.Thread(target=read_stream, args=(
-                stderr, 'stderr', log_queue, cancel_event), daemon=True)
-            stdout_thread.start()
-            stderr_thread.start()
+            # stdoutとstderrの読み取りを共有の読み取りスレッドに登録
+            capture = None
+            if spool is not None:
+                capture = outputs[i] = spool.new_capture()
+            held = dedup.new_step(i) if dedup is not None else None
+            output = _CommandOutput(log_queue, i, parallel, capture, held)
+            read_done = reader.register(channel, output)
 
-            # コマンドの終了を待つ (これが完了するまでブロッキング)
-            exit_status = stdout.channel.recv_exit_status()
+            # コマンドの終了を待つ。キャンセルとタイムアウトは一定間隔で確認し、
+            # 該当した場合はチャンネルを閉じてリモートのコマンドを終了させる
+            while not channel.status_event.wait(stop.wait_time()):
+                reason = stop.reason()
+                if reason is None:
+                    continue
+                reader.close(channel)
+                read_done.wait(timeout=2)
+                run_metrics.add('command', exec_start, time.monotonic(), i)
+                if reason == 'cancel':
+                    raise _Cancelled()
+                if reason == 'deadline':
+                    raise _DeadlineExceeded()
+                log_queue.put(log_record.message(
+                    f"[タイムアウト] コマンド {i+1} は {cmd_obj['timeout']} 秒以内に"
+                    "終わらなかったため打ち切りました。", i))
+                return EXIT_TIMEOUT
+            exit_status = channel.recv_exit_status()
+            run_metrics.add('command', exec_start, time.monotonic(), i)
 
-            # ストリームリーダーが残りのデータを処理し終えるのを待つ (短いタイムアウト)
-            stdout_thread.join(timeout=2)
-            stderr_thread.join(timeout=2)
+            # 読み取りスレッドが残りのデータを処理し終えるのを待つ (短いタイムアウト)
+            if read_done.wait(timeout=2):
+                # 登録解除済みなのでチャンネルと通知用パイプを閉じてよい
+                channel.close()
+            if held is not None and held.duplicate and held.group['capture'] is not None:
+                # 他のホストと同じ出力は、最初のホストの保存した出力を共有する
+                outputs[i] = held.group['capture']
+            if output.first_output is not None:
+                run_metrics.add('ttfb', exec_start, output.first_output, i)
 
-            log_queue.put(
-                f"コマンド '{command[:30]}...' 終了 (終了コード: {exit_status})")
+            log_queue.put(log_record.message(
+                f"コマンド '{command[:30]}...' 終了 (終了コード: {exit_status})", i))
 
             if exit_status != 0:
-                log_queue.put(
-                    f"[エラー] コマンド {i+1} はエラーコード {exit_status} で終了しました。")
-                # ====[オプション] エラー発生時に処理を中断する場合 =====
-                # log_queue.put("エラーのため処理を中断します。")
-                # update_status(STATUS_ERROR)
-                # return # ここで関数を抜ける
-                # =====================================================
-
-        # ループが正常に完了した場合 (キャンセルされなかった場合)
-        if not cancel_event.is_set():
-            log_queue.put("全てのコマンドが正常に完了しました。")
-            update_status(STATUS_DONE)
+                log_queue.put(log_record.message(
+                    f"[エラー] コマンド {i+1} はエラーコード {exit_status} で終了しました。", i))
+            return exit_status
+
+        has_dependencies = getattr(commands, 'has_dependencies', False)
+        if pipelined and has_dependencies:
+            log_queue.put("依存関係が指定されているため、一括送信モードは使用しません。")
+            pipelined = False
+        if pipelined and getattr(commands, 'has_transfers', False):
+            log_queue.put("ファイル転送が含まれているため、一括送信モードは使用しません。")
+            pipelined = False
+        if pipelined and getattr(commands, 'has_timeouts', False):
+            log_queue.put("タイムアウトが指定されているため、一括送信モードは使用しません。")
+            pipelined = False
 
+        if has_dependencies:
+            # 依存関係を満たしたコマンドから並列に実行
+            step_scheduler.run_dependency_graph(
+                commands,
+                lambda i, cmd_obj: run_step(i, cmd_obj, max_parallel_steps > 1),
+                log_queue, cancel_event, max_parallel_steps, stop_on_error)
+            if cancel_event.is_set():
+                log_queue.put("キャンセルされました。")
+                update_status(STATUS_STOPPED)
+                return result
+            if stop_on_error and any(exit_codes.values()):
+                log_queue.put("エラーのため処理を中断しました。")
+                update_status(STATUS_ERROR)
+                reusable = True
+                return result
+        elif pipelined:
+            # 一括送信モード: コマンドリスト全体を1つのシェルチャンネルで実行
+            skip = set()
+            if step_journal is not None:
+                skip = {i for i, cmd_obj in enumerate(commands)
+                        if (resume or cmd_obj.get('cache')) and cmd_obj.get('command')
+                        and step_journal.succeeded(run_journal.step_key(i, cmd_obj))}
+            pipeline_results, completed = shell_pipeline.run_pipelined(
+                open_channel, commands, log_queue, cancel_event, reader, skip,
+                spool, outputs, run_deadline, stop_on_error, dedup)
+            for i in skip:
+                exit_codes[i] = 0
+            now = time.monotonic()
+            for i, (exit_status, duration) in pipeline_results.items():
+                exit_codes[i] = exit_status
+                # 一括送信モードではコマンドごとの所要時間のみ記録する (終了時刻は集計時点で近似)
+                run_metrics.add('command', now - duration, now, i)
+                if step_journal is not None:
+                    step_journal.record(run_journal.step_key(i, commands[i]), exit_status,
+                                        duration, commands[i].get('cache', False))
+            if not completed:
+                if run_deadline is not None and time.monotonic() >= run_deadline:
+                    raise _DeadlineExceeded()
+                if stop_on_error and any(exit_codes.values()):
+                    log_queue.put("エラーのため処理を中断しました。")
+                    update_status(STATUS_ERROR)
+                    reusable = True
+                    return result
+                if cancel_event.is_set():
+                    log_queue.put("キャンセルされました (一括実行中)。")
+                    update_status(STATUS_STOPPED)
+                else:
+                    log_queue.put("[エラー] 一括実行のシェルが途中で終了しました。")
+                    update_status(STATUS_ERROR)
+                return result
+        else:
+            # コマンドリストの実行
+            for i, cmd_obj in enumerate(commands):
+                if not cmd_obj.get('command') and not file_transfer.is_transfer(cmd_obj):
+                    log_queue.put(f"[スキップ] コマンド {i+1}: 無効なコマンドオブジェクトです。")
+                    continue
+
+                # 各コマンド実行前にキャンセルをチェック
+                if cancel_event.is_set():
+                    log_queue.put("キャンセルされました (コマンド実行前)。")
+                    update_status(STATUS_STOPPED)
+                    return result
+
+                if run_deadline is not None and time.monotonic() >= run_deadline:
+                    raise _DeadlineExceeded()
+
+                exit_status = run_step(i, cmd_obj)
+                if exit_status != 0 and stop_on_error:
+                    # エラー発生時に残りのコマンドを実行せずに中断する
+                    log_queue.put("エラーのため処理を中断します。")
+                    update_status(STATUS_ERROR)
+                    reusable = True  # コマンドの失敗であり、接続は再利用できる
+                    return result
+
+        # 全てのコマンドを実行し終えた場合 (最後のコマンドの終了後にキャンセルされた場合を含む)
+        log_queue.put("全てのコマンドが正常に完了しました。")
+        update_status(STATUS_DONE)
+        reusable = True
+        valid_steps = sum(1 for cmd_obj in commands
+                          if cmd_obj.get('command') or file_transfer.is_transfer(cmd_obj))
+        if step_journal is not None and len(exit_codes) == valid_steps \
+                and not any(exit_codes.values()):
+            # 全ステップが成功したので、再開用の記録は不要 (cache の記録は残す)
+            step_journal.finish_run()
+
+    except _Cancelled as e:
+        # 実行中のコマンドのチャンネルは閉じ済みで、接続自体は再利用できる
+        log_queue.put(str(e) or "キャンセルされました (コマンド実行中)。")
+        update_status(STATUS_STOPPED)
+        reusable = True
+    except _DeadlineExceeded:
+        log_queue.put(f"[タイムアウト] 実行全体の制限時間 ({run_timeout} 秒) を過ぎたため中断しました。")
+        update_status(STATUS_ERROR)
     except paramiko.AuthenticationException:
         log_queue.put("[エラー] 認証に失敗しました。ユーザー名またはパスワードを確認してください。")
         update_status(STATUS_ERROR)
@@ -172,13 +671,22 @@ def execute_ssh_commands(host, port, user, pwd, commands, log_queue, status_queu
         log_queue.put(f"[予期せぬエラー] {e}\n{traceback.format_exc()}")
         update_status(STATUS_ERROR)
     finally:
-        # 接続を確実に閉じる
-        if client:
+        if transport and pool is not None and reusable:
+            # 次回の実行で再利用できるようにプールへ返却
+            pool.release(pool_key, transport)
+            log_queue.put("接続をプールに返却しました。")
+        elif transport:
+            # 接続を確実に閉じる
             try:
-                client.close()
+                transport.close()
                 log_queue.put("接続を閉じました。")
             except Exception as e:
                 log_queue.put(f"[エラー] 接続終了時にエラーが発生しました: {e}")
+        if spool is not None:
+            # 結果を保持している間ファイル記述子を使い続けないよう、書き込み用のファイルを閉じる
+            spool.release()
         # 最終ステータスが設定されていない場合（途中で抜けたなど）にエラーを設定
         if current_status not in [STATUS_DONE, STATUS_ERROR, STATUS_STOPPED]:
             update_status(STATUS_ERROR)  # 不明な理由で終わった場合はエラー扱い
+        run_metrics.finish(current_status, exit_codes)
+    return result
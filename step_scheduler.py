@@ -0,0 +1,82 @@
+# step_scheduler.py
+import heapq
+
+# 1ホスト内で同時に実行するコマンド数のデフォルト値
+DEFAULT_MAX_PARALLEL_STEPS = 4
+
+
+def run_dependency_graph(commands, run_step, log_queue, cancel_event,
+                         max_parallel=DEFAULT_MAX_PARALLEL_STEPS, stop_on_error=False):
+    """
+    依存関係 (depends_on) を満たしたコマンドから順に、同じ接続上の
+    複数のチャンネルで並列に実行する。
+
+    依存先のコマンドが失敗 (終了コードが0以外) またはスキップされた場合、
+    そのコマンドは実行せずにスキップする。依存関係のないコマンドは引き続き実行する。
+    stop_on_error=True の場合は、いずれかのコマンドが失敗した時点で新しいコマンドを
+    開始せず、実行中のコマンドの終了を待って戻る。
+
+    Args:
+        commands (json_loader.CommandList): 依存関係を解析済みのコマンドリスト。
+        run_step (callable): run_step(index, cmd_obj) でコマンドを1つ実行し、
+            終了コードを返す関数。複数のスレッドから同時に呼ばれる。
+        log_queue: ログメッセージの送信先キュー。
+        cancel_event (threading.Event): キャンセル通知用イベント。
+        max_parallel (int): 同時に実行する最大コマンド数。
+        stop_on_error (bool): 失敗したコマンドがあれば残りのコマンドを開始しない。
+
+    Returns:
+        dict: 実行したコマンドのインデックスをキー、終了コードを値とする辞書。
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    rank = {index: position for position, index in enumerate(commands.order)}
+    remaining = [set(deps) for deps in commands.dependencies]
+    dependents = [[] for _ in commands]
+    for index, deps in enumerate(commands.dependencies):
+        for dep in deps:
+            dependents[dep].append(index)
+
+    ready = [(rank[i], i) for i, deps in enumerate(remaining) if not deps]
+    heapq.heapify(ready)
+    skipped = set()
+    results = {}
+
+    def skip_dependents(failed_index):
+        # 失敗したコマンドに(間接的に)依存するコマンドを全てスキップする
+        stack = [failed_index]
+        while stack:
+            current = stack.pop()
+            for dependent in dependents[current]:
+                if dependent in skipped:
+                    continue
+                skipped.add(dependent)
+                log_queue.put(
+                    f"[スキップ] コマンド {dependent+1}: 依存するコマンド {current+1} が成功しなかったため実行しません。")
+                stack.append(dependent)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel),
+                            thread_name_prefix="ssh-step") as executor:
+        running = {}
+        failed = False
+        while ready or running:
+            while ready and len(running) < max(1, max_parallel) and not cancel_event.is_set() \
+                    and not failed:
+                _, index = heapq.heappop(ready)
+                running[executor.submit(run_step, index, commands[index])] = index
+            if not running:
+                break  # キャンセル (またはエラーで中断) されたため新しいコマンドは開始しない
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                exit_status = future.result()  # 接続エラーなどはそのまま呼び出し元へ送出
+                results[index] = exit_status
+                if exit_status != 0:
+                    failed = failed or stop_on_error
+                    skip_dependents(index)
+                    continue
+                for dependent in dependents[index]:
+                    remaining[dependent].discard(index)
+                    if not remaining[dependent] and dependent not in skipped:
+                        heapq.heappush(ready, (rank[dependent], dependent))
+    return results
@@ -0,0 +1,75 @@
+# test_inventory.py
+# インベントリの選択式と変数の解決のテスト
+#
+# 使い方:
+#     python -m unittest discover test
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inventory  # noqa: E402
+
+DATA = {
+    "vars": {"user": "pi"},
+    "groups": {
+        "factory": {"children": ["line1", "line2"], "vars": {"transport_profile": "lan"}},
+        "line1": {"hosts": ["board-001", "board-002"]},
+        "line2": {"hosts": ["board-101"], "vars": {"port": 2222}},
+    },
+    "hosts": {
+        "board-001": {"address": "10.0.0.1", "tags": ["arm64", "rack1"]},
+        "board-002": {"address": "10.0.0.2", "tags": ["arm64"]},
+        "board-101": {"address": "10.0.1.1", "tags": ["x86"], "vars": {"site": "osaka"}},
+        "spare": {"groups": ["line2"]},
+    },
+}
+
+
+class SelectTest(unittest.TestCase):
+
+    def test_expressions(self):
+        inv = inventory.Inventory(DATA)
+        self.assertEqual(inv.select("board-0*"), ["board-001", "board-002"])
+        self.assertEqual(inv.select("tag:arm64, !board-002"), ["board-001"])
+        self.assertEqual(inv.select("group:factory, &tag:x86"), ["board-101"])
+        self.assertEqual(inv.select("group:line2"), ["board-101", "spare"])
+        self.assertEqual(inv.select("!group:factory"), [])
+        self.assertEqual(inv.groups, ["factory", "line1", "line2"])
+
+    def test_indexes_are_built_on_demand(self):
+        inv = inventory.Inventory(DATA)
+        inv.select("board-1*")
+        self.assertIsNone(inv._tags)
+        self.assertIsNone(inv._groups)
+        inv.select("tag:x86")
+        self.assertIsNotNone(inv._tags)
+        self.assertIsNone(inv._groups)
+
+    def test_host_vars(self):
+        inv = inventory.Inventory(DATA)
+        self.assertEqual(inv.host_vars("board-101"), {
+            "user": "pi", "transport_profile": "lan", "port": 2222,
+            "site": "osaka", "address": "10.0.1.1"})
+        # ホストの groups で指定した所属も親グループの変数を引き継ぐ
+        self.assertEqual(inv.host_vars("spare"), {"user": "pi", "transport_profile": "lan", "port": 2222})
+        # 変数の解決ではホスト全体の索引を作らない
+        self.assertIsNone(inv._groups)
+
+    def test_invalid_definitions(self):
+        cycle = inventory.Inventory({"hosts": {"a": {"groups": ["x"]}},
+                                     "groups": {"x": {"children": ["y"]}, "y": {"children": ["x"]}}})
+        with self.assertRaises(ValueError):
+            cycle.select("group:x")
+        with self.assertRaises(ValueError):
+            cycle.host_vars("a")
+        bad_port = inventory.Inventory({"hosts": {"a": {"port": "22"}}})
+        with self.assertRaises(ValueError):
+            bad_port.host_vars("a")
+        with self.assertRaises(ValueError):
+            inventory.Inventory({"hosts": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
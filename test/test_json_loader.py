@@ -0,0 +1,64 @@
+# test_json_loader.py
+# コマンドファイルの読み込みとテンプレートの解析のテスト
+#
+# 使い方:
+#     python -m unittest discover test
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_loader  # noqa: E402
+
+
+class LoadCommandsTest(unittest.TestCase):
+
+    def load(self, commands):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(commands, f, ensure_ascii=False)
+        return json_loader.load_commands_from_json(path)
+
+    def test_sample_file(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.json")
+        commands = json_loader.load_commands_from_json(path)
+        self.assertEqual([c['command'] for c in commands], ["date", "date"])
+        self.assertFalse(commands.has_templates)
+
+    def test_go_template_is_kept_as_text(self):
+        # 変数の形式でない "{{" は展開せず、そのまま送信する
+        source = [
+            {"command": "docker ps --format '{{.Names}}'", "description": "コンテナ一覧"},
+            {"command": "docker inspect -f '{{ .State.Running }}' web"},
+            {"command": "kubectl get pods -o go-template='{{range .items}}{{.metadata.name}}{{end}}'"},
+        ]
+        commands = self.load(source)
+        self.assertFalse(commands.has_templates)
+        self.assertEqual(commands.variables, frozenset())
+        self.assertEqual(list(commands.render({})), source)
+
+    def test_go_template_with_variables(self):
+        commands = self.load([
+            {"command": "docker inspect -f '{{ .State.Running }}' {{ name }}"},
+            {"command": "docker ps --filter name={{ name|quote }} --format '{{.ID}}'"},
+            {"command": "echo \\{{ name }}"},
+        ])
+        self.assertEqual(commands.variables, frozenset({'name'}))
+        rendered = commands.render({'name': "web 1"})
+        self.assertEqual([c['command'] for c in rendered], [
+            "docker inspect -f '{{ .State.Running }}' web 1",
+            "docker ps --filter name='web 1' --format '{{.ID}}'",
+            "echo {{ name }}",
+        ])
+
+    def test_unknown_filter(self):
+        with self.assertRaises(ValueError):
+            self.load([{"command": "echo {{ name|upper }}"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# test_log_record.py
+# 実行ログファイルの書き込みと読み込みのテスト
+#
+# 使い方:
+#     python -m unittest discover test
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_record  # noqa: E402
+
+
+class RunLogTest(unittest.TestCase):
+
+    def write_and_read(self, suffix):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "run" + suffix)
+        with log_record.RunLogWriter(path) as writer:
+            writer.write("開始")
+            writer.write(log_record.message("コマンド 1", 0))
+            writer.write(log_record.LogRecord(log_record.STREAM_STDOUT, b"out", 0, "web-01", None, True))
+            writer.write(log_record.LogRecord(log_record.STREAM_STDERR, b"err", 1, "web-02"))
+        return list(log_record.read_run_log(path))
+
+    def check_round_trip(self, records):
+        self.assertEqual([log_record.format_record(r) for r in records],
+                         ["開始", "コマンド 1", "[web-01] [#1 stdout] out", "[web-02] [stderr] err"])
+        self.assertEqual([r.parallel for r in records], [False, False, True, False])
+        self.assertEqual(records[2].data, b"out")
+
+    def test_jsonl_keeps_parallel(self):
+        self.check_round_trip(self.write_and_read(".jsonl"))
+
+    def test_binary_keeps_parallel(self):
+        self.check_round_trip(self.write_and_read(".sshlog"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# test_rollout.py
+# 段階実行の台数の指定とバッチの分け方のテスト
+#
+# 使い方:
+#     python -m unittest discover test
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rollout  # noqa: E402
+
+
+class ParseAmountTest(unittest.TestCase):
+
+    def test_integer(self):
+        self.assertEqual(rollout.parse_amount("5", 100), 5)
+        self.assertEqual(rollout.parse_amount(0, 100), 0)
+
+    def test_percent_is_rounded_up(self):
+        self.assertEqual(rollout.parse_amount("25%", 8), 2)
+        self.assertEqual(rollout.parse_amount("10%", 7), 1)
+        self.assertEqual(rollout.parse_amount("0%", 7), 0)
+        self.assertEqual(rollout.parse_amount("100%", 7), 7)
+
+    def test_fractional_percent(self):
+        # 33.4% of 3 = 1.002 台 -> 2 台
+        self.assertEqual(rollout.parse_amount("33.4%", 3), 2)
+        self.assertEqual(rollout.parse_amount("0.5%", 200), 1)
+        # 浮動小数点の誤差で切り上げすぎない (28.6% of 1000 = 286 台)
+        self.assertEqual(rollout.parse_amount("28.6%", 1000), 286)
+        self.assertEqual(rollout.parse_amount("64.4%", 250), 161)
+
+    def test_invalid(self):
+        for value in ("-1", "101%", "-5%", "abc", "nan%", "1.5"):
+            with self.assertRaises(ValueError):
+                rollout.parse_amount(value, 10)
+
+
+class PlanBatchesTest(unittest.TestCase):
+
+    def test_canary_and_batches(self):
+        batches = rollout.plan_batches(list(range(7)), canary=1, batch_size=3)
+        self.assertEqual(batches, [[0], [1, 2, 3], [4, 5, 6]])
+
+    def test_rest_in_one_batch(self):
+        self.assertEqual(rollout.plan_batches(list(range(4)), canary=2), [[0, 1], [2, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# test_ssh_auth.py
+# known_hosts によるホスト鍵の確認のテスト
+#
+# 使い方:
+#     python -m unittest discover test
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paramiko  # noqa: E402
+
+import cli  # noqa: E402
+import ssh_auth  # noqa: E402
+
+
+class HostKeyPolicyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = paramiko.RSAKey.generate(1024)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "known_hosts")
+
+    def test_default_is_strict(self):
+        self.assertEqual(ssh_auth.DEFAULT_HOST_KEY_POLICY, ssh_auth.POLICY_STRICT)
+        args = cli.build_parser().parse_args(["commands.json"])
+        self.assertEqual(args.host_key_policy, ssh_auth.POLICY_STRICT)
+
+    def test_unknown_host_is_rejected_by_default(self):
+        known_hosts = ssh_auth.KnownHosts([self.path])
+        with self.assertRaises(paramiko.SSHException):
+            known_hosts.check("10.0.0.1", 22, self.key)
+        # 拒否したホストの鍵は登録しない
+        self.assertFalse(os.path.exists(self.path))
+        with self.assertRaises(paramiko.SSHException):
+            ssh_auth.KnownHosts([self.path]).check("10.0.0.1", 22, self.key)
+
+    def test_accept_new_registers_key(self):
+        known_hosts = ssh_auth.KnownHosts([self.path])
+        self.assertTrue(known_hosts.check("10.0.0.1", 2222, self.key, ssh_auth.POLICY_ACCEPT_NEW))
+        # 登録した鍵は strict でも一致する
+        reloaded = ssh_auth.KnownHosts([self.path])
+        self.assertFalse(reloaded.check("10.0.0.1", 2222, self.key))
+        other = paramiko.RSAKey.generate(1024)
+        with self.assertRaises(paramiko.SSHException):
+            reloaded.check("10.0.0.1", 2222, other, ssh_auth.POLICY_ACCEPT_NEW)
+
+
+if __name__ == '__main__':
+    unittest.main()